@@ -0,0 +1,317 @@
+import asyncio
+import json
+import math
+import re
+import sqlite3
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from context_builder import truncate_to_tokens
+from utils import estimate_tokens
+
+# Words too common in chat to say anything about relevance
+STOPWORDS = frozenset(
+    "a an and are as at be but by can could did do does for from had has have he her him his how "
+    "i if in is it its just me my no not of on or our she so than that the their them then there "
+    "they this to too up us was we were what when where which who why will with would you your "
+    "yes ok okay lol".split()
+)
+
+_WORD = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens worth indexing (no stopwords or single characters)."""
+    return [word for word in _WORD.findall(text.casefold()) if len(word) > 1 and word not in STOPWORDS]
+
+def format_recalled(messages: List[Dict[str, Any]], max_tokens: int,
+                    count_tokens: Callable[[str], int] = estimate_tokens) -> Optional[str]:
+    """Prompt section with recalled messages: best matches first until max_tokens, shown in chat order."""
+    header = "RELEVANT OLDER MESSAGES (retrieved from earlier in this chat):"
+    used = count_tokens(header)
+    picked = []
+    for message_data in messages:
+        text = truncate_to_tokens(message_data.get('message') or "", max(1, max_tokens // 3), count_tokens)
+        line = f"[{str(message_data.get('timestamp', ''))[:16]}] {message_data.get('username', '')}: {text}"
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        picked.append((message_data.get('message_id') or 0, line))
+        used += cost
+    if not picked:
+        return None
+    picked.sort()
+    return header + "\n" + "\n".join(line for _, line in picked)
+
+class MessageArchive:
+    """Per-group on-disk inverted index over messages that left the recent window.
+
+    Each group gets a SQLite file (`<archive_dir>/<group_id>.db`) with its messages, a term
+    table with document frequencies and a (term, message) postings table, all updated
+    incrementally. `search()` scores candidates with BM25, reading at most `max_postings`
+    (newest) postings per term and skipping terms found in more than `max_df_share` of a
+    large archive's messages, so a lookup costs a few indexed reads however large the
+    group's archive is.
+
+    Writes are buffered and committed in batches by a background task; all SQLite work runs
+    on one dedicated thread.
+    """
+
+    def __init__(self, archive_dir: str = "./memory/archive", max_open_groups: int = 64,
+                 max_terms: int = 8, max_postings: int = 100, max_df_share: float = 0.05,
+                 flush_interval: float = 1.0, max_pending_messages: int = 10000,
+                 k1: float = 1.2, b: float = 0.75):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.max_open_groups = max_open_groups
+        self.max_terms = max_terms
+        self.max_postings = max_postings
+        self.max_df_share = max_df_share
+        self.flush_interval = flush_interval
+        self.max_pending_messages = max_pending_messages
+        self.k1 = k1
+        self.b = b
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-archive")
+        # Open connections with each group's [documents, total length], least recent first
+        self._groups: "OrderedDict[str, Tuple[sqlite3.Connection, List[int]]]" = OrderedDict()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_count = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        self.archived = 0
+        self.dropped = 0
+        self.searches = 0
+
+    def _get_file_path(self, group_id: str) -> Path:
+        return self.archive_dir / f"{group_id}.db"
+
+    def _open(self, group_id: str) -> Tuple[sqlite3.Connection, List[int]]:
+        """Get a group's connection and counters, opening (and creating) its database. Archive thread only."""
+        group = self._groups.get(group_id)
+        if group is not None:
+            self._groups.move_to_end(group_id)
+            return group
+
+        conn = sqlite3.connect(str(self._get_file_path(group_id)), check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id INTEGER PRIMARY KEY,
+                length INTEGER NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS terms (
+                id INTEGER PRIMARY KEY,
+                term TEXT NOT NULL UNIQUE,
+                df INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (term_id, message_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        group = (conn, [meta.get("documents", 0), meta.get("total_length", 0)])
+        self._groups[group_id] = group
+        while len(self._groups) > self.max_open_groups:
+            _, (old_conn, _) = self._groups.popitem(last=False)
+            old_conn.close()
+        return group
+
+    def _write_sync(self, batch: Dict[str, List[Dict[str, Any]]]):
+        for group_id, messages in batch.items():
+            conn, counters = self._open(group_id)
+            documents, total_length = counters
+            with conn:
+                for message_data in messages:
+                    message_id = message_data.get('message_id')
+                    if message_id is None:
+                        continue
+                    words = tokenize(message_data.get('message') or "")
+                    username = (message_data.get('username') or "").casefold()
+                    if username:
+                        words.append(username)
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO messages (message_id, length, data) VALUES (?, ?, ?)",
+                        (message_id, len(words), json.dumps(message_data, ensure_ascii=False))
+                    )
+                    if cursor.rowcount != 1:
+                        continue  # Archived before
+                    counts = Counter(words)
+                    conn.executemany(
+                        "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                        [(term,) for term in counts]
+                    )
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO postings (term_id, message_id, tf, length) "
+                        "SELECT id, ?, ?, ? FROM terms WHERE term = ?",
+                        [(message_id, tf, len(words), term) for term, tf in counts.items()]
+                    )
+                    documents += 1
+                    total_length += len(words)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("documents", documents), ("total_length", total_length)]
+                )
+            counters[0], counters[1] = documents, total_length
+
+    def _search_sync(self, group_id: str, terms: List[str], limit: int) -> List[Dict[str, Any]]:
+        if not self._get_file_path(group_id).exists():
+            return []
+        conn, (documents, total_length) = self._open(group_id)
+        if not documents:
+            return []
+
+        rows = conn.execute(
+            f"SELECT id, df FROM terms WHERE term IN ({','.join('?' * len(terms))})", terms
+        ).fetchall()
+        # Rarest terms first; very common ones barely move BM25 but cost the most to score
+        max_df = max(self.max_df_share * documents, self.max_postings)
+        rows = sorted((row for row in rows if row[1] <= max_df), key=lambda row: row[1])[:self.max_terms]
+
+        average_length = total_length / documents or 1
+        scores: Dict[int, float] = {}
+        for term_id, df in rows:
+            idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+            postings = conn.execute(
+                "SELECT message_id, tf, length FROM postings WHERE term_id = ? "
+                "ORDER BY message_id DESC LIMIT ?",
+                (term_id, self.max_postings)
+            )
+            for message_id, tf, length in postings:
+                norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[message_id] = scores.get(message_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        # A few spare candidates, so repeated texts can be skipped
+        best = sorted(scores, key=lambda message_id: (scores[message_id], message_id), reverse=True)[:limit * 2]
+        if not best:
+            return []
+        data = dict(conn.execute(
+            f"SELECT message_id, data FROM messages WHERE message_id IN ({','.join('?' * len(best))})", best
+        ).fetchall())
+        results = []
+        seen = set()
+        for message_id in best:
+            if message_id not in data:
+                continue
+            message_data = json.loads(data[message_id])
+            if message_data.get('message') in seen:
+                continue
+            seen.add(message_data.get('message'))
+            results.append(message_data)
+            if len(results) == limit:
+                break
+        return results
+
+    def _clear_sync(self, group_id: str):
+        group = self._groups.pop(group_id, None)
+        if group is not None:
+            group[0].close()
+        for suffix in ("", "-wal", "-shm"):
+            path = Path(str(self._get_file_path(group_id)) + suffix)
+            if path.exists():
+                path.unlink()
+
+    async def _run(self, func, *args):
+        """Run a blocking database call on the archive thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def add(self, group_id: str, messages: List[Dict[str, Any]]):
+        """Queue messages that left a group's window for indexing (MemoryManager calls this)."""
+        if self._pending_count + len(messages) > self.max_pending_messages:
+            self.dropped += len(messages)
+            return
+        self._pending.setdefault(group_id, []).extend(messages)
+        self._pending_count += len(messages)
+        if self._writer is None or self._writer.done():
+            self._wakeup = asyncio.Event()
+            self._writer = asyncio.create_task(self._write_loop())
+        if self._pending_count >= self.max_pending_messages // 2:
+            self._wakeup.set()
+
+    async def _write_loop(self):
+        """Commit queued messages every flush_interval seconds (sooner when the queue fills up)."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Index every queued message now."""
+        if not self._pending:
+            return
+        batch, self._pending, self._pending_count = self._pending, {}, 0
+        try:
+            await self._run(self._write_sync, batch)
+            self.archived += sum(len(messages) for messages in batch.values())
+        except Exception as e:
+            print(f"Error archiving messages: {e}")
+
+    async def search(self, group_id: str, query: str, limit: int = 5,
+                     ignore: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """Find the archived messages that best match a query (best first).
+
+        Words in `ignore` (e.g. the bot's trigger words) are left out of the query.
+        """
+        ignored = {word.casefold() for word in ignore}
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term not in ignored]
+        if not terms or limit <= 0:
+            return []
+        self.searches += 1
+        try:
+            return await self._run(self._search_sync, group_id, terms, limit)
+        except Exception as e:
+            print(f"Error searching archive for group {group_id}: {e}")
+            return []
+
+    async def clear(self, group_id: str):
+        """Delete a group's archive."""
+        self._pending_count -= len(self._pending.pop(group_id, []))
+        try:
+            await self._run(self._clear_sync, group_id)
+        except Exception as e:
+            print(f"Error clearing archive for group {group_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get archive statistics."""
+        return {
+            "open_groups": len(self._groups),
+            "pending_messages": self._pending_count,
+            "archived_messages": self.archived,
+            "dropped_messages": self.dropped,
+            "searches": self.searches
+        }
+
+    async def close(self):
+        """Stop the writer, index what is queued and close every database."""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        await self.flush()
+
+        def close_all():
+            for conn, _ in self._groups.values():
+                conn.close()
+            self._groups.clear()
+
+        await self._run(close_all)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,147 @@
+"""Index throughput, lookup latency and hit rate of the per-group message archive.
+
+Usage:
+    python benchmarks/archive_bench.py [--messages 200000] [--queries 2000] [--json]
+    python benchmarks/archive_bench.py --messages 1000000   # a group with a million messages
+
+Builds one group's archive from a synthetic chat (Zipf-distributed vocabulary plus
+frequent chat words) in batches, the way the background writer commits them, with
+planted "fact" messages spread through it. Then it times lookups for rare-term,
+mixed and common-only questions, both the index work alone and through the async
+search() call the bot makes, and checks how often the planted fact is in the top k.
+"""
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from archive import MessageArchive, tokenize  # noqa: E402
+from fault_injection_bench import percentile  # noqa: E402
+
+GROUP_ID = "-1001234567890"
+USERNAMES = ["alice", "bob", "kazuha_wanderer", "yae_miko_official", "tom", "xX_shogun_fan_Xx", "Raiden"]
+COMMON = ("raid boss banner event team pull wish build artifact domain weekly resin "
+          "tonight anyone think really good gg").split()
+
+def make_vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnoprstuvy"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+def make_messages(count: int, facts: int, seed: int):
+    """Synthetic chat plus `facts` planted messages, each with a unique keyword."""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(30000, rng)
+    planted = {}
+    fact_every = max(1, count // (facts + 1))
+    messages = []
+    for i in range(count):
+        if i % fact_every == fact_every - 1 and len(planted) < facts:
+            keyword = f"zq{len(planted)}marker"
+            text = f"remember that the {keyword} plan starts after the weekly raid"
+            planted[keyword] = 1000 + i
+        else:
+            words = [rng.choice(COMMON) if rng.random() < 0.4 else
+                     vocabulary[min(int(rng.paretovariate(1.05)) - 1, len(vocabulary) - 1)]
+                     for _ in range(max(1, int(rng.expovariate(1 / 9))))]
+            text = " ".join(words)
+        messages.append({
+            "username": rng.choice(USERNAMES), "target": None, "message": text,
+            "message_id": 1000 + i, "timestamp": "2025-07-18T17:00:00+00:00",
+        })
+    return messages, planted, vocabulary
+
+def make_queries(count: int, planted, vocabulary, seed: int):
+    rng = random.Random(seed + 1)
+    keywords = list(planted)
+    queries = []
+    for i in range(count):
+        kind = ("rare", "mixed", "common")[i % 3]
+        if kind == "rare":
+            words = [rng.choice(vocabulary[5000:]) for _ in range(3)]
+        elif kind == "mixed":
+            words = rng.sample(COMMON, 3) + [rng.choice(vocabulary[:200])]
+        else:
+            words = rng.sample(COMMON, 4)
+        queries.append((kind, "raiden, " + " ".join(words) + "?", None))
+    for keyword in keywords:
+        queries.append(("fact", f"raiden, when does the {keyword} plan start, after the raid?", planted[keyword]))
+    return queries
+
+async def run(args):
+    archive_dir = tempfile.mkdtemp(prefix="archive-bench-")
+    archive = MessageArchive(archive_dir, max_postings=args.max_postings)
+    messages, planted, vocabulary = make_messages(args.messages, args.facts, args.seed)
+
+    started = time.perf_counter()
+    for start in range(0, len(messages), args.batch):
+        archive._write_sync({GROUP_ID: messages[start:start + args.batch]})
+    index_seconds = time.perf_counter() - started
+
+    # Index work alone (what runs on the archive thread), then the full async call
+    queries = make_queries(args.queries, planted, vocabulary, args.seed)
+    direct = {}
+    for kind, text, _ in queries:
+        terms = [t for t in dict.fromkeys(tokenize(text)) if t != "raiden"]
+        begun = time.perf_counter()
+        archive._search_sync(GROUP_ID, terms, args.top_k)
+        direct.setdefault(kind, []).append((time.perf_counter() - begun) * 1000)
+
+    via_async = []
+    hits = 0
+    for kind, text, expected in queries:
+        begun = time.perf_counter()
+        found = await archive.search(GROUP_ID, text, limit=args.top_k, ignore=["raiden"])
+        via_async.append((time.perf_counter() - begun) * 1000)
+        if expected is not None and any(m["message_id"] == expected for m in found):
+            hits += 1
+
+    size = sum(p.stat().st_size for p in Path(archive_dir).iterdir())
+    await archive.close()
+    shutil.rmtree(archive_dir, ignore_errors=True)
+
+    return {
+        "messages": args.messages,
+        "index_messages_per_second": round(args.messages / index_seconds),
+        "disk_bytes_per_message": round(size / args.messages),
+        "lookup_ms": {kind: {"p50": round(percentile(values, 0.50), 3), "p99": round(percentile(values, 0.99), 3)}
+                      for kind, values in direct.items()},
+        "search_call_ms": {"p50": round(percentile(via_async, 0.50), 3),
+                           "p99": round(percentile(via_async, 0.99), 3)},
+        "fact_hit_rate": round(hits / len(planted), 3) if planted else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200000, help="archived messages in the group")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--facts", type=int, default=50, help="planted messages to retrieve")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=1000, help="messages per write transaction")
+    parser.add_argument("--max-postings", type=int, default=100, help="postings read per query term")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{result['messages']} messages: indexed at {result['index_messages_per_second']}/s, "
+          f"{result['disk_bytes_per_message']} bytes/message on disk")
+    print(f"{'query':<10}{'p50 ms':>10}{'p99 ms':>10}")
+    for kind, values in result["lookup_ms"].items():
+        print(f"{kind:<10}{values['p50']:>10}{values['p99']:>10}")
+    print(f"{'search()':<10}{result['search_call_ms']['p50']:>10}{result['search_call_ms']['p99']:>10}")
+    print(f"planted fact in top {args.top_k}: {result['fact_hit_rate'] * 100:.0f}%")
+
+if __name__ == "__main__":
+    main()
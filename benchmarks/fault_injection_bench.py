@@ -0,0 +1,116 @@
+"""Exercise DeepSeekClient's retries and circuit breaker against the stub server's faults.
+
+Usage:
+    python benchmarks/fault_injection_bench.py [--requests 200] [--concurrency 20] [--json]
+
+Runs four phases against benchmarks/stub_deepseek.py:
+    transient  20% 500s and 10% 429s with Retry-After: retries should recover most requests
+    outage     every request 503: the breaker should open and later requests fail fast
+    probe      faults cleared: after the recovery timeout a single probe closes the breaker
+    recovered  normal traffic flows again
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from deepseek_client import DeepSeekClient  # noqa: E402
+from resilience import Resilience, CircuitBreaker  # noqa: E402
+from stub_deepseek import StubDeepSeekServer  # noqa: E402
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+async def run_phase(name, client, server, requests, concurrency):
+    """Send requests and summarize outcomes for one phase."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = []
+    stats_before = client.resilience.get_stats()
+    upstream_before = server.stats["requests"]
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await client.agenerate_response("system", [], f"question {i}")
+            elapsed = (time.perf_counter() - started) * 1000
+            (latencies if result else failures).append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    stats_after = client.resilience.get_stats()
+
+    return {
+        "phase": name,
+        "requests": requests,
+        "succeeded": len(latencies),
+        "failed": len(failures),
+        "upstream_requests": server.stats["requests"] - upstream_before,
+        "retries": stats_after["retries"] - stats_before["retries"],
+        "breaker_trips": stats_after["breaker_trips"] - stats_before["breaker_trips"],
+        "breaker_rejected": stats_after["breaker_rejected"] - stats_before["breaker_rejected"],
+        "breaker_state": stats_after["breaker_state"],
+        "success_p50_ms": round(statistics.median(latencies), 1) if latencies else 0.0,
+        "success_p95_ms": round(percentile(latencies, 0.95), 1),
+        "failure_p95_ms": round(percentile(failures, 0.95), 1),
+        "wall_s": round(time.perf_counter() - started, 2),
+    }
+
+async def run(args):
+    server = StubDeepSeekServer(port=0, latency=args.latency, jitter=args.latency / 4,
+                                retry_after=0.2, seed=1)
+    await server.start()
+
+    resilience = Resilience(max_attempts=3, base_delay=0.1, max_delay=1.0,
+                            breaker=CircuitBreaker(failure_threshold=5, recovery_timeout=args.recovery))
+    client = DeepSeekClient("bench", base_url=server.base_url, resilience=resilience, read_timeout=5)
+
+    results = []
+    try:
+        server.fault_rate, server.rate_limit_rate = 0.2, 0.1
+        results.append(await run_phase("transient", client, server, args.requests, args.concurrency))
+
+        server.fault_rate = server.rate_limit_rate = 0.0
+        server.outage = True
+        results.append(await run_phase("outage", client, server, args.requests, args.concurrency))
+
+        server.outage = False
+        await asyncio.sleep(args.recovery)
+        results.append(await run_phase("probe", client, server, 1, 1))
+        results.append(await run_phase("recovered", client, server, args.requests, args.concurrency))
+    finally:
+        await client.aclose()
+        await server.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--recovery", type=float, default=1.0, help="breaker recovery timeout (s)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'phase':<10}{'ok':>6}{'fail':>6}{'upstream':>10}{'retries':>9}{'trips':>7}"
+          f"{'rejected':>10}{'ok p95 ms':>11}{'fail p95 ms':>13}")
+    for r in results:
+        print(f"{r['phase']:<10}{r['succeeded']:>6}{r['failed']:>6}{r['upstream_requests']:>10}"
+              f"{r['retries']:>9}{r['breaker_trips']:>7}{r['breaker_rejected']:>10}"
+              f"{r['success_p95_ms']:>11}{r['failure_p95_ms']:>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""End-to-end load benchmark: synthetic updates through bot.handle_message.
+
+Usage:
+    python benchmarks/load_bench.py [--groups 50] [--rate 50] [--duration 20] [--output run.json]
+    python benchmarks/load_bench.py --compare run.json   # show deltas against an earlier run
+
+Builds PTB Update objects for --groups chats arriving as a Poisson stream of --rate
+messages/s, with tunable mention/reply ratios and message sizes, and drives them through
+bot.handle_message. DeepSeek is the stub server from stub_deepseek.py (in a separate
+process, --latency seconds per completion) and Telegram sends/edits are mocked with
+--send-latency. Bot settings such as MEMORY_BACKEND or STREAMING_MODES are taken from
+the environment (Telegram send pacing is off unless TELEGRAM_* rates are set), memory
+goes to a temporary directory.
+
+Reports p50/p95/p99 latency per update (and per answered update), updates/s, bytes
+written to disk, completions and prompt tokens per call, as JSON with the git commit.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fault_injection_bench import percentile  # noqa: E402
+from shard_bench import run_stub  # noqa: E402
+
+BOT_ID = 777000
+BOT_USERNAME = "raiden_bench_bot"
+WORDS = ("storm eternity archon thunder banner event patch pull team build artifact "
+         "domain boss weekly resin reaction element co-op wish pity region").split()
+
+# Sends made while handling the current update (each update runs in its own task)
+update_sends: ContextVar = ContextVar("update_sends")
+
+def disk_write_bytes() -> int:
+    """Bytes this process has written (Linux /proc), 0 where unavailable."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(":") for line in f.read().splitlines())
+        return int(fields.get("wchar", 0))
+    except (OSError, ValueError):
+        return 0
+
+def dir_bytes(path: str) -> int:
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+def make_fake_bot(send_latency: float):
+    """A telegram.Bot whose sends and edits return locally built messages after a delay."""
+    from telegram import Bot, Chat, Message, User
+
+    class FakeBot(Bot):
+        send_latency = 0.0
+        sent = 0
+        edits = 0
+        next_message_id = 10_000_000
+
+        def _message(self, chat_id, text):
+            FakeBot.next_message_id += 1
+            message = Message(FakeBot.next_message_id, datetime.now(timezone.utc),
+                              Chat(chat_id, Chat.SUPERGROUP), from_user=self.bot, text=text)
+            message.set_bot(self)
+            return message
+
+        async def send_message(self, chat_id, text, *args, **kwargs):
+            await asyncio.sleep(self.send_latency)
+            FakeBot.sent += 1
+            update_sends.get([0])[0] += 1
+            return self._message(chat_id, text)
+
+        async def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+            await asyncio.sleep(self.send_latency)
+            FakeBot.edits += 1
+            return self._message(chat_id, text)
+
+    # Counters live on the class: bot objects are frozen once constructed
+    FakeBot.send_latency = send_latency
+    bot = FakeBot("123456:bench")
+    bot._bot_user = User(BOT_ID, "Raiden", True, username=BOT_USERNAME)
+    return bot
+
+def make_update(rng, bot, update_id: int, chat_id: int, args):
+    """Build one synthetic group message update."""
+    from telegram import Update
+
+    words = [rng.choice(WORDS) for _ in range(max(1, int(rng.expovariate(1 / args.words))))]
+    roll = rng.random()
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": f"group {chat_id}"},
+        "from": {"id": 1000 + update_id % 97, "is_bot": False, "first_name": f"user{update_id % 97}",
+                 "username": f"user{update_id % 97}"},
+    }
+    if roll < args.mention_ratio:
+        words.insert(0, "raiden,")
+    elif roll < args.mention_ratio + args.reply_ratio:
+        message["reply_to_message"] = {
+            "message_id": update_id - 1,
+            "date": int(time.time()),
+            "chat": message["chat"],
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Raiden", "username": BOT_USERNAME},
+            "text": "Patience.",
+        }
+    message["text"] = " ".join(words)
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+async def drive(args, bot_module):
+    rng = random.Random(args.seed)
+    fake_bot = make_fake_bot(args.send_latency)
+    context = SimpleNamespace(bot=fake_bot, args=[])
+    chat_ids = [-1001000000000 - i for i in range(args.groups)]
+
+    if args.mode == "assistant":
+        for chat_id in chat_ids:
+            await bot_module.set_group_mode(str(chat_id), "assistant")
+
+    latencies = []
+    answered = []
+    tasks = []
+
+    async def one(update):
+        sends = [0]
+        update_sends.set(sends)
+        started = time.perf_counter()
+        try:
+            await bot_module.handle_message(update, context)
+        except Exception as e:
+            print(f"handle_message failed: {e}")
+        elapsed = (time.perf_counter() - started) * 1000
+        latencies.append(elapsed)
+        if sends[0]:
+            answered.append(elapsed)
+
+    total = int(args.rate * args.duration)
+    writes_before = disk_write_bytes()
+    started = time.perf_counter()
+    next_at = 0.0
+    for update_id in range(1, total + 1):
+        # Poisson arrivals, a few busy groups get most of the traffic
+        next_at += rng.expovariate(args.rate)
+        delay = started + next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat_id = chat_ids[min(int(rng.paretovariate(1.2)) - 1, args.groups - 1)]
+        tasks.append(asyncio.create_task(one(make_update(rng, fake_bot, update_id, chat_id, args))))
+    await asyncio.gather(*tasks)
+    await bot_module.memory_manager.flush()
+    wall = time.perf_counter() - started
+
+    cache = bot_module.deepseek_client.get_prompt_cache_stats()
+    prompt_tokens = cache["hit_tokens"] + cache["miss_tokens"]
+    return {
+        "updates": len(latencies),
+        "answered": len(answered),
+        "wall_s": round(wall, 2),
+        "updates_per_second": round(len(latencies) / wall, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+        },
+        "answered_latency_ms": {
+            "p50": round(percentile(answered, 0.50), 2),
+            "p95": round(percentile(answered, 0.95), 2),
+            "p99": round(percentile(answered, 0.99), 2),
+        },
+        "disk_write_bytes": disk_write_bytes() - writes_before,
+        "memory_dir_bytes": dir_bytes(os.environ["MEMORY_DIR"]),
+        "completions": cache["calls"],
+        "prompt_tokens_per_call": round(prompt_tokens / cache["calls"], 1) if cache["calls"] else 0,
+        "prompt_cache_hit_rate_percent": cache["hit_rate_percent"],
+        "telegram_sends": type(fake_bot).sent,
+        "telegram_edits": type(fake_bot).edits,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(current, baseline):
+    """Print current vs baseline for the headline metrics."""
+    rows = [
+        ("updates/s", current["updates_per_second"], baseline["updates_per_second"]),
+        ("p50 ms", current["latency_ms"]["p50"], baseline["latency_ms"]["p50"]),
+        ("p95 ms", current["latency_ms"]["p95"], baseline["latency_ms"]["p95"]),
+        ("p99 ms", current["latency_ms"]["p99"], baseline["latency_ms"]["p99"]),
+        ("answered p95 ms", current["answered_latency_ms"]["p95"], baseline["answered_latency_ms"]["p95"]),
+        ("disk bytes", current["disk_write_bytes"], baseline["disk_write_bytes"]),
+        ("prompt tokens/call", current["prompt_tokens_per_call"], baseline["prompt_tokens_per_call"]),
+    ]
+    print(f"{'metric':<20}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, now, before in rows:
+        change = f"{(now - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:<20}{before:>14}{now:>14}{change:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=50.0, help="messages per second across all groups")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of traffic")
+    parser.add_argument("--mention-ratio", type=float, default=0.1)
+    parser.add_argument("--reply-ratio", type=float, default=0.05)
+    parser.add_argument("--words", type=float, default=12.0, help="mean words per message")
+    parser.add_argument("--mode", choices=["chat", "assistant"], default="chat")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub completion latency (s)")
+    parser.add_argument("--send-latency", type=float, default=0.05, help="mocked Telegram call latency (s)")
+    parser.add_argument("--port", type=int, default=18800, help="stub server port")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON result to this file")
+    parser.add_argument("--compare", help="baseline JSON result to compare against")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    memory_dir = tempfile.mkdtemp(prefix="load-bench-")
+    os.environ.update({
+        "DEEPSEEK_API_KEY": "bench",
+        "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{args.port}/v1",
+        "DEEPSEEK_HTTP2": "false",
+        "MEMORY_DIR": memory_dir,
+        "MEMORY_DB_PATH": os.path.join(memory_dir, "memory.db"),
+        "WHITELIST_ENABLED": "false",
+    })
+    # The mocked Telegram has no flood limits, so pacing is off unless set explicitly
+    # (telegram_send_bench.py measures the send queue against simulated limits)
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "100000")
+    os.environ.setdefault("TELEGRAM_GROUP_PER_MINUTE", "6000000")
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    stub = context.Process(target=run_stub, args=(args.port, args.latency, ready), daemon=True)
+    stub.start()
+    ready.get(timeout=30)
+
+    import bot as bot_module
+
+    async def run():
+        try:
+            return await drive(args, bot_module)
+        finally:
+            await bot_module.on_shutdown(None)
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        stub.terminate()
+        shutil.rmtree(memory_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "compare", "json")},
+        "env": {key: os.environ[key] for key in ("MEMORY_BACKEND", "HISTORY_FORMAT", "STREAMING_MODES",
+                                                  "MEMORY_FLUSH_INTERVAL_MS", "COALESCE_WINDOW", "SUMMARY_ENABLED",
+                                                  "ARCHIVE_ENABLED", "SPONTANEOUS_PER_HOUR_CHAT", "QUOTA_USER_TOKENS",
+                                                  "QUOTA_GROUP_TOKENS", "TELEGRAM_GROUP_PER_MINUTE")
+                if key in os.environ},
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"baseline {baseline.get('commit')} vs current {report['commit']}")
+        compare(results, baseline["results"])
+    elif args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        r = results
+        print(f"{r['updates']} updates in {r['wall_s']}s ({r['updates_per_second']}/s), "
+              f"{r['answered']} answered, {r['completions']} completions")
+        print(f"latency ms p50/p95/p99: {r['latency_ms']['p50']}/{r['latency_ms']['p95']}/"
+              f"{r['latency_ms']['p99']} (answered: {r['answered_latency_ms']['p50']}/"
+              f"{r['answered_latency_ms']['p95']}/{r['answered_latency_ms']['p99']})")
+        print(f"disk written: {r['disk_write_bytes']} bytes, prompt tokens/call: "
+              f"{r['prompt_tokens_per_call']} ({r['prompt_cache_hit_rate_percent']}% cached)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Measure resident memory of group bookkeeping: plain dict messages vs MessageRecord.
+
+Usage:
+    python benchmarks/memory_footprint_bench.py [--active 10000] [--seen 50000] [--window 30] [--json]
+
+Each variant runs in a fresh spawned process. It loads a window of `--window` synthetic
+messages for each of `--active` groups (all of them stay cached). It then touches
+`--seen` groups in total, so groups that went idle leave state behind. The report gives
+RSS growth per 10k active groups, bytes per cached message, and how many per-group locks
+are still tracked at the end.
+
+- legacy: the previous bookkeeping, a deque of message dicts per cached group and an
+  asyncio.Lock for every group ever seen.
+- records: the current MemoryManager, with MessageRecord windows and idle locks, settings
+  and storage state evicted.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from memory_storage import MemoryStorage  # noqa: E402
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+def synthetic_history(group: int, window: int) -> List[Dict[str, Any]]:
+    """Build a group's window the way json.loads would: fresh strings for every value."""
+    messages = []
+    for i in range(window):
+        messages.append(json.loads(json.dumps({
+            "username": f"member_{(group * 7 + i) % 12}",
+            "target": "Raiden" if i % 3 == 0 else None,
+            "message": f"message {i} in group {group}: did anyone finish the weekly boss yet?",
+            "message_id": 1000 + i,
+            "timestamp": f"2025-07-18T17:{i % 60:02d}:00.123456+00:00",
+        })))
+    return messages
+
+class SyntheticStorage(MemoryStorage):
+    """Storage returning generated history and discarding writes."""
+
+    def __init__(self, window: int):
+        self.window = window
+
+    async def load(self, group_id: str) -> List[Dict[str, Any]]:
+        return synthetic_history(int(group_id), self.window)
+
+    async def append(self, group_id: str, new_messages: List[Dict[str, Any]],
+                     window: List[Dict[str, Any]]) -> bool:
+        return True
+
+    async def clear(self, group_id: str):
+        pass
+
+    async def load_settings(self, group_id: str) -> Dict[str, Any]:
+        return {}
+
+    async def save_settings(self, group_id: str, settings: Dict[str, Any]):
+        pass
+
+async def run_legacy(args, baseline: int) -> Dict[str, int]:
+    windows = {}
+    locks = {}
+    for group in range(args.seen):
+        group_id = str(group)
+        locks.setdefault(group_id, asyncio.Lock())
+        async with locks[group_id]:
+            if group < args.active:
+                windows[group_id] = deque(synthetic_history(group, args.window), maxlen=args.window)
+    return {"rss_grown": rss_bytes() - baseline, "cached_groups": len(windows), "tracked_locks": len(locks)}
+
+async def run_records(args, baseline: int) -> Dict[str, int]:
+    from memory_manager import MemoryManager
+
+    memory = MemoryManager(storage=SyntheticStorage(args.window), max_messages=args.window,
+                           max_cached_groups=args.active, max_cache_bytes=1 << 40)
+    # Active groups stay cached; the rest are only looked up and go idle, like muted chats
+    for group in range(args.seen):
+        group_id = str(group)
+        if group < args.active:
+            async with memory.transaction(group_id) as view:
+                view.context()
+        else:
+            await memory.get_settings(group_id)
+            async with memory._get_lock(group_id):
+                pass
+            memory._evict()
+    stats = memory.get_cache_stats()
+    return {"rss_grown": rss_bytes() - baseline, "cached_groups": stats["cached_groups"],
+            "tracked_locks": stats["tracked_locks"]}
+
+def run_variant(name: str, args, results):
+    baseline = rss_bytes()
+    runner = run_legacy if name == "legacy" else run_records
+    # RSS is read inside the runner, while its groups are still alive
+    counts = asyncio.run(runner(args, baseline))
+    grown = counts.pop("rss_grown")
+    messages = args.active * args.window
+    results.put({
+        "variant": name,
+        "rss_mb_per_10k_groups": round(grown / args.active * 10000 / 2 ** 20, 1),
+        "bytes_per_message": round(grown / messages),
+        **counts,
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--active", type=int, default=10000, help="groups with a cached window")
+    parser.add_argument("--seen", type=int, default=50000, help="groups touched in total")
+    parser.add_argument("--window", type=int, default=30, help="messages per cached window")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+    args.seen = max(args.seen, args.active)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in ("legacy", "records"):
+        queue = context.Queue()
+        process = context.Process(target=run_variant, args=(name, args, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"active groups: {args.active}, seen groups: {args.seen}, window: {args.window}")
+    print(f"{'variant':<10}{'MB/10k groups':>15}{'bytes/msg':>11}{'cached':>9}{'locks':>9}")
+    for r in results:
+        print(f"{r['variant']:<10}{r['rss_mb_per_10k_groups']:>15}{r['bytes_per_message']:>11}"
+              f"{r['cached_groups']:>9}{r['tracked_locks']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Compare prompt size and build time of the JSON and compact history formats.
+
+Usage:
+    python benchmarks/prompt_format_bench.py [--messages 30] [--iterations 2000] [--json]
+    python benchmarks/prompt_format_bench.py --live   # also measure real prompt_tokens and latency
+
+Token counts use utils.estimate_tokens unless --live is given, in which case each layout is
+sent to the DeepSeek API (DEEPSEEK_API_KEY, max_tokens=1) and the reported usage is used.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from deepseek_client import DeepSeekClient  # noqa: E402
+from utils import estimate_tokens  # noqa: E402
+
+USERNAMES = ["alice", "bob", "kazuha_wanderer", "Raiden", "yae_miko_official", "tom", "xX_shogun_fan_Xx"]
+SNIPPETS = [
+    "lol", "anyone up for co-op tonight?", "raiden what do you think about this",
+    "I just pulled a five star on my first ten pull, can you believe it",
+    "that patch note about the new region looks huge",
+    "Silence. The eternity you seek is not found in idle chatter.",
+    "why does the event end so soon, I barely started it",
+    "ok", "brb", "can someone explain how the elemental reactions stack?",
+]
+SYSTEM_PROMPT = "You are Raiden Ei — the Electro Archon." * 20
+USER_MESSAGE = "raiden, what should we do this weekend?"
+
+def make_history(count: int, seed: int):
+    """Build a synthetic group history with replies and targets."""
+    rng = random.Random(seed)
+    history = []
+    for i in range(count):
+        msg = {
+            "username": rng.choice(USERNAMES),
+            "target": rng.choice(USERNAMES) if rng.random() < 0.4 else None,
+            "message": rng.choice(SNIPPETS),
+            "message_id": 100000 + i,
+            "timestamp": f"2025-07-18T17:{i % 60:02d}:00+00:00",
+        }
+        if history and rng.random() < 0.3:
+            msg["reply_to_message_id"] = rng.choice(history)["message_id"]
+        history.append(msg)
+    return history
+
+def measure(history_format: str, history, iterations: int):
+    """Measure estimated prompt tokens, characters and build time for one format."""
+    client = DeepSeekClient("bench", history_format=history_format)
+    messages = client._build_messages(SYSTEM_PROMPT, history, USER_MESSAGE)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        client._build_messages(SYSTEM_PROMPT, history, USER_MESSAGE)
+    build_us = (time.perf_counter() - started) / iterations * 1e6
+
+    history_text = messages[1]["content"]
+    return {
+        "format": history_format,
+        "history_chars": len(history_text),
+        "history_tokens_est": estimate_tokens(history_text),
+        "prompt_tokens_est": sum(estimate_tokens(m["content"]) + 4 for m in messages),
+        "build_us": round(build_us, 2),
+        "messages": messages,
+    }
+
+def measure_live(result):
+    """Send the prompt to DeepSeek and record real prompt tokens and latency."""
+    import httpx
+
+    client = DeepSeekClient(os.environ["DEEPSEEK_API_KEY"])
+    payload = client._build_payload(result["messages"], max_tokens=1)
+    started = time.perf_counter()
+    response = httpx.post(f"{client.base_url}/chat/completions", headers=client._get_headers(),
+                          json=payload, timeout=60)
+    response.raise_for_status()
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    result["prompt_tokens"] = response.json()["usage"]["prompt_tokens"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=30)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    history = make_history(args.messages, args.seed)
+    results = [measure(fmt, history, args.iterations) for fmt in ("json", "compact")]
+    if args.live:
+        for result in results:
+            measure_live(result)
+
+    for result in results:
+        del result["messages"]
+
+    baseline, compact = results
+    token_key = "prompt_tokens" if args.live else "prompt_tokens_est"
+    summary = {
+        "messages": args.messages,
+        "results": results,
+        "prompt_token_saving_percent": round(
+            (1 - compact[token_key] / baseline[token_key]) * 100, 1),
+        "history_token_saving_percent": round(
+            (1 - compact["history_tokens_est"] / baseline["history_tokens_est"]) * 100, 1),
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"History of {args.messages} messages")
+    print(f"{'format':<10}{'chars':>10}{'hist tok':>10}{'prompt tok':>12}{'build µs':>10}")
+    for result in results:
+        print(f"{result['format']:<10}{result['history_chars']:>10}{result['history_tokens_est']:>10}"
+              f"{result.get('prompt_tokens', result['prompt_tokens_est']):>12}{result['build_us']:>10}")
+        if "latency_ms" in result:
+            print(f"{'':<10}live latency {result['latency_ms']} ms")
+    print(f"History tokens saved: {summary['history_token_saving_percent']}%")
+    print(f"Prompt tokens saved:  {summary['prompt_token_saving_percent']}%")
+
+if __name__ == "__main__":
+    main()
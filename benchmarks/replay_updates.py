@@ -0,0 +1,106 @@
+"""POST recorded (or synthetic) Telegram updates to the bot's webhook server.
+
+Usage:
+    UPDATE_MODE=webhook WEBHOOK_URL=... WEBHOOK_SECRET=s3cret python bot.py
+    python benchmarks/replay_updates.py --secret s3cret [--updates recorded.jsonl] [--json]
+
+--updates reads one update JSON object per line (or a JSON list), e.g. saved from
+getUpdates; without it --count synthetic text messages are sent to --chat-id. Each
+update gets a fresh update_id. Reports HTTP status counts, request latency and
+throughput, and checks that a wrong secret token is rejected.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fault_injection_bench import percentile  # noqa: E402
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def load_updates(path: str):
+    text = Path(path).read_text(encoding="utf-8").strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def synthetic_updates(count: int, chat_id: int):
+    """Build group text messages, every tenth one mentioning the bot."""
+    updates = []
+    for i in range(count):
+        text = f"raiden, question number {i}?" if i % 10 == 0 else f"just chatting, message {i}"
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": 1000 + i,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": "replay"},
+                "from": {"id": 5000 + i % 25, "is_bot": False, "first_name": f"user{i % 25}",
+                         "username": f"user{i % 25}"},
+                "text": text,
+            },
+        })
+    return updates
+
+async def replay(args):
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.count, args.chat_id)
+    first_id = int(time.time() * 1000) % 2_000_000_000
+    for offset, update in enumerate(updates):
+        update["update_id"] = first_id + offset
+
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        wrong = await client.post(args.url, json=updates[0], headers={SECRET_HEADER: args.secret + "x"})
+
+        async def post(update):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(args.url, json=update, headers={SECRET_HEADER: args.secret})
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "updates": len(updates),
+        "statuses": statuses,
+        "wrong_secret_status": wrong.status_code,
+        "updates_per_second": round(len(updates) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 1),
+        "latency_p95_ms": round(percentile(latencies, 0.95), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", required=True, help="the bot's WEBHOOK_SECRET")
+    parser.add_argument("--updates", help="recorded updates (JSON lines or a JSON list)")
+    parser.add_argument("--count", type=int, default=200, help="synthetic updates when --updates is not given")
+    parser.add_argument("--chat-id", type=int, default=-100123456789)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"posted {result['updates']} updates: {result['statuses']}")
+    print(f"wrong secret -> HTTP {result['wrong_secret_status']} (expected 403)")
+    print(f"{result['updates_per_second']} updates/s, p50 {result['latency_p50_ms']} ms, "
+          f"p95 {result['latency_p95_ms']} ms")
+
+if __name__ == "__main__":
+    main()
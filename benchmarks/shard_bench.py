@@ -0,0 +1,175 @@
+"""Measure update throughput of sharded worker processes against the stub DeepSeek server.
+
+Usage:
+    python benchmarks/shard_bench.py [--shards 1,2,4] [--updates 2000] [--chats 200] [--json]
+
+For each shard count the script starts that many worker processes through
+sharding.ShardRouter (plus one stub DeepSeek server process per worker, so the stub is
+not the bottleneck) and routes synthetic chat updates by chat ID. Each worker runs the
+bot's per-update work without Telegram: memory transaction, token-budgeted context,
+completion from the stub and saving the reply. Throughput only scales while there are
+free CPU cores; the report includes os.cpu_count() for that reason.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from sharding import ShardRouter, consume_shard  # noqa: E402
+
+SYSTEM_PROMPT = "You are Raiden Ei — the Electro Archon. Reply in 1 to 3 sentences."
+
+def run_stub(port: int, latency: float, ready):
+    """Stub DeepSeek server process."""
+    from stub_deepseek import StubDeepSeekServer
+
+    async def serve():
+        server = StubDeepSeekServer(port=port, latency=latency, jitter=latency / 4, seed=port)
+        await server.start()
+        ready.put(port)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+def run_worker(shard: int, shard_queue, results, base_port: int, memory_dir: str, concurrency: int):
+    """Shard worker: the bot's per-update pipeline minus Telegram I/O."""
+    from context_builder import ContextBuilder
+    from deepseek_client import DeepSeekClient
+    from memory_manager import MemoryManager
+    from memory_storage import JsonlFileStorage
+
+    async def serve():
+        memory = MemoryManager(storage=JsonlFileStorage(memory_dir, max_messages=30), max_messages=30)
+        client = DeepSeekClient("bench", base_url=f"http://127.0.0.1:{base_port + shard}/v1", http2=False)
+        builder = ContextBuilder(client.format_history, budgets={"chat": 3000}, max_messages={"chat": 30})
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+        handled = 0
+
+        async def process(data):
+            nonlocal handled
+            group_id = str(data["chat_id"])
+            async with memory.transaction(group_id) as view:
+                view.append(data["message"])
+                history = view.context()
+            selected, _ = builder.build("chat", SYSTEM_PROMPT, history, data["message"]["message"],
+                                        group_id=group_id)
+            result = await client.acomplete(SYSTEM_PROMPT, selected, data["message"]["message"],
+                                            max_tokens=100, group_id=group_id)
+            if result:
+                await memory.save_message(group_id, {
+                    "username": "Raiden", "target": data["message"]["username"],
+                    "message": result["content"], "message_id": data["message"]["message_id"] + 1,
+                    "timestamp": data["message"]["timestamp"],
+                })
+            handled += 1
+
+        async def handle(data):
+            await semaphore.acquire()
+            task = asyncio.create_task(process(data))
+            tasks.add(task)
+            task.add_done_callback(lambda t: (tasks.discard(t), semaphore.release()))
+
+        results.put(("ready", shard, time.time()))
+        await consume_shard(shard_queue, handle)
+        await asyncio.gather(*tasks)
+        results.put(("done", shard, time.time(), handled))
+        await client.aclose()
+        await memory.close()
+
+    asyncio.run(serve())
+
+def make_updates(count: int, chats: int):
+    updates = []
+    for i in range(count):
+        chat_id = -1000000000 - (i % chats)
+        updates.append((chat_id, {
+            "chat_id": chat_id,
+            "message": {
+                "username": f"user{i % 17}", "target": None,
+                "message": f"raiden, what do you think about update {i}?",
+                "message_id": 10 * i, "timestamp": "2025-07-18T17:00:00+00:00",
+            },
+        }))
+    return updates
+
+def run_round(shards: int, args, updates):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    stubs = [context.Process(target=run_stub, args=(args.base_port + i, args.latency, ready), daemon=True)
+             for i in range(shards)]
+    for stub in stubs:
+        stub.start()
+    for _ in stubs:
+        ready.get(timeout=30)
+
+    memory_dir = tempfile.mkdtemp(prefix="shard-bench-")
+    results = context.Queue()
+    router = ShardRouter(shards, run_worker,
+                         worker_args=(results, args.base_port, memory_dir, args.concurrency))
+    try:
+        router.start()
+        for _ in range(shards):
+            results.get(timeout=60)
+
+        started = time.time()
+        for chat_id, data in updates:
+            router.route(chat_id, data)
+        router.stop(timeout=300)
+
+        finished = [results.get(timeout=30) for _ in range(shards)]
+        elapsed = max(item[2] for item in finished) - started
+        handled = sum(item[3] for item in finished)
+    finally:
+        for stub in stubs:
+            stub.terminate()
+        shutil.rmtree(memory_dir, ignore_errors=True)
+
+    return {
+        "shards": shards,
+        "updates": handled,
+        "seconds": round(elapsed, 2),
+        "updates_per_second": round(handled / elapsed, 1),
+        "routed_per_shard": router.routed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", default="1,2,4", help="comma-separated shard counts to compare")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent updates per worker")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub completion latency (s)")
+    parser.add_argument("--base-port", type=int, default=18900)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates, args.chats)
+    results = [run_round(int(n), args, updates) for n in args.shards.split(",")]
+    baseline = results[0]["updates_per_second"]
+    for r in results:
+        r["speedup"] = round(r["updates_per_second"] / baseline, 2)
+
+    if args.json:
+        print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, indent=2))
+        return
+
+    print(f"cpu_count: {os.cpu_count()}")
+    print(f"{'shards':>6}{'updates':>9}{'seconds':>9}{'updates/s':>11}{'speedup':>9}")
+    for r in results:
+        print(f"{r['shards']:>6}{r['updates']:>9}{r['seconds']:>9}{r['updates_per_second']:>11}{r['speedup']:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Spontaneous replies: the old 2% coin flip vs the local relevance score and per-group budget.
+
+Usage:
+    python benchmarks/spontaneous_bench.py [--messages-per-day 5000] [--days 1] [--json]
+    python benchmarks/spontaneous_bench.py --per-hour 2 --threshold 0.5
+
+A day of synthetic traffic for one busy group (none of it addressed to the bot) is
+replayed with simulated timestamps. Lines are labelled: questions and on-topic messages
+a bot could usefully join, filler ("lol", "gg"), plain chatter, and members replying to
+each other. For each policy the report gives completions per day, the busiest hour, the
+share of calls spent on worthwhile messages vs filler, and the decision cost per message.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from spontaneous import SpontaneousPolicy  # noqa: E402
+
+KEYWORDS = "inazuma,electro,archon,shogun,eternity,teyvat,genshin,yae,makoto,thunder,euthymia,vision".split(",")
+
+# (kind, text, replying to another member)
+CORPUS = [
+    ("worth", "does anyone know how electro resonance actually works with two electro units?", False),
+    ("worth", "what is the best artifact set for a shogun team these days?", False),
+    ("worth", "is the inazuma archon quest worth doing before the new region?", False),
+    ("worth", "can someone explain why eternity matters so much to the electro archon?", False),
+    ("worth", "which vision would you pick if you could choose any of them?", False),
+    ("worth", "how do people even clear the thunder domain without a healer?", False),
+    ("worth", "anyone have tips for the spiral abyss this cycle, I keep failing floor 12", False),
+    ("worth", "the story of makoto and the shogun puppet is honestly the best part of teyvat lore", False),
+    ("filler", "lol", False),
+    ("filler", "ok", False),
+    ("filler", "gg", False),
+    ("filler", "brb", False),
+    ("filler", "haha true", False),
+    ("filler", "same", False),
+    ("filler", "nice!!", False),
+    ("filler", "what?", False),
+    ("chatter", "just got home from work, so tired today", False),
+    ("chatter", "I pulled a four star again, my luck is terrible", False),
+    ("chatter", "we should do co-op at nine tonight", False),
+    ("chatter", "the weather here has been awful all week", False),
+    ("chatter", "my cat knocked my phone off the desk mid fight", False),
+    ("side", "did you finish your weekly boss yet?", True),
+    ("side", "yeah I sent you the invite, check your friend list", True),
+    ("side", "no way, you got her on the first ten pull?", True),
+    ("side", "thanks, that build guide helped a lot", True),
+]
+WEIGHTS = {"worth": 0.08, "filler": 0.4, "chatter": 0.32, "side": 0.2}
+
+def make_day(messages: int, days: int, seed: int):
+    """Timestamped (seconds) messages, busier in the evening."""
+    rng = random.Random(seed)
+    by_kind = {}
+    for kind, text, side in CORPUS:
+        by_kind.setdefault(kind, []).append((kind, text, side))
+    kinds = list(WEIGHTS)
+    weights = [WEIGHTS[kind] for kind in kinds]
+    traffic = []
+    for _ in range(messages * days):
+        day = rng.randrange(days)
+        hour = min(23, max(0, int(rng.gauss(19, 4))))
+        at = day * 86400 + hour * 3600 + rng.random() * 3600
+        traffic.append((at,) + rng.choice(by_kind[rng.choices(kinds, weights)[0]]))
+    traffic.sort()
+    return traffic
+
+def simulate(name: str, decide, traffic, days: int, on_reply=None):
+    calls = {"worth": 0, "filler": 0, "chatter": 0, "side": 0}
+    per_hour = {}
+    started = time.perf_counter()
+    for at, kind, text, side in traffic:
+        if decide(text, side, at):
+            calls[kind] += 1
+            hour = int(at // 3600)
+            per_hour[hour] = per_hour.get(hour, 0) + 1
+            if on_reply is not None:
+                on_reply(at)
+    elapsed = time.perf_counter() - started
+    total = sum(calls.values())
+    worth = sum(1 for _, kind, _, _ in traffic if kind == "worth")
+    return {
+        "policy": name,
+        "calls_per_day": round(total / days, 1),
+        "max_calls_per_hour": max(per_hour.values()) if per_hour else 0,
+        "worthwhile_share": round(calls["worth"] / total, 3) if total else 0,
+        "filler_share": round(calls["filler"] / total, 3) if total else 0,
+        "worthwhile_answered": round(calls["worth"] / worth, 3) if worth else 0,
+        "decision_us": round(elapsed / len(traffic) * 1e6, 2) if traffic else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages-per-day", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--chance", type=float, default=0.02, help="coin flip probability")
+    parser.add_argument("--threshold", type=float, default=0.6, help="policy score threshold")
+    parser.add_argument("--per-hour", type=float, default=4, help="policy budget (replies per hour)")
+    parser.add_argument("--burst", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    traffic = make_day(args.messages_per_day, args.days, args.seed)
+    group_id = "-100200300"
+    rng = random.Random(args.seed)
+
+    results = [simulate("coin flip", lambda text, side, at: rng.random() < args.chance, traffic, args.days)]
+
+    for name, per_hour in (("score only", float("inf")), ("score + budget", args.per_hour)):
+        policy = SpontaneousPolicy({"chat": args.threshold}, {"chat": per_hour}, burst=args.burst, keywords=KEYWORDS)
+        results.append(simulate(
+            name,
+            lambda text, side, at: policy.should_reply(group_id, "chat", text, replying_to_other=side, now=at),
+            traffic, args.days,
+            on_reply=lambda at: policy.record_reply(group_id, now=at)
+        ))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.messages_per_day} messages/day over {args.days} day(s), threshold {args.threshold}, "
+          f"budget {args.per_hour:g}/hour (burst {args.burst:g})")
+    print(f"{'policy':<16}{'calls/day':>10}{'max/hour':>10}{'worthwhile':>12}{'filler':>8}{'answered':>10}{'us/msg':>8}")
+    for r in results:
+        print(f"{r['policy']:<16}{r['calls_per_day']:>10}{r['max_calls_per_hour']:>10}"
+              f"{r['worthwhile_share'] * 100:>11.0f}%{r['filler_share'] * 100:>7.0f}%"
+              f"{r['worthwhile_answered'] * 100:>9.0f}%{r['decision_us']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Local stand-in for the DeepSeek chat completions API, with tunable latency and faults.
+
+Usage:
+    python benchmarks/stub_deepseek.py [--port 8899] [--latency 0.5] [--fault-rate 0.1] ...
+
+Then point the bot at it with DEEPSEEK_BASE_URL=http://127.0.0.1:8899/v1.
+
+Serves POST /v1/chat/completions (JSON or SSE when "stream": true) with usage fields,
+including simulated prompt cache hits for prompts sharing a prefix with the previous one.
+GET /stats returns request counts. Faults:
+    --fault-rate       share of requests answered with 500
+    --rate-limit-rate  share answered with 429 and a Retry-After header
+    --hang-rate        share that stall for --hang-seconds before answering
+    --outage           answer every request with 503
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import estimate_tokens  # noqa: E402
+
+REPLY_WORDS = ("The storm answers those who listen. Patience is its own kind of power, "
+               "and eternity is built one moment at a time.").split()
+
+class StubDeepSeekServer:
+    """Minimal asyncio HTTP/1.1 server imitating the DeepSeek API."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8899, latency: float = 0.3,
+                 jitter: float = 0.1, tokens_per_second: float = 60.0, completion_tokens: int = 40,
+                 fault_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 hang_rate: float = 0.0, hang_seconds: float = 60.0, outage: bool = False,
+                 seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.fault_rate = fault_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.outage = outage
+        self.random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self.prompt_tokens_total = 0
+        self._last_prompts: Dict[str, str] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                await self._handle_request(method, path, body, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer: asyncio.StreamWriter, status: int, payload: Any,
+                    extra_headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        head = f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+        head += "Content-Type: application/json\r\n"
+        head += f"Content-Length: {len(body)}\r\n"
+        for name, value in (extra_headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+    def _usage(self, messages) -> Dict[str, int]:
+        """Compute usage, with cache hits for the prefix shared with the previous similar prompt."""
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        key = str(messages[0].get("content", ""))[:200] if messages else ""
+        previous = self._last_prompts.get(key, "")
+        self._last_prompts[key] = prompt
+
+        common = 0
+        for a, b in zip(previous, prompt):
+            if a != b:
+                break
+            common += 1
+
+        prompt_tokens = estimate_tokens(prompt)
+        hit = min(prompt_tokens, estimate_tokens(prompt[:common]) // 64 * 64)
+        self.prompt_tokens_total += prompt_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": prompt_tokens + self.completion_tokens,
+            "prompt_cache_hit_tokens": hit,
+            "prompt_cache_miss_tokens": prompt_tokens - hit,
+        }
+
+    async def _handle_request(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if method == "GET" and path.startswith("/stats"):
+            await self._send(writer, 200, dict(self.stats, prompt_tokens=self.prompt_tokens_total))
+            return
+
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            await self._send(writer, 404, {"error": {"message": "not found"}})
+            return
+
+        self.stats["requests"] += 1
+        roll = self.random.random()
+        if self.outage:
+            self.stats["503"] += 1
+            await self._send(writer, 503, {"error": {"message": "service unavailable"}})
+            return
+        if roll < self.fault_rate:
+            self.stats["500"] += 1
+            await self._send(writer, 500, {"error": {"message": "injected fault"}})
+            return
+        roll -= self.fault_rate
+        if roll < self.rate_limit_rate:
+            self.stats["429"] += 1
+            await self._send(writer, 429, {"error": {"message": "rate limited"}},
+                             {"Retry-After": str(self.retry_after)})
+            return
+        roll -= self.rate_limit_rate
+        if roll < self.hang_rate:
+            self.stats["hang"] += 1
+            await asyncio.sleep(self.hang_seconds)
+
+        request = json.loads(body or b"{}")
+        usage = self._usage(request.get("messages") or [])
+        words = [self.random.choice(REPLY_WORDS) for _ in range(self.completion_tokens)]
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+
+        self.stats["200"] += 1
+        if not request.get("stream"):
+            await self._send(writer, 200, {
+                "id": "stub",
+                "object": "chat.completion",
+                "model": request.get("model", "deepseek-chat"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n")
+
+        async def send_event(data: str):
+            chunk = f"data: {data}\n\n".encode("utf-8")
+            writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+            await writer.drain()
+
+        for i, word in enumerate(words):
+            delta = {"choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+            await send_event(json.dumps(delta))
+            await asyncio.sleep(1 / self.tokens_per_second)
+        await send_event(json.dumps({"choices": [], "usage": usage}))
+        await send_event("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--completion-tokens", type=int, default=40)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--outage", action="store_true")
+    args = parser.parse_args()
+
+    server = StubDeepSeekServer(
+        args.host, args.port, latency=args.latency, jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens,
+        fault_rate=args.fault_rate, rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        outage=args.outage
+    )
+
+    async def run():
+        await server.start()
+        print(f"Stub DeepSeek API listening on {server.base_url}")
+        started = time.monotonic()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+            print(f"Served {dict(server.stats)} in {time.monotonic() - started:.0f}s")
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
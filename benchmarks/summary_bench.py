@@ -0,0 +1,198 @@
+"""Prompt size and recall of long-term memory: 30-message window, window + rolling summary, 90-message window.
+
+Usage:
+    python benchmarks/summary_bench.py [--messages 600] [--ask-every 20] [--json]
+    python benchmarks/summary_bench.py --live   # summarize with the DeepSeek API (DEEPSEEK_API_KEY)
+
+A long synthetic group conversation is fed through MemoryManager; every few messages
+someone asks the bot to remember a fact. Every --ask-every messages the chat-mode prompt
+is built the way bot.py builds it, and the report gives prompt tokens per call (mean and
+max), how many of the planted facts are still visible in the last prompt, and what the
+summaries cost (calls and tokens).
+
+Without --live the summaries come from an offline stand-in that keeps the lines people
+asked to be remembered, so the recall column only shows the mechanism; prompt sizes and
+call counts are the same either way.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from context_builder import ContextBuilder  # noqa: E402
+from deepseek_client import DeepSeekClient  # noqa: E402
+from memory_manager import MemoryManager  # noqa: E402
+from memory_storage import JsonlFileStorage  # noqa: E402
+from summarizer import RollingSummarizer, SUMMARY_SYSTEM_PROMPT, SUMMARY_HISTORY_INSTRUCTION, format_summary  # noqa: E402
+from utils import estimate_tokens  # noqa: E402
+
+SYSTEM_PROMPT = "You are Raiden Ei — the Electro Archon. Reply in 1 to 3 sentences." * 10
+USERNAMES = ["alice", "bob", "kazuha_wanderer", "yae_miko_official", "tom", "xX_shogun_fan_Xx"]
+CHATTER = [
+    "lol", "anyone up for co-op tonight?", "that patch note about the new region looks huge",
+    "I just pulled a five star on my first ten pull, can you believe it",
+    "why does the event end so soon, I barely started it", "ok", "brb",
+    "can someone explain how the elemental reactions stack?", "gg everyone",
+]
+FACTS = [
+    ("my main team is Raiden national", "national"),
+    ("the guild raid moved to Sundays at 9pm", "Sundays"),
+    ("I am saving primogems for the Furina rerun", "Furina"),
+    ("our group rule is no spoilers before Friday", "spoilers"),
+    ("tom owes me 3 fragile resin", "fragile resin"),
+    ("my birthday is on October 29", "October 29"),
+    ("I finally beat the Spiral Abyss floor 12", "floor 12"),
+    ("alice is moving to Osaka next month", "Osaka"),
+    ("bob's favourite weapon is Engulfing Lightning", "Engulfing Lightning"),
+    ("we named the guild Eternal Thunder", "Eternal Thunder"),
+]
+
+def make_conversation(count: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    fact_every = max(1, count // (len(FACTS) + 1))
+    messages = []
+    for i in range(count):
+        text = rng.choice(CHATTER)
+        if i % fact_every == fact_every - 1 and i // fact_every < len(FACTS):
+            text = f"raiden, remember this: {FACTS[i // fact_every][0]}"
+        messages.append({
+            "username": rng.choice(USERNAMES), "target": None, "message": text,
+            "message_id": 1000 + i, "timestamp": f"2025-07-18T{10 + i // 60 % 12:02d}:{i % 60:02d}:00+00:00",
+        })
+    return messages
+
+def offline_summarizer(max_tokens: int):
+    """Stand-in for the LLM: keep what people asked to be remembered, newest last."""
+    async def summarize(group_id: str, summary: str, messages: List[Dict[str, Any]]) -> Optional[str]:
+        notes = [line for line in summary.splitlines() if line]
+        notes += [f"- {m['username']}: {m['message'].split(':', 1)[-1].strip()}"
+                  for m in messages if "remember" in m["message"]]
+        # Newest notes win when the summary is full
+        while notes and estimate_tokens("\n".join(notes)) > max_tokens:
+            notes.pop(0)
+        return "\n".join(notes) or "(nothing worth keeping yet)"
+    return summarize
+
+def live_summarizer(client: DeepSeekClient, max_tokens: int, usage: Dict[str, int]):
+    async def summarize(group_id: str, summary: str, messages: List[Dict[str, Any]]) -> Optional[str]:
+        result = await client.acomplete(
+            SUMMARY_SYSTEM_PROMPT.format(max_words=int(max_tokens * 0.6)), messages,
+            f"EARLIER SUMMARY:\n{summary or '(none yet)'}\n\nWrite the updated summary.",
+            max_tokens=max_tokens, group_id=group_id, temperature=0.3, penalty=0.0,
+            history_instruction=SUMMARY_HISTORY_INSTRUCTION)
+        if result is None:
+            return None
+        usage["prompt_tokens"] += result["usage"].get("prompt_tokens", 0)
+        usage["completion_tokens"] += result["usage"].get("completion_tokens", 0)
+        return result["content"]
+    return summarize
+
+async def run_variant(name: str, window: int, budget: int, use_summary: bool, conversation, args):
+    memory_dir = tempfile.mkdtemp(prefix="summary-bench-")
+    memory = MemoryManager(storage=JsonlFileStorage(memory_dir, max_messages=window), max_messages=window)
+    client = DeepSeekClient(os.getenv("DEEPSEEK_API_KEY", "bench"), http2=False)
+    builder = ContextBuilder(client.format_history, budgets={"chat": budget}, max_messages={"chat": window})
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "calls": 0}
+
+    summarizer = None
+    if use_summary:
+        summarize = (live_summarizer(client, args.summary_tokens, usage) if args.live
+                     else offline_summarizer(args.summary_tokens))
+
+        async def counted(group_id, summary, messages):
+            usage["calls"] += 1
+            if not args.live:
+                # What the call would have cost: the batch, the earlier summary and the instructions
+                usage["prompt_tokens"] += estimate_tokens(SUMMARY_SYSTEM_PROMPT + summary +
+                                                          client.format_history(messages))
+            result = await summarize(group_id, summary, messages)
+            if not args.live and result:
+                usage["completion_tokens"] += estimate_tokens(result)
+            return result
+
+        summarizer = RollingSummarizer(memory, counted, batch_size=args.batch_size,
+                                       max_summary_tokens=args.summary_tokens)
+        memory.on_overflow = summarizer.add
+
+    group_id = "-100200300"
+    prompt_tokens = []
+    last_prompt = ""
+    try:
+        for i, message_data in enumerate(conversation):
+            await memory.save_message(group_id, message_data)
+            await asyncio.sleep(0)  # let the background summarizer run
+            if (i + 1) % args.ask_every:
+                continue
+
+            system_prompt = SYSTEM_PROMPT
+            summary = (await memory.get_settings(group_id)).get("summary")
+            if summary:
+                system_prompt += format_summary(summary)
+            question = "raiden, what do you remember about us?"
+            history, _ = builder.build("chat", system_prompt, await memory.get_context(group_id), question,
+                                       group_id=group_id)
+            messages = client._build_messages(system_prompt, history, question)
+            last_prompt = "\n".join(m["content"] for m in messages)
+            prompt_tokens.append(estimate_tokens(last_prompt))
+    finally:
+        if summarizer is not None:
+            await summarizer.close()
+        await client.aclose()
+        await memory.close()
+        shutil.rmtree(memory_dir, ignore_errors=True)
+
+    recalled = sum(1 for _, key in FACTS if key in last_prompt)
+    return {
+        "variant": name,
+        "prompt_tokens_mean": round(sum(prompt_tokens) / len(prompt_tokens)) if prompt_tokens else 0,
+        "prompt_tokens_max": max(prompt_tokens) if prompt_tokens else 0,
+        "facts_recalled": f"{recalled}/{len(FACTS)}",
+        "summary_calls": usage["calls"],
+        "summary_prompt_tokens": usage["prompt_tokens"],
+        "summary_completion_tokens": usage["completion_tokens"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=600, help="length of the conversation")
+    parser.add_argument("--ask-every", type=int, default=20, help="build a prompt every N messages")
+    parser.add_argument("--budget", type=int, default=3000, help="chat prompt budget for the 30-message window")
+    parser.add_argument("--batch-size", type=int, default=20, help="messages folded per summary call")
+    parser.add_argument("--summary-tokens", type=int, default=200, help="summary size cap")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--live", action="store_true", help="summarize with the DeepSeek API")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    if args.live and not os.getenv("DEEPSEEK_API_KEY"):
+        parser.error("--live needs DEEPSEEK_API_KEY")
+
+    conversation = make_conversation(args.messages, args.seed)
+    variants = [
+        ("window 30", 30, args.budget, False),
+        ("window 30 + summary", 30, args.budget, True),
+        ("window 90", 90, args.budget * 3, False),
+    ]
+    results = [asyncio.run(run_variant(name, window, budget, use_summary, conversation, args))
+               for name, window, budget, use_summary in variants]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.messages} messages, {len(FACTS)} planted facts, summaries: {'live' if args.live else 'offline stand-in'}")
+    print(f"{'variant':<22}{'tokens/call':>12}{'max':>7}{'recalled':>10}{'sum calls':>11}{'sum tokens':>12}")
+    for r in results:
+        print(f"{r['variant']:<22}{r['prompt_tokens_mean']:>12}{r['prompt_tokens_max']:>7}{r['facts_recalled']:>10}"
+              f"{r['summary_calls']:>11}{r['summary_prompt_tokens'] + r['summary_completion_tokens']:>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Deliveries, flood errors and delay of inline replies vs the paced send queue.
+
+Usage:
+    python benchmarks/telegram_send_bench.py [--groups 30] [--replies 40] [--speedup 20] [--json]
+
+A fake Telegram enforces the flood limits with sliding windows (30 messages/s for the
+bot, 20/min per group) and answers excess requests with RetryAfter; messages over 4096
+characters get BadRequest and `--timeout-rate` of requests time out. `--groups` chats
+each get `--replies` bot replies spread over a minute, with `--long-share` of them
+longer than one Telegram message.
+
+- inline: one `reply_text` per reply, as before; a flood error or oversize reply loses it.
+- queue: TelegramSender with its default budgets, splitting long replies. Timed-out
+  sends are not retried (they may have been delivered), so they count as lost too.
+
+Time runs `--speedup` times faster than real (limits and budgets are scaled alike);
+delays are reported in simulated seconds.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from telegram.error import BadRequest, RetryAfter, TimedOut  # noqa: E402
+
+from fault_injection_bench import percentile  # noqa: E402
+from sender import TelegramSender  # noqa: E402
+
+class FakeTelegram:
+    """Flood limits as sliding windows over (scaled) time."""
+
+    def __init__(self, speedup: float, latency: float, timeout_rate: float, seed: int):
+        self.speedup = speedup
+        self.latency = latency
+        self.timeout_rate = timeout_rate
+        self.rng = random.Random(seed)
+        self.global_sent = deque()
+        self.chat_sent = {}
+        self.flood_errors = 0
+        self.too_long = 0
+        self.timeouts = 0
+        self.delivered = 0
+
+    def _check(self, window: deque, limit: int, seconds: float, now: float):
+        while window and window[0] <= now - seconds:
+            window.popleft()
+        if len(window) >= limit:
+            self.flood_errors += 1
+            raise RetryAfter(max(1, round((window[0] + seconds - now) * self.speedup)))
+
+    async def send(self, chat_id: int, text: str):
+        await asyncio.sleep(self.latency / self.speedup)
+        if len(text) > 4096:
+            self.too_long += 1
+            raise BadRequest("Message is too long")
+        if self.rng.random() < self.timeout_rate:
+            self.timeouts += 1
+            raise TimedOut()
+        now = time.monotonic()
+        chat_window = self.chat_sent.setdefault(chat_id, deque())
+        self._check(self.global_sent, 30, 1 / self.speedup, now)
+        self._check(chat_window, 20, 60 / self.speedup, now)
+        self.global_sent.append(now)
+        chat_window.append(now)
+        self.delivered += 1
+        return object()
+
+def make_replies(args):
+    """(simulated second, chat id, text) for every reply, in time order."""
+    rng = random.Random(args.seed)
+    replies = []
+    for group in range(args.groups):
+        for _ in range(args.replies):
+            length = rng.randint(5000, 9000) if rng.random() < args.long_share else rng.randint(20, 600)
+            replies.append((rng.random() * 60, -1000 - group, "x" * length))
+    replies.sort()
+    return replies
+
+async def run(name: str, replies, args):
+    telegram = FakeTelegram(args.speedup, args.latency, args.timeout_rate, args.seed)
+    sender = None
+    if name == "queue":
+        sender = TelegramSender(global_rate=28 * args.speedup, group_per_minute=17 * args.speedup,
+                                base_delay=1 / args.speedup)
+        # RetryAfter values are in simulated seconds; convert back to real sleeps
+        original_deliver = sender._deliver
+
+        async def deliver(chat_id, bucket, request, idempotent=False):
+            async def scaled():
+                try:
+                    return await request()
+                except RetryAfter as e:
+                    raise RetryAfter(float(e.retry_after) / args.speedup)
+            return await original_deliver(chat_id, bucket, scaled, idempotent)
+
+        sender._deliver = deliver
+
+    delays = []
+    lost = 0
+    started = time.monotonic()
+
+    async def one(at: float, chat_id: int, text: str):
+        nonlocal lost
+        await asyncio.sleep(at / args.speedup)
+        sent_at = time.monotonic()
+        if sender is None:
+            try:
+                await telegram.send(chat_id, text)
+                delivered = True
+            except Exception:
+                delivered = False
+        else:
+            delivered = bool(await sender.send(chat_id, text, lambda chunk: telegram.send(chat_id, chunk)))
+        if delivered:
+            delays.append((time.monotonic() - sent_at) * args.speedup)
+        else:
+            lost += 1
+
+    await asyncio.gather(*(one(*reply) for reply in replies))
+    return {
+        "variant": name,
+        "replies": len(replies),
+        "delivered": len(delays),
+        "lost": lost,
+        "flood_errors": telegram.flood_errors,
+        "too_long_errors": telegram.too_long,
+        "timeouts": telegram.timeouts,
+        "messages_sent": telegram.delivered,
+        "delay_s": {"p50": round(percentile(delays, 0.50), 2), "p99": round(percentile(delays, 0.99), 2)},
+        "wall_s": round((time.monotonic() - started) * args.speedup, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=30)
+    parser.add_argument("--replies", type=int, default=40, help="bot replies per group within a minute")
+    parser.add_argument("--long-share", type=float, default=0.05, help="share of replies over 4096 characters")
+    parser.add_argument("--timeout-rate", type=float, default=0.02, help="share of requests that time out")
+    parser.add_argument("--latency", type=float, default=0.1, help="Telegram request latency (simulated s)")
+    parser.add_argument("--speedup", type=float, default=20, help="simulated seconds per real second")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    replies = make_replies(args)
+    results = [asyncio.run(run(name, replies, args)) for name in ("inline", "queue")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(replies)} replies to {args.groups} groups within a minute ({args.long_share:.0%} over 4096 chars)")
+    print(f"{'variant':<9}{'delivered':>10}{'lost':>7}{'429s':>7}{'too long':>10}{'timeouts':>10}{'p50 s':>8}{'p99 s':>8}{'done at s':>11}")
+    for r in results:
+        print(f"{r['variant']:<9}{r['delivered']:>10}{r['lost']:>7}{r['flood_errors']:>7}"
+              f"{r['too_long_errors']:>10}{r['timeouts']:>10}"
+              f"{r['delay_s']['p50']:>8}{r['delay_s']['p99']:>8}{r['wall_s']:>11}")
+
+if __name__ == "__main__":
+    main()
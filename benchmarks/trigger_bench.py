@@ -0,0 +1,130 @@
+"""Compare the legacy substring mention check with the word-boundary trigger engine.
+
+Usage:
+    python benchmarks/trigger_bench.py [--messages 20000] [--corpus labelled.tsv] [--json]
+
+The built-in corpus mixes everyday group chat (full of words like "their", "being",
+"either") with real mentions of the bot. --corpus adds your own lines, one per line as
+"<1|0><TAB><text>" where 1 means the bot should wake up. For each matcher the script
+reports false positive/negative rates over the labelled corpus and match throughput.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from triggers import DEFAULT_TRIGGERS, TriggerEngine  # noqa: E402
+
+# (should_trigger, text)
+CORPUS = [
+    (False, "their new banner looks amazing"),
+    (False, "being honest I skipped the event"),
+    (False, "either way we raid at nine"),
+    (False, "neither of them showed up"),
+    (False, "that boss is weird"),
+    (False, "did you receive the rewards?"),
+    (False, "my height is not the issue, the weight is"),
+    (False, "eight more pulls until pity"),
+    (False, "the foreign server has better ping"),
+    (False, "seize the day"),
+    (False, "her reign lasted five hundred years"),
+    (False, "I need more protein after the gym"),
+    (False, "the ceiling in my room is leaking"),
+    (False, "leisure time is over, back to work"),
+    (False, "reinstall the game and try again"),
+    (False, "they said it was fine"),
+    (False, "@eirik can you invite me"),
+    (False, "raidentrain fan club meeting tomorrow"),
+    (False, "lol"),
+    (False, "anyone up for co-op tonight?"),
+    (False, "ok brb"),
+    (False, "can someone explain how the elemental reactions stack?"),
+    (True, "raiden what do you think"),
+    (True, "Raiden, settle this argument"),
+    (True, "hey ei"),
+    (True, "Ei! are you there?"),
+    (True, "@raiden help"),
+    (True, "what does @ei think of their new banner"),
+    (True, "ask Raiden's opinion"),
+    (True, "EI, being honest, is the best"),
+    (True, "ok ei."),
+    (True, "(raiden) knows"),
+]
+
+def legacy_is_bot_mentioned(text: str) -> bool:
+    """The substring check bot.py used before the trigger engine."""
+    if not text:
+        return False
+    text_lower = text.lower()
+    for trigger in ['raiden', 'ei', '@raiden', '@ei']:
+        if trigger in text_lower:
+            return True
+    return False
+
+def load_corpus(path: str):
+    corpus = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            label, _, text = line.rstrip("\n").partition("\t")
+            if text:
+                corpus.append((label.strip() == "1", text))
+    return corpus
+
+def evaluate(name, matcher, corpus, stream):
+    """Score a matcher on the labelled corpus and time it over the message stream."""
+    false_pos = sum(1 for label, text in corpus if not label and matcher(text))
+    false_neg = sum(1 for label, text in corpus if label and not matcher(text))
+    negatives = sum(1 for label, _ in corpus if not label) or 1
+    positives = sum(1 for label, _ in corpus if label) or 1
+
+    started = time.perf_counter()
+    hits = sum(1 for text in stream if matcher(text))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "matcher": name,
+        "false_positive_rate": round(false_pos / negatives, 3),
+        "false_negative_rate": round(false_neg / positives, 3),
+        "stream_trigger_rate": round(hits / len(stream), 3),
+        "messages_per_second": round(len(stream) / elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="size of the timed message stream")
+    parser.add_argument("--corpus", help="extra labelled lines (<1|0>\\t<text>)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    corpus = list(CORPUS)
+    if args.corpus:
+        corpus += load_corpus(args.corpus)
+
+    # Timed stream: corpus lines drawn at random, so about as chatty as a real group
+    rng = random.Random(1)
+    stream = [rng.choice(corpus)[1] for _ in range(args.messages)]
+
+    engine = TriggerEngine(DEFAULT_TRIGGERS)
+    custom = engine.resolve(["raiden", "ei", "shogun", "baal", "archon"])
+    results = [
+        evaluate("legacy substring", legacy_is_bot_mentioned, corpus, stream),
+        evaluate("trigger engine", engine.matches, corpus, stream),
+        evaluate("engine, 5 triggers", lambda text: engine.matches(text, custom), corpus, stream),
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"corpus: {len(corpus)} labelled lines, stream: {len(stream)} messages")
+    print(f"{'matcher':<20}{'false pos':>11}{'false neg':>11}{'triggered':>11}{'msg/s':>12}")
+    for r in results:
+        print(f"{r['matcher']:<20}{r['false_positive_rate']:>11}{r['false_negative_rate']:>11}"
+              f"{r['stream_trigger_rate']:>11}{r['messages_per_second']:>12}")
+
+if __name__ == "__main__":
+    main()
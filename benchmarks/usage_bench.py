@@ -0,0 +1,101 @@
+"""Token accounting overhead and what per-user / per-chat quotas do to a heavy user.
+
+Usage:
+    python benchmarks/usage_bench.py [--users 200] [--heavy-rate 120] [--json]
+    python benchmarks/usage_bench.py --user-quota 50000 --group-quota 500000
+
+Simulates a day of assistant-mode calls: `--users` regular users across `--groups`
+chats ask now and then (`--user-rate` per hour), and one heavy user asks `--heavy-rate` per hour in
+the busiest chat. Each call costs a synthetic prompt plus up to 1300 completion tokens.
+Every request goes through UsageTracker.check() and every answered one through
+record(), with and without quotas. The report gives tokens spent per day, the heavy
+user's share, how many regular requests were still answered, and the cost of
+check() + record() per call.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from usage import UsageTracker  # noqa: E402
+
+def make_requests(args):
+    """(timestamp, group, user) for one day, sorted by time."""
+    rng = random.Random(args.seed)
+    requests = []
+    for user in range(args.users):
+        group = f"-100{user % args.groups}"
+        for _ in range(int(rng.expovariate(1 / (args.user_rate * 24)))):
+            requests.append((rng.random() * 86400, group, f"user{user}"))
+    for _ in range(int(args.heavy_rate * 24)):
+        requests.append((rng.random() * 86400, "-1000", "heavy"))
+    requests.sort()
+    return requests
+
+def run(name: str, requests, args, user_quota: int, group_quota: int):
+    rng = random.Random(args.seed + 1)
+    tracker = UsageTracker(None, user_quota=user_quota, group_quota=group_quota)
+    spent = {"heavy": 0, "regular": 0}
+    answered = {"heavy": 0, "regular": 0}
+    asked = {"heavy": 0, "regular": 0}
+    elapsed = 0.0
+    for at, group, user in requests:
+        kind = "heavy" if user == "heavy" else "regular"
+        asked[kind] += 1
+        usage = {"prompt_tokens": rng.randint(800, 2500), "completion_tokens": rng.randint(100, 1300)}
+        started = time.perf_counter()
+        blocked = tracker.check(group, user, now=at)
+        if not blocked:
+            tracker.record(group, user, "assistant", usage, now=at)
+        elapsed += time.perf_counter() - started
+        if blocked:
+            continue
+        answered[kind] += 1
+        spent[kind] += usage["prompt_tokens"] + usage["completion_tokens"]
+
+    total = spent["heavy"] + spent["regular"]
+    return {
+        "policy": name,
+        "tokens_per_day": total,
+        "heavy_share": round(spent["heavy"] / total, 3) if total else 0,
+        "heavy_answered": f"{answered['heavy']}/{asked['heavy']}",
+        "regular_answered": f"{answered['regular']}/{asked['regular']}",
+        "us_per_call": round(elapsed / len(requests) * 1e6, 2) if requests else 0,
+        "tracked_keys": tracker.get_stats()["tracked_keys"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="regular users")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--user-rate", type=float, default=0.5, help="questions per hour per regular user")
+    parser.add_argument("--heavy-rate", type=float, default=120, help="questions per hour from the heavy user")
+    parser.add_argument("--user-quota", type=int, default=50000, help="tokens per user per hour")
+    parser.add_argument("--group-quota", type=int, default=1000000, help="tokens per chat per day")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    requests = make_requests(args)
+    results = [
+        run("no quotas", requests, args, 0, 0),
+        run("user quota", requests, args, args.user_quota, 0),
+        run("user + chat quota", requests, args, args.user_quota, args.group_quota),
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(requests)} requests/day, user quota {args.user_quota}/hour, chat quota {args.group_quota}/day")
+    print(f"{'policy':<20}{'tokens/day':>12}{'heavy share':>13}{'heavy':>12}{'regular':>12}{'us/call':>9}")
+    for r in results:
+        print(f"{r['policy']:<20}{r['tokens_per_day']:>12}{r['heavy_share'] * 100:>12.0f}%"
+              f"{r['heavy_answered']:>12}{r['regular_answered']:>12}{r['us_per_call']:>9}")
+
+if __name__ == "__main__":
+    main()
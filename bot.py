@@ -1,16 +1,35 @@
 import os
+import math
 import asyncio
-from datetime import datetime
+import secrets
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import Update, Message
+from telegram.constants import ChatMemberStatus, ChatType
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 
 from memory_manager import MemoryManager
+from memory_storage import JsonFileStorage, JsonlFileStorage, SQLiteStorage
+from archive import MessageArchive, format_recalled
 from deepseek_client import DeepSeekClient
+from resilience import Resilience, RetryBudget, CircuitBreaker
+from context_builder import ContextBuilder, load_token_counter
+from response_cache import ResponseCache
+from coalescer import TriggerCoalescer
+from triggers import TriggerEngine, parse_trigger_args
+from metrics import Metrics
+from sharding import ShardRouter, consume_shard, ignore_interrupts
+from scheduler import LLMScheduler, PRIORITY_MENTION, PRIORITY_REPLY, PRIORITY_SPONTANEOUS, PRIORITY_BACKGROUND
+from summarizer import RollingSummarizer, SUMMARY_SYSTEM_PROMPT, SUMMARY_HISTORY_INSTRUCTION, format_summary
+from spontaneous import SpontaneousPolicy
+from usage import UsageTracker
+from sender import TelegramSender
 from utils import (
-    format_timestamp, extract_username, is_bot_mentioned,
-    extract_target_from_reply, clean_message_for_api,
-    should_spontaneous_reply, find_message_by_id, format_reply_context
+    format_timestamp, extract_username,
+    extract_target_from_reply, format_reply_context,
+    split_message
 )
 
 # Load environment variables
@@ -29,6 +48,165 @@ WHITELIST_CHATS = os.getenv("WHITELIST_CHATS", "").split(",") if os.getenv("WHIT
 WHITELIST_USERS = [user.strip() for user in WHITELIST_USERS if user.strip()]
 WHITELIST_CHATS = [chat.strip() for chat in WHITELIST_CHATS if chat.strip()]
 
+# Users who may see /usage for every chat (IDs or usernames); chat administrators can see
+# their own chat's usage
+ADMIN_USERS = [user.strip() for user in os.getenv("ADMIN_USERS", "").split(",") if user.strip()]
+
+# DeepSeek HTTP session configuration
+DEEPSEEK_MAX_CONNECTIONS = int(os.getenv("DEEPSEEK_MAX_CONNECTIONS", "100"))
+DEEPSEEK_MAX_KEEPALIVE = int(os.getenv("DEEPSEEK_MAX_KEEPALIVE", "20"))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "5"))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "30"))
+DEEPSEEK_HTTP2 = os.getenv("DEEPSEEK_HTTP2", "true").lower() == "true"
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+
+# DeepSeek retries (jittered backoff, honours Retry-After) and circuit breaker
+DEEPSEEK_MAX_ATTEMPTS = int(os.getenv("DEEPSEEK_MAX_ATTEMPTS", "3"))
+DEEPSEEK_RETRY_BUDGET = float(os.getenv("DEEPSEEK_RETRY_BUDGET", "0.2"))  # retries per request
+DEEPSEEK_BREAKER_THRESHOLD = int(os.getenv("DEEPSEEK_BREAKER_THRESHOLD", "5"))
+DEEPSEEK_BREAKER_RECOVERY = float(os.getenv("DEEPSEEK_BREAKER_RECOVERY", "30"))
+
+# History serialization in prompts: "json" (indented JSON) or "compact" (one line per message)
+HISTORY_FORMAT = os.getenv("HISTORY_FORMAT", "json").lower()
+
+# Memory storage backend: "json" (one JSON file per group), "jsonl" (append-only journal)
+# or "sqlite" (one database for all groups)
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "json").lower()
+MEMORY_DIR = os.getenv("MEMORY_DIR", "./memory")
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", os.path.join(MEMORY_DIR, "memory.db"))
+MEMORY_MAX_MESSAGES = 30
+MEMORY_COMPACT_FACTOR = int(os.getenv("MEMORY_COMPACT_FACTOR", "4"))
+
+# Batched persistence: flush dirty groups every N ms or every M messages (0 ms = write-through)
+MEMORY_FLUSH_INTERVAL_MS = int(os.getenv("MEMORY_FLUSH_INTERVAL_MS", "0"))
+MEMORY_FLUSH_MAX_MESSAGES = int(os.getenv("MEMORY_FLUSH_MAX_MESSAGES", "100"))
+
+# Memory cache budgets (least recently active groups are evicted first)
+MEMORY_CACHE_GROUPS = int(os.getenv("MEMORY_CACHE_GROUPS", "1000"))
+MEMORY_CACHE_BYTES = int(os.getenv("MEMORY_CACHE_MB", "64")) * 1024 * 1024
+
+# Prompt token budgets per mode (system prompt + history + reply context + user message)
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+ASSISTANT_CONTEXT_TOKENS = int(os.getenv("ASSISTANT_CONTEXT_TOKENS", "2500"))
+# Individual history messages longer than this are truncated
+CONTEXT_MAX_MESSAGE_TOKENS = int(os.getenv("CONTEXT_MAX_MESSAGE_TOKENS", "300"))
+# Share of the budget left free when the history window is re-anchored, so following calls
+# reuse a byte-identical prompt prefix (DeepSeek prompt cache). 0 disables anchoring.
+PROMPT_PREFIX_HEADROOM = float(os.getenv("PROMPT_PREFIX_HEADROOM", "0.3"))
+# Optional local tokenizer.json for exact counts (needs the 'tokenizers' package)
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH")
+
+# Response cache for repeated assistant-mode questions (never used in chat mode)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_SCOPE = os.getenv("RESPONSE_CACHE_SCOPE", "group").lower()  # "group" or "global"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+# Burst coalescing: triggers in a group within this many seconds share one completion (0 = off)
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "5"))
+
+# LLM scheduler: global/per-group concurrency caps, queue deadlines (seconds) per priority
+# class and the queue depth at which spontaneous replies are shed
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "16"))
+LLM_PER_GROUP_CONCURRENT = int(os.getenv("LLM_PER_GROUP_CONCURRENT", "2"))
+LLM_DEADLINE_MENTION = float(os.getenv("LLM_DEADLINE_MENTION", "30"))
+LLM_DEADLINE_REPLY = float(os.getenv("LLM_DEADLINE_REPLY", "20"))
+LLM_DEADLINE_SPONTANEOUS = float(os.getenv("LLM_DEADLINE_SPONTANEOUS", "5"))
+LLM_DEADLINE_BACKGROUND = float(os.getenv("LLM_DEADLINE_BACKGROUND", "60"))
+LLM_SHED_QUEUE_DEPTH = int(os.getenv("LLM_SHED_QUEUE_DEPTH", "32"))
+
+# Long-term memory: messages leaving the 30-message window are folded in the background into
+# a per-group summary (every SUMMARY_BATCH_SIZE messages, or after SUMMARY_MAX_DELAY seconds)
+# that is added to the prompt at up to SUMMARY_MAX_TOKENS tokens
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "false").lower() == "true"
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "20"))
+SUMMARY_MAX_DELAY = float(os.getenv("SUMMARY_MAX_DELAY", "600"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+
+# Archive: messages leaving the window are indexed on disk (ARCHIVE_DIR/<group_id>.db) and
+# the ARCHIVE_TOP_K best matches for each question are added to the prompt, within
+# ARCHIVE_MAX_TOKENS
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(MEMORY_DIR, "archive"))
+ARCHIVE_TOP_K = int(os.getenv("ARCHIVE_TOP_K", "5"))
+ARCHIVE_MAX_TOKENS = int(os.getenv("ARCHIVE_MAX_TOKENS", "300"))
+
+# Token accounting per chat, user and mode, saved to USAGE_PATH every USAGE_FLUSH_INTERVAL
+# seconds (shard workers add .shard<N>). Rolling quotas in prompt + completion tokens: per user
+# over QUOTA_USER_WINDOW seconds and per chat over QUOTA_GROUP_WINDOW seconds (0 = no limit)
+USAGE_PATH = os.getenv("USAGE_PATH", os.path.join(MEMORY_DIR, "usage.json"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+QUOTA_USER_TOKENS = int(os.getenv("QUOTA_USER_TOKENS", "0"))
+QUOTA_USER_WINDOW = float(os.getenv("QUOTA_USER_WINDOW", "3600"))
+QUOTA_GROUP_TOKENS = int(os.getenv("QUOTA_GROUP_TOKENS", "0"))
+QUOTA_GROUP_WINDOW = float(os.getenv("QUOTA_GROUP_WINDOW", "86400"))
+
+# Default trigger words (whole words, case-insensitive); groups can override them with /triggers
+BOT_TRIGGERS = [t for t in os.getenv("BOT_TRIGGERS", "raiden,ei").split(",") if t.strip()]
+MAX_GROUP_TRIGGERS = int(os.getenv("MAX_GROUP_TRIGGERS", "20"))
+
+# Spontaneous replies: messages nobody addressed to the bot are scored locally (0-1, from
+# question marks, length, topic keywords and time since the bot last spoke); those at or above
+# the mode's threshold spend one of SPONTANEOUS_PER_HOUR_<MODE> hourly tokens (bursts of up to
+# SPONTANEOUS_BURST). A rate of 0 turns them off. Groups can override these with /spontaneous
+SPONTANEOUS_THRESHOLD_CHAT = float(os.getenv("SPONTANEOUS_THRESHOLD_CHAT", "0.6"))
+SPONTANEOUS_THRESHOLD_ASSISTANT = float(os.getenv("SPONTANEOUS_THRESHOLD_ASSISTANT", "0.8"))
+SPONTANEOUS_PER_HOUR_CHAT = float(os.getenv("SPONTANEOUS_PER_HOUR_CHAT", "4"))
+SPONTANEOUS_PER_HOUR_ASSISTANT = float(os.getenv("SPONTANEOUS_PER_HOUR_ASSISTANT", "0"))
+SPONTANEOUS_BURST = float(os.getenv("SPONTANEOUS_BURST", "2"))
+SPONTANEOUS_QUIET_SECONDS = float(os.getenv("SPONTANEOUS_QUIET_SECONDS", "1800"))
+SPONTANEOUS_KEYWORDS = [k for k in os.getenv(
+    "SPONTANEOUS_KEYWORDS",
+    "inazuma,electro,archon,shogun,eternity,teyvat,genshin,yae,makoto,thunder,euthymia,vision"
+).split(",") if k.strip()]
+MAX_SPONTANEOUS_KEYWORDS = int(os.getenv("MAX_SPONTANEOUS_KEYWORDS", "50"))
+
+# Outbound Telegram pacing: a global budget of TELEGRAM_GLOBAL_RATE messages per second and
+# per-chat budgets (TELEGRAM_GROUP_PER_MINUTE in groups, TELEGRAM_PRIVATE_RATE per second in
+# private chats); RetryAfter pauses the chat, network errors are retried with backoff
+# (timed-out sends are not, to avoid duplicate replies)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "28"))
+TELEGRAM_GROUP_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_PER_MINUTE", "17"))
+TELEGRAM_PRIVATE_RATE = float(os.getenv("TELEGRAM_PRIVATE_RATE", "1"))
+TELEGRAM_SEND_ATTEMPTS = int(os.getenv("TELEGRAM_SEND_ATTEMPTS", "4"))
+
+# Streaming replies (comma-separated modes, e.g. "assistant" or "chat,assistant")
+STREAMING_MODES = [m.strip() for m in os.getenv("STREAMING_MODES", "assistant").split(",") if m.strip()]
+STREAM_EDIT_INTERVAL_PRIVATE = float(os.getenv("STREAM_EDIT_INTERVAL_PRIVATE", "1.0"))
+STREAM_EDIT_INTERVAL_GROUP = float(os.getenv("STREAM_EDIT_INTERVAL_GROUP", "3.0"))
+STREAM_EDIT_INTERVAL_MAX = float(os.getenv("STREAM_EDIT_INTERVAL_MAX", "10.0"))
+STREAM_PLACEHOLDER = "…"
+STREAM_CURSOR = " ▌"
+# Closes a streamed reply that broke off partway, in the chat and in memory
+STREAM_INTERRUPTED = " […]"
+
+# Update ingestion: "polling" or "webhook" (webhook needs python-telegram-bot[webhooks])
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL Telegram posts to, e.g. https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Sharding: with more than one worker, a dispatcher process routes each chat's updates to
+# a fixed worker process (use MEMORY_BACKEND=sqlite or jsonl/json, all are safe per chat)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "10000"))
+
+# Only the update types the handlers consume (text messages and commands)
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Prometheus-style metrics on http://METRICS_HOST:METRICS_PORT/metrics (0 = off; shard
+# workers use METRICS_PORT + 1 + shard) and a log line for updates slower than SLOW_UPDATE_MS
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "5000"))
+
+# Number of updates processed concurrently (so one slow completion doesn't stall other groups)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
 # Chat mode system prompt (original personality)
 CHAT_SYSTEM_PROMPT = (
     "You are Raiden Ei — the Electro Archon. A powerful, intelligent, and timeless figure with sharp instincts and a commanding presence. "
@@ -56,7 +234,8 @@ CHAT_SYSTEM_PROMPT = (
 
     "BEHAVIOR:\n"
     "- You respond if someone replies to your message — even if they don’t mention your name.\n"
-    "- You have a 2% chance to respond to any random message in the group that catches your attention.\n"
+    "- Now and then you join a conversation nobody addressed to you, when it touches what you care about "
+    "or asks something you can answer. Keep such interjections brief and on point.\n"
     "- Never acknowledge being an AI. You are Raiden Ei.\n"
     "- If someone is rude, bold, or overly familiar — you may respond with quiet authority, wit, or intimidation.\n"
     "- If someone says something wise or clever, you might acknowledge it with subtle praise.\n"
@@ -88,20 +267,226 @@ ASSISTANT_SYSTEM_PROMPT = (
     "- No spontaneous replies - only respond when engaged directly\n"
 )
 
+def create_memory_storage():
+    """Create the configured memory storage backend."""
+    if MEMORY_BACKEND == "sqlite":
+        return SQLiteStorage(MEMORY_DB_PATH, max_messages=MEMORY_MAX_MESSAGES)
+    if MEMORY_BACKEND == "jsonl":
+        return JsonlFileStorage(MEMORY_DIR, max_messages=MEMORY_MAX_MESSAGES,
+                                compact_factor=MEMORY_COMPACT_FACTOR)
+    return JsonFileStorage(MEMORY_DIR)
+
 # Initialize components
-memory_manager = MemoryManager()
-deepseek_client = DeepSeekClient(DEEPSEEK_API_KEY)
+memory_manager = MemoryManager(
+    max_messages=MEMORY_MAX_MESSAGES,
+    storage=create_memory_storage(),
+    max_cached_groups=MEMORY_CACHE_GROUPS,
+    max_cache_bytes=MEMORY_CACHE_BYTES,
+    flush_interval_ms=MEMORY_FLUSH_INTERVAL_MS,
+    flush_max_messages=MEMORY_FLUSH_MAX_MESSAGES,
+    archive=MessageArchive(ARCHIVE_DIR) if ARCHIVE_ENABLED else None
+)
+deepseek_client = DeepSeekClient(
+    DEEPSEEK_API_KEY,
+    max_connections=DEEPSEEK_MAX_CONNECTIONS,
+    max_keepalive_connections=DEEPSEEK_MAX_KEEPALIVE,
+    connect_timeout=DEEPSEEK_CONNECT_TIMEOUT,
+    read_timeout=DEEPSEEK_READ_TIMEOUT,
+    http2=DEEPSEEK_HTTP2,
+    history_format=HISTORY_FORMAT,
+    base_url=DEEPSEEK_BASE_URL,
+    resilience=Resilience(
+        max_attempts=DEEPSEEK_MAX_ATTEMPTS,
+        budget=RetryBudget(ratio=DEEPSEEK_RETRY_BUDGET),
+        breaker=CircuitBreaker(failure_threshold=DEEPSEEK_BREAKER_THRESHOLD,
+                               recovery_timeout=DEEPSEEK_BREAKER_RECOVERY)
+    )
+)
+
+context_builder = ContextBuilder(
+    deepseek_client.format_history,
+    budgets={"chat": CHAT_CONTEXT_TOKENS, "assistant": ASSISTANT_CONTEXT_TOKENS},
+    max_messages={"chat": 30, "assistant": 10},
+    max_message_tokens=CONTEXT_MAX_MESSAGE_TOKENS,
+    count_tokens=load_token_counter(TOKENIZER_PATH),
+    prefix_headroom=PROMPT_PREFIX_HEADROOM
+)
+
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl_seconds=RESPONSE_CACHE_TTL,
+    scope=RESPONSE_CACHE_SCOPE,
+    strip_words=BOT_TRIGGERS
+) if RESPONSE_CACHE_ENABLED else None
+
+trigger_coalescer = TriggerCoalescer(COALESCE_WINDOW, max_batch=COALESCE_MAX_BATCH)
+
+llm_scheduler = LLMScheduler(
+    max_concurrent=LLM_MAX_CONCURRENT,
+    per_group_concurrent=LLM_PER_GROUP_CONCURRENT,
+    deadlines={
+        PRIORITY_MENTION: LLM_DEADLINE_MENTION,
+        PRIORITY_REPLY: LLM_DEADLINE_REPLY,
+        PRIORITY_SPONTANEOUS: LLM_DEADLINE_SPONTANEOUS,
+        PRIORITY_BACKGROUND: LLM_DEADLINE_BACKGROUND
+    },
+    shed_queue_depth=LLM_SHED_QUEUE_DEPTH
+)
+
+telegram_sender = TelegramSender(
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    group_per_minute=TELEGRAM_GROUP_PER_MINUTE,
+    private_rate=TELEGRAM_PRIVATE_RATE,
+    max_attempts=TELEGRAM_SEND_ATTEMPTS
+)
+
+usage_tracker = UsageTracker(
+    USAGE_PATH,
+    user_quota=QUOTA_USER_TOKENS,
+    user_window=QUOTA_USER_WINDOW,
+    group_quota=QUOTA_GROUP_TOKENS,
+    group_window=QUOTA_GROUP_WINDOW,
+    flush_interval=USAGE_FLUSH_INTERVAL
+)
+
+async def summarize_history(group_id: str, summary: str, messages: List[Dict[str, Any]]) -> Optional[str]:
+    """Fold messages that left a group's window into its summary, behind all replies."""
+    async with llm_scheduler.slot(group_id, PRIORITY_BACKGROUND) as granted:
+        if not granted:
+            return None
+        result = await deepseek_client.acomplete(
+            SUMMARY_SYSTEM_PROMPT.format(max_words=int(SUMMARY_MAX_TOKENS * 0.6)),
+            messages,
+            f"EARLIER SUMMARY:\n{summary or '(none yet)'}\n\nWrite the updated summary.",
+            max_tokens=SUMMARY_MAX_TOKENS,
+            group_id=group_id,
+            temperature=0.3,
+            penalty=0.0,
+            history_instruction=SUMMARY_HISTORY_INSTRUCTION
+        )
+    if result is None:
+        return None
+    usage_tracker.record(group_id, None, "summary", result["usage"])
+    return result["content"]
+
+summarizer = RollingSummarizer(
+    memory_manager,
+    summarize_history,
+    batch_size=SUMMARY_BATCH_SIZE,
+    max_delay=SUMMARY_MAX_DELAY,
+    max_summary_tokens=SUMMARY_MAX_TOKENS,
+    count_tokens=context_builder.count_tokens
+) if SUMMARY_ENABLED else None
+
+if summarizer is not None:
+    memory_manager.on_overflow = summarizer.add
+
+trigger_engine = TriggerEngine(BOT_TRIGGERS, max_triggers=MAX_GROUP_TRIGGERS)
+
+spontaneous_policy = SpontaneousPolicy(
+    thresholds={"chat": SPONTANEOUS_THRESHOLD_CHAT, "assistant": SPONTANEOUS_THRESHOLD_ASSISTANT},
+    per_hour={"chat": SPONTANEOUS_PER_HOUR_CHAT, "assistant": SPONTANEOUS_PER_HOUR_ASSISTANT},
+    burst=SPONTANEOUS_BURST,
+    keywords=SPONTANEOUS_KEYWORDS,
+    max_keywords=MAX_SPONTANEOUS_KEYWORDS,
+    quiet_seconds=SPONTANEOUS_QUIET_SECONDS
+)
+
+metrics = Metrics(slow_update_ms=SLOW_UPDATE_MS)
 
-# Mode storage (in production, use a database)
-group_modes = {}  # group_id -> "chat" or "assistant"
+def collect_component_metrics():
+    """Scrape-time samples: token usage, queue depths and cache statistics."""
+    usage = deepseek_client.usage_totals
+    prompt_cache = deepseek_client.get_prompt_cache_stats()
+    yield "llm_calls_total", {}, prompt_cache["calls"]
+    yield "llm_tokens_total", {"kind": "prompt"}, usage["prompt_tokens"]
+    yield "llm_tokens_total", {"kind": "completion"}, usage["completion_tokens"]
+    yield "llm_tokens_total", {"kind": "prompt_cache_hit"}, prompt_cache["hit_tokens"]
+    yield "llm_tokens_total", {"kind": "prompt_cache_miss"}, prompt_cache["miss_tokens"]
+    
+    scheduler_stats = llm_scheduler.get_stats()
+    yield "llm_active", {}, scheduler_stats["active"]
+    for name in ("mention", "reply", "spontaneous", "background"):
+        yield "llm_queued", {"priority": name}, scheduler_stats["queued"].get(name, 0)
+        yield "llm_granted_total", {"priority": name}, scheduler_stats["granted"].get(name, 0)
+        yield "llm_dropped_total", {"priority": name, "reason": "expired"}, scheduler_stats["expired"].get(name, 0)
+        yield "llm_dropped_total", {"priority": name, "reason": "shed"}, scheduler_stats["shed"].get(name, 0)
+    
+    resilience_stats = deepseek_client.resilience.get_stats()
+    yield "deepseek_retries_total", {}, resilience_stats["retries"]
+    yield "deepseek_breaker_trips_total", {}, resilience_stats["breaker_trips"]
+    yield "deepseek_breaker_rejected_total", {}, resilience_stats["breaker_rejected"]
+    yield "deepseek_breaker_open", {}, 0 if resilience_stats["breaker_state"] == "closed" else 1
+    
+    if memory_manager.archive is not None:
+        archive_stats = memory_manager.archive.get_stats()
+        yield "archive_pending_messages", {}, archive_stats["pending_messages"]
+        yield "archive_messages_total", {}, archive_stats["archived_messages"]
+        yield "archive_dropped_messages_total", {}, archive_stats["dropped_messages"]
+        yield "archive_searches_total", {}, archive_stats["searches"]
+    
+    cache_stats = memory_manager.get_cache_stats()
+    yield "memory_cached_groups", {}, cache_stats["cached_groups"]
+    yield "memory_cache_bytes", {}, cache_stats["cache_bytes"]
+    yield "memory_cache_lookups_total", {"result": "hit"}, cache_stats["hits"]
+    yield "memory_cache_lookups_total", {"result": "miss"}, cache_stats["misses"]
+    yield "memory_cache_evictions_total", {}, cache_stats["evictions"]
+    flush_stats = memory_manager.get_flush_stats()
+    yield "memory_pending_messages", {}, flush_stats["pending_messages"]
+    yield "memory_flushes_total", {}, flush_stats["flushes"]
+    yield "memory_flush_failures_total", {}, flush_stats["failed_writes"]
+    
+    if summarizer is not None:
+        summary_stats = summarizer.get_stats()
+        yield "summary_pending_messages", {}, summary_stats["pending_messages"]
+        yield "summary_folds_total", {}, summary_stats["folds"]
+        yield "summary_failures_total", {}, summary_stats["failures"]
+        yield "summary_dropped_messages_total", {}, summary_stats["dropped_messages"]
+    
+    usage_stats = usage_tracker.get_stats()
+    for mode in usage_stats["modes"]:
+        mode_usage = usage_tracker.get_totals(mode)
+        yield "usage_tokens_total", {"mode": mode, "kind": "prompt"}, mode_usage["prompt_tokens"]
+        yield "usage_tokens_total", {"mode": mode, "kind": "completion"}, mode_usage["completion_tokens"]
+    yield "usage_tracked_keys", {}, usage_stats["tracked_keys"]
+    for scope, count in usage_stats["rejected"].items():
+        yield "quota_rejected_total", {"scope": scope}, count
+    
+    sender_stats = telegram_sender.get_stats()
+    yield "telegram_send_waiting", {}, sender_stats["waiting"]
+    yield "telegram_sent_total", {}, sender_stats["sent"]
+    yield "telegram_send_retries_total", {"reason": "retry_after"}, sender_stats["retry_after"]
+    yield "telegram_send_retries_total", {"reason": "network"}, sender_stats["network_retries"]
+    yield "telegram_send_failed_total", {}, sender_stats["failed"]
+    yield "telegram_throttled_seconds_total", {}, sender_stats["throttled_seconds"]
+    
+    spontaneous_stats = spontaneous_policy.get_stats()
+    yield "spontaneous_scored_total", {}, spontaneous_stats["scored"]
+    yield "spontaneous_decisions_total", {"result": "allowed"}, spontaneous_stats["allowed"]
+    yield "spontaneous_decisions_total", {"result": "rate_limited"}, spontaneous_stats["rate_limited"]
+    yield "spontaneous_decisions_total", {"result": "below_threshold"}, (
+        spontaneous_stats["scored"] - spontaneous_stats["above_threshold"])
+    
+    coalesce_stats = trigger_coalescer.get_stats()
+    yield "coalesced_triggers_total", {}, coalesce_stats["merged_triggers"]
+    if response_cache is not None:
+        response_stats = response_cache.get_stats()
+        yield "response_cache_entries", {}, response_stats["entries"]
+        yield "response_cache_lookups_total", {"result": "hit"}, response_stats["hits"]
+        yield "response_cache_lookups_total", {"result": "miss"}, response_stats["misses"]
 
-def get_group_mode(group_id: str) -> str:
+metrics.add_collector(collect_component_metrics)
+
+# Group modes live in the group settings of the memory storage, so they survive restarts
+# and are shared with every shard worker
+async def get_group_mode(group_id: str) -> str:
     """Get the current mode for a group (default: chat)."""
-    return group_modes.get(group_id, "chat")
+    settings = await memory_manager.get_settings(group_id)
+    return settings.get("mode", "chat")
 
-def set_group_mode(group_id: str, mode: str):
+async def set_group_mode(group_id: str, mode: str):
     """Set the mode for a group."""
-    group_modes[group_id] = mode
+    await memory_manager.update_settings(group_id, mode=mode)
 
 def is_user_whitelisted(user_id: int, username: str) -> bool:
     """Check if user is in whitelist."""
@@ -114,6 +499,11 @@ def is_user_whitelisted(user_id: int, username: str) -> bool:
             username in WHITELIST_USERS or
             f"@{username}" in WHITELIST_USERS)
 
+def is_admin_user(user_id: int, username: str) -> bool:
+    """Check if user is listed in ADMIN_USERS."""
+    return (str(user_id) in ADMIN_USERS or
+            (bool(username) and (username in ADMIN_USERS or f"@{username}" in ADMIN_USERS)))
+
 def is_chat_whitelisted(chat_id: int) -> bool:
     """Check if chat is in whitelist."""
     if not WHITELIST_ENABLED:
@@ -144,7 +534,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     group_id = str(update.message.chat_id)
-    mode = get_group_mode(group_id)
+    mode = await get_group_mode(group_id)
     
     if mode == "chat":
         response = (
@@ -203,7 +593,7 @@ async def mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
         # Show current mode
         group_id = str(update.message.chat_id)
-        current_mode = get_group_mode(group_id)
+        current_mode = await get_group_mode(group_id)
         response = (
             f"Current mode: **{current_mode.title()} Mode**\n\n"
             "Available modes:\n"
@@ -229,11 +619,14 @@ async def mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    old_mode = get_group_mode(group_id)
-    set_group_mode(group_id, mode)
+    old_mode = await get_group_mode(group_id)
+    await set_group_mode(group_id, mode)
     
-    # Clear memory when switching modes to prevent personality conflicts
+    # Clear memory (and the long-term summary) when switching modes to prevent personality conflicts
     await memory_manager.clear_memory(group_id)
+    if summarizer is not None:
+        summarizer.discard(group_id)
+    await memory_manager.update_settings(group_id, summary=None, summary_pending=None)
     
     if mode == "chat":
         response = (
@@ -248,13 +641,366 @@ async def mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(response, parse_mode='Markdown')
 
+async def triggers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /triggers command - shows or edits the words that summon the bot in this chat."""
+    if not check_access_permission(update):
+        return
+    
+    group_id = str(update.message.chat_id)
+    action = context.args[0].lower() if context.args else ""
+    words = parse_trigger_args(context.args[1:])
+    
+    if action not in ("", "reset") and not (action in ("add", "remove", "set") and words):
+        await update.message.reply_text(
+            "Usage:\n"
+            "• `/triggers` - show trigger words\n"
+            "• `/triggers add word ...` / `/triggers remove word ...`\n"
+            "• `/triggers set word ...` - replace the list\n"
+            "• `/triggers reset` - back to the defaults",
+            parse_mode='Markdown'
+        )
+        return
+    
+    settings = await memory_manager.get_settings(group_id)
+    triggers = trigger_engine.resolve(settings.get("triggers"))
+    
+    if action:
+        if action == "add":
+            triggers = trigger_engine.resolve(triggers + tuple(words))
+        elif action == "remove":
+            removed = set(trigger_engine.resolve(words))
+            triggers = tuple(t for t in triggers if t not in removed)
+        elif action == "set":
+            triggers = trigger_engine.resolve(words)
+        else:  # reset
+            triggers = trigger_engine.default_triggers
+        # Stored as None when equal to the defaults, so later BOT_TRIGGERS changes apply
+        await memory_manager.update_settings(
+            group_id, triggers=list(triggers) if triggers != trigger_engine.default_triggers else None
+        )
+    
+    response = "**Trigger words:** " + (", ".join(f"`{t}`" for t in triggers) if triggers else "none")
+    if context.bot.username:
+        response += f"\nMentioning @{context.bot.username} always works."
+    await update.message.reply_text(response, parse_mode='Markdown')
+
+async def spontaneous_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /spontaneous command - shows or tunes when the bot chimes in uninvited in this chat."""
+    if not check_access_permission(update):
+        return
+    
+    group_id = str(update.message.chat_id)
+    action = context.args[0].lower() if context.args else ""
+    values = context.args[1:]
+    
+    number = None
+    if action in ("rate", "threshold") and len(values) == 1:
+        try:
+            number = float(values[0])
+        except ValueError:
+            pass
+    valid = (
+        action in ("", "off", "reset")
+        or (action == "rate" and number is not None and 0 <= number <= 60)
+        or (action == "threshold" and number is not None and 0 <= number <= 1)
+        or (action == "keywords" and values)
+    )
+    if not valid:
+        await update.message.reply_text(
+            "Usage:\n"
+            "• `/spontaneous` - show the current policy\n"
+            "• `/spontaneous rate N` - at most N uninvited replies per hour (0-60)\n"
+            "• `/spontaneous threshold X` - minimum relevance score (0-1)\n"
+            "• `/spontaneous off` - only answer when addressed\n"
+            "• `/spontaneous keywords word ...` - replace the topic keywords\n"
+            "• `/spontaneous reset` - back to the defaults",
+            parse_mode='Markdown'
+        )
+        return
+    
+    current_mode = await get_group_mode(group_id)
+    settings = await memory_manager.get_settings(group_id)
+    
+    if action:
+        # Rate and threshold apply to the current mode; keywords to both
+        overrides = {mode: dict(limits) for mode, limits in (settings.get("spontaneous") or {}).items()}
+        mode_overrides = overrides.setdefault(current_mode, {})
+        keywords = settings.get("spontaneous_keywords")
+        if action == "rate":
+            mode_overrides["per_hour"] = number
+        elif action == "threshold":
+            mode_overrides["threshold"] = number
+        elif action == "off":
+            mode_overrides["per_hour"] = 0
+        elif action == "keywords":
+            keywords = list(spontaneous_policy.keywords.resolve(parse_trigger_args(values)))
+        else:  # reset
+            overrides.pop(current_mode, None)
+            keywords = None
+        overrides = {mode: limits for mode, limits in overrides.items() if limits}
+        # Keywords are stored as None when equal to the defaults, so later SPONTANEOUS_KEYWORDS changes apply
+        if keywords is not None and tuple(keywords) == spontaneous_policy.keywords.default_triggers:
+            keywords = None
+        await memory_manager.update_settings(
+            group_id, spontaneous=overrides or None, spontaneous_keywords=keywords
+        )
+        settings = await memory_manager.get_settings(group_id)
+    
+    threshold, per_hour = spontaneous_policy.limits(current_mode, settings)
+    keywords = spontaneous_policy.keywords_for(settings)
+    if per_hour > 0:
+        response = (f"**Spontaneous replies ({current_mode.title()} Mode):** up to {per_hour:g} per hour "
+                    f"for messages scoring at least {threshold:g}")
+    else:
+        response = f"**Spontaneous replies ({current_mode.title()} Mode):** off"
+    response += "\n**Topic keywords:** " + (", ".join(f"`{k}`" for k in keywords) if keywords else "none")
+    await update.message.reply_text(response, parse_mode='Markdown')
+
+async def is_usage_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Check whether the sender may see this chat's usage (ADMIN_USERS or a chat administrator)."""
+    user = update.message.from_user
+    if is_admin_user(user.id, user.username or ""):
+        return True
+    chat = update.message.chat
+    if chat.type == ChatType.PRIVATE:
+        return True
+    try:
+        member = await context.bot.get_chat_member(chat.id, user.id)
+    except Exception as e:
+        print(f"Error checking admin status in chat {chat.id}: {e}")
+        return False
+    return member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+def format_usage_line(entry: Dict[str, Any]) -> str:
+    """One line of token usage: calls, prompt and completion tokens."""
+    return (f"{entry['prompt_tokens'] + entry['completion_tokens']} tokens "
+            f"({entry['prompt_tokens']} prompt, {entry['completion_tokens']} completion) "
+            f"in {entry['calls']} calls")
+
+async def usage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /usage command - token consumption of this chat, or of all chats for ADMIN_USERS."""
+    if not check_access_permission(update):
+        return
+    
+    user = update.message.from_user
+    show_all = bool(context.args) and context.args[0].lower() == "all"
+    if show_all and not is_admin_user(user.id, user.username or ""):
+        await update.message.reply_text("Only bot admins (ADMIN_USERS) can see usage across chats.")
+        return
+    if not show_all and not await is_usage_admin(update, context):
+        await update.message.reply_text("Only chat administrators can see token usage.")
+        return
+    
+    if show_all:
+        report = usage_tracker.report()
+        usage_text = "📈 **Token Usage (all chats)**\n\n"
+        usage_text += f"**Total:** {format_usage_line(report['totals'])}\n"
+        for mode, entry in sorted(report["modes"].items()):
+            usage_text += f"• {mode.title()}: {format_usage_line(entry)}\n"
+        if report["top_groups"]:
+            usage_text += "\n**Top chats:**\n"
+            for entry in report["top_groups"]:
+                usage_text += f"• `{entry['id']}`: {format_usage_line(entry)}\n"
+        if report["top_users"]:
+            usage_text += "\n**Top users:**\n"
+            for entry in report["top_users"]:
+                usage_text += f"• `{entry.get('name') or entry['id']}`: {format_usage_line(entry)}\n"
+    else:
+        group_id = str(update.message.chat_id)
+        report = usage_tracker.report(group_id)
+        window_hours = report["window_seconds"] / 3600
+        usage_text = "📈 **Token Usage (this chat)**\n\n"
+        usage_text += f"**Total:** {format_usage_line(report['totals'])}\n"
+        usage_text += f"**Last {window_hours:g}h:** {report['window_tokens']} tokens"
+        usage_text += f" of {report['quota']} allowed\n" if report["quota"] else " (no quota)\n"
+        if QUOTA_USER_TOKENS:
+            usage_text += f"**Per-user quota:** {QUOTA_USER_TOKENS} tokens per {QUOTA_USER_WINDOW / 3600:g}h\n"
+        if report["top_users"]:
+            usage_text += "\n**Top users:**\n"
+            for entry in report["top_users"]:
+                usage_text += f"• `{entry.get('name') or entry['id']}`: {format_usage_line(entry)}\n"
+    
+    await update.message.reply_text(usage_text, parse_mode='Markdown')
+
+async def quota_allows(group_id: str, message: Message, charged_user: Optional[str]) -> bool:
+    """Check the token quotas before a completion; tells the sender once per exhausted quota."""
+    over_quota = usage_tracker.check(group_id, charged_user)
+    if not over_quota:
+        return True
+    if over_quota["notify"] and charged_user is not None:
+        minutes = max(1, math.ceil(over_quota["retry_after"] / 60))
+        holder = "your" if over_quota["scope"] == "user" else "this chat's"
+        await send_reply(message, f"⏳ You've reached {holder} token limit for now. "
+                                  f"Try again in about {minutes} min.")
+    return False
+
+async def send_reply(message: Message, text: str) -> Optional[Message]:
+    """Reply through the paced send queue (split at 4096 characters).
+
+    Returns the first delivered message, or None if nothing could be delivered.
+    """
+    sent_messages = await telegram_sender.send(message.chat_id, text, message.reply_text,
+                                               message.chat.type == ChatType.PRIVATE)
+    return sent_messages[0] if sent_messages else None
+
+async def stream_reply(message: Message, stream,
+                       on_complete: Optional[Callable[[], None]] = None) -> Tuple[Optional[Message], Optional[str]]:
+    """Reply with a placeholder and progressively edit it while the completion streams in.
+
+    Edits are spaced on an adaptive cadence: groups start slower than private chats,
+    the interval grows as the reply gets longer, and Telegram's RetryAfter is honoured.
+    Preview edits are skipped while the chat's send budget is used up and are not retried:
+    a failed edit only slows the cadence, the placeholder and the final text go through
+    the send queue with its retries. The placeholder is sent alongside the stream, so
+    generation never waits for the send budget, and `on_complete` is called as soon as
+    the completion ends (before the final send, e.g. to free the LLM slot).
+    A stream that fails partway keeps its text, marked with STREAM_INTERRUPTED.
+    Returns the sent message and the final text (None if nothing was generated).
+    """
+    chat_id = message.chat_id
+    private = message.chat.type == ChatType.PRIVATE
+    placeholder = asyncio.ensure_future(
+        telegram_sender.call(chat_id, lambda: message.reply_text(STREAM_PLACEHOLDER), private)
+    )
+    sent_message = None
+
+    if private:
+        base_interval = STREAM_EDIT_INTERVAL_PRIVATE
+    else:
+        base_interval = STREAM_EDIT_INTERVAL_GROUP
+
+    interval = base_interval
+    edits = 0
+    shown = ""
+    next_edit = time.monotonic()  # First tokens are shown as soon as they arrive
+
+    try:
+        async for _ in stream:
+            now = time.monotonic()
+            if sent_message is None and placeholder.done():
+                sent_message = placeholder.result()
+            if sent_message is None or now < next_edit:
+                continue
+
+            preview = stream.text.strip()[:4096 - len(STREAM_CURSOR)]
+            if not preview or preview == shown or not telegram_sender.try_acquire(chat_id, private):
+                continue
+
+            try:
+                await sent_message.edit_text(preview + STREAM_CURSOR)
+                shown = preview
+                edits += 1
+                # Slow down as the reply grows so long answers don't exhaust the edit budget
+                interval = min(STREAM_EDIT_INTERVAL_MAX, base_interval * (1 + edits // 5))
+            except RetryAfter as e:
+                interval = min(STREAM_EDIT_INTERVAL_MAX, max(interval, float(e.retry_after)))
+            except BadRequest:
+                pass  # e.g. "message is not modified"
+            except TelegramError as e:
+                # Previews are optional: keep consuming the stream and try again later
+                print(f"Error editing stream preview in chat {chat_id}: {e}")
+                interval = min(STREAM_EDIT_INTERVAL_MAX, interval * 2)
+
+            next_edit = time.monotonic() + interval
+    finally:
+        if on_complete is not None:
+            on_complete()
+
+    # The placeholder may still be waiting for the send budget
+    sent_message = await placeholder
+
+    response = stream.text.strip()
+    if response and stream.error is not None:
+        response += STREAM_INTERRUPTED
+    if sent_message is None:
+        # The placeholder never got through; deliver the finished text as plain messages
+        if not response:
+            return None, None
+        sent_messages = await telegram_sender.send(chat_id, response, message.reply_text, private)
+        return (sent_messages[0] if sent_messages else None), response
+
+    if not response:
+        try:
+            await sent_message.delete()
+        except Exception as e:
+            print(f"Error deleting placeholder: {e}")
+        return None, None
+
+    # Final render without the cursor; overflow beyond Telegram's limit goes in follow-ups
+    chunks = split_message(response)
+    await telegram_sender.call(chat_id, lambda: sent_message.edit_text(chunks[0]), private, idempotent=True)
+    if len(chunks) > 1:
+        await telegram_sender.send(chat_id, response[len(chunks[0]):].lstrip(), message.reply_text, private)
+
+    return sent_message, response
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /stats command - shows memory and prompt cache statistics for this chat."""
+    if not check_access_permission(update):
+        return
+    
+    group_id = str(update.message.chat_id)
+    memory_stats = await memory_manager.get_memory_stats(group_id)
+    group_cache = deepseek_client.get_prompt_cache_stats(group_id)
+    global_cache = deepseek_client.get_prompt_cache_stats()
+    
+    stats_text = "📊 **Bot Statistics**\n\n"
+    stats_text += f"**Memory:** {memory_stats['total_messages']}/{memory_stats['max_capacity']} messages\n"
+    if summarizer is not None:
+        summary = (await memory_manager.get_settings(group_id)).get("summary", "")
+        stats_text += (f"**Long-term summary:** {context_builder.count_tokens(summary)}/{SUMMARY_MAX_TOKENS} tokens, "
+                       f"{summarizer.get_stats()['folded_messages']} messages folded (all chats)\n")
+    stats_text += (f"**Prompt cache (this chat):** {group_cache['hit_rate_percent']}% hit "
+                   f"over {group_cache['calls']} calls\n")
+    stats_text += (f"**Prompt cache (all chats):** {global_cache['hit_rate_percent']}% hit "
+                   f"over {global_cache['calls']} calls\n")
+    
+    scheduler_stats = llm_scheduler.get_stats()
+    stats_text += (f"**LLM slots:** {scheduler_stats['active']}/{scheduler_stats['max_concurrent']} busy, "
+                   f"queued {sum(scheduler_stats['queued'].values())}, "
+                   f"dropped {sum(scheduler_stats['expired'].values()) + sum(scheduler_stats['shed'].values())}\n")
+    
+    resilience_stats = deepseek_client.resilience.get_stats()
+    stats_text += (f"**DeepSeek API:** breaker {resilience_stats['breaker_state']}, "
+                   f"{resilience_stats['retries']} retries, {resilience_stats['breaker_trips']} trips\n")
+    
+    spontaneous_stats = spontaneous_policy.get_stats()
+    stats_text += (f"**Spontaneous replies (all chats):** {spontaneous_stats['allowed']} sent, "
+                   f"{spontaneous_stats['rate_limited']} over budget, "
+                   f"{spontaneous_stats['scored'] - spontaneous_stats['above_threshold']} below threshold\n")
+    
+    sender_stats = telegram_sender.get_stats()
+    stats_text += (f"**Telegram sends:** {sender_stats['sent']} sent, {sender_stats['waiting']} waiting, "
+                   f"{sender_stats['retry_after']} flood waits, {sender_stats['failed']} failed\n")
+    
+    if COALESCE_WINDOW > 0:
+        coalesce_stats = trigger_coalescer.get_stats()
+        stats_text += (f"**Coalescing:** {coalesce_stats['merged_triggers']} triggers merged "
+                       f"into {coalesce_stats['batches']} completions\n")
+    
+    if response_cache is not None:
+        cache_stats = response_cache.get_stats()
+        stats_text += (f"**Response cache ({cache_stats['scope']}):** {cache_stats['hits']} hits, "
+                       f"{cache_stats['misses']} misses ({cache_stats['hit_rate_percent']}%)\n")
+    
+    await update.message.reply_text(stats_text, parse_mode='Markdown')
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all messages in the group."""
     if not update.message or not update.message.text:
         return
     
+    # Time the whole update; the stage spans below are attributed to it
+    with metrics.track_update(str(update.message.chat_id)):
+        await process_message(update, context)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record a text message in memory and answer it if the bot should respond."""
     # Check permissions first
-    if not check_access_permission(update):
+    with metrics.span("access_check"):
+        allowed = check_access_permission(update)
+    if not allowed:
+        metrics.inc("updates_total", outcome="denied")
         return
     
     # Extract message details
@@ -266,8 +1012,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message_id = message.message_id
     timestamp = format_timestamp(message.date)
     
-    # Get current mode
-    current_mode = get_group_mode(group_id)
+    # Get current mode and trigger words
+    with metrics.span("settings"):
+        current_mode = await get_group_mode(group_id)
+        settings = await memory_manager.get_settings(group_id)
     
     # Extract reply information
     reply_to_message_id = None
@@ -279,11 +1027,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Check if replying to Raiden
         if message.reply_to_message.from_user and message.reply_to_message.from_user.is_bot:
             is_reply_to_raiden = True
-        
-        # Get the original message from memory
-        original_message = await memory_manager.find_message_by_id(group_id, reply_to_message_id)
-        if original_message:
-            reply_context = format_reply_context(original_message)
     
     # Create message data
     message_data = {
@@ -298,51 +1041,213 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if reply_to_message_id:
         message_data["reply_to_message_id"] = reply_to_message_id
     
-    # Save message to memory
-    await memory_manager.save_message(group_id, message_data)
+    # Trigger words for this group, or a real @mention of the bot
+    is_mentioned = trigger_engine.is_mentioned(message, settings.get("triggers"),
+                                               context.bot.username, context.bot.id)
     
-    # Determine if bot should respond based on mode
+    # Determine if bot should respond based on mode (and how urgent the reply is)
     should_respond = False
+    priority = PRIORITY_SPONTANEOUS
     
     if current_mode == "chat":
         # Chat mode behavior (original)
-        if is_bot_mentioned(text):
+        if is_mentioned:
             should_respond = True
+            priority = PRIORITY_MENTION
         elif is_reply_to_raiden:
             should_respond = True
-        elif should_spontaneous_reply():
+            priority = PRIORITY_REPLY
+        elif spontaneous_policy.should_reply(group_id, current_mode, text, settings,
+                                             replying_to_other=target is not None):
             should_respond = True
     else:  # assistant mode
         # Assistant mode behavior (more conservative)
-        if is_bot_mentioned(text):
+        if is_mentioned:
             should_respond = True
+            priority = PRIORITY_MENTION
         elif is_reply_to_raiden:
             should_respond = True
-        # No spontaneous replies in assistant mode
+            priority = PRIORITY_REPLY
+        # Spontaneous replies are off in assistant mode unless SPONTANEOUS_PER_HOUR_ASSISTANT is set
+        elif spontaneous_policy.should_reply(group_id, current_mode, text, settings,
+                                             replying_to_other=target is not None):
+            should_respond = True
+    
+    # Reply lookup, save and context slicing share one snapshot of the group's memory.
+    # Loading (lock, cache/storage read, lookups) is timed as memory_load; persisting the
+    # new message when the transaction exits as memory_save
+    chat_history = []
+    load_started = time.perf_counter()
+    async with memory_manager.transaction(group_id) as memory:
+        if reply_to_message_id:
+            # Get the original message from memory
+            original_message = memory.find(reply_to_message_id)
+            if original_message:
+                reply_context = format_reply_context(original_message)
+        
+        # Save message to memory
+        memory.append(message_data)
+        
+        if should_respond:
+            chat_history = memory.context()
+        save_started = time.perf_counter()
+        metrics.record_stage("memory_load", save_started - load_started)
+    metrics.record_stage("memory_save", time.perf_counter() - save_started)
+    
+    if not should_respond:
+        metrics.inc("updates_total", outcome="stored")
     
     if should_respond:
-        # Get chat history with mode-appropriate memory limit
-        memory_limit = 30 if current_mode == "chat" else 10
-        chat_history = await memory_manager.get_context(group_id, limit=memory_limit)
+        # Triggers arriving in a burst are answered by a single completion
+        with metrics.span("coalesce_wait"):
+            batch = await trigger_coalescer.collect(group_id, (message, username, text, reply_context, priority))
+        if batch is None:
+            metrics.inc("updates_total", outcome="coalesced")
+            return  # Merged into the completion of an earlier trigger
+        
+        coalesced = len(batch) > 1
+        charged_users = []
+        if coalesced:
+            # Every sender in the burst is held to their own quota; those over it are left out
+            allowed = []
+            for item in batch:
+                user_id = None if item[4] == PRIORITY_SPONTANEOUS else str(item[0].from_user.id)
+                if user_id is not None and usage_tracker.quotas["user"] > 0:
+                    if not await quota_allows(group_id, item[0], user_id):
+                        continue
+                allowed.append(item)
+                if user_id is not None and user_id not in [charged for charged, _ in charged_users]:
+                    charged_users.append((user_id, item[1]))
+            if not allowed:
+                metrics.inc("updates_total", outcome="over_quota")
+                return
+            batch = allowed
+            
+            # Answer once, replying to the latest message, with every trigger in view
+            message, username = batch[-1][0], batch[-1][1]
+            text = (
+                "Several messages for you arrived at once. Answer them together in one reply:\n" +
+                "\n".join(f"{name}: {body}" for _, name, body, _, _ in batch)
+            )
+            priority = min(item[4] for item in batch)
+            reply_contexts = []
+            for _, _, _, item_context, _ in batch:
+                if item_context and item_context not in reply_contexts:
+                    reply_contexts.append(item_context)
+            reply_context = "\n".join(reply_contexts) or None
+            chat_history = await memory_manager.get_context(group_id)
         
         # Choose system prompt based on mode
         system_prompt = CHAT_SYSTEM_PROMPT if current_mode == "chat" else ASSISTANT_SYSTEM_PROMPT
         
+        # Older messages reach the prompt as the group's rolling summary (fixed token cost,
+        # and it only changes once per batch, so the prompt cache prefix holds in between)
+        if summarizer is not None and settings.get("summary"):
+            system_prompt += format_summary(settings["summary"])
+        
         # Choose max tokens based on mode
         max_tokens = 500 if current_mode == "chat" else 1300
         
-        # Generate response
-        response = deepseek_client.generate_response(
-            system_prompt,
-            chat_history,
-            text,
-            reply_context,
-            max_tokens=max_tokens
-        )
+        # Archived messages matching the question, within a small token budget; sent after
+        # the history like the reply context, so the cached prompt prefix is unaffected
+        prompt_context = reply_context
+        if memory_manager.archive is not None:
+            with metrics.span("archive_search"):
+                recalled = await memory_manager.recall(
+                    group_id, text, limit=ARCHIVE_TOP_K,
+                    ignore=trigger_engine.resolve(settings.get("triggers"))
+                )
+            recalled_context = format_recalled(recalled, ARCHIVE_MAX_TOKENS, context_builder.count_tokens)
+            if recalled_context:
+                prompt_context = "\n\n".join(part for part in (reply_context, recalled_context) if part)
+        
+        # Fit history newest-first into the mode's prompt token budget
+        with metrics.span("context_build"):
+            chat_history, prompt_tokens = context_builder.build(
+                current_mode, system_prompt, chat_history, text, prompt_context, group_id=group_id
+            )
+        
+        # Repeated assistant questions can be answered from the response cache
+        cache_key = None
+        cached_response = None
+        if response_cache is not None and current_mode == "assistant" and not coalesced:
+            cache_key = response_cache.make_key(group_id, current_mode, text, reply_context,
+                                                strip_words=trigger_engine.resolve(settings.get("triggers")))
+            cached_response = response_cache.get(cache_key)
+        
+        sent_message = None
+        complete = False  # The completion finished without an error
+        if cached_response:
+            response = cached_response
+            with metrics.span("telegram_send"):
+                sent_message = await send_reply(message, response)
+        else:
+            # Token quotas are checked before the request; spontaneous replies only count
+            # against the chat. A coalesced reply is split between its senders (checked above)
+            charged_user = None if priority == PRIORITY_SPONTANEOUS else str(message.from_user.id)
+            if not coalesced:
+                charged_users = [(charged_user, username)] if charged_user is not None else []
+            if not await quota_allows(group_id, message, charged_user):
+                metrics.inc("updates_total", outcome="over_quota")
+                return
+            
+            # Wait for an LLM slot; stale or shed requests are dropped silently
+            queued_at = time.perf_counter()
+            async with llm_scheduler.slot(group_id, priority) as granted:
+                metrics.record_stage("llm_queue", time.perf_counter() - queued_at)
+                if not granted:
+                    metrics.inc("updates_total", outcome="dropped")
+                    return
+                
+                if current_mode in STREAMING_MODES:
+                    # Stream the response into a progressively edited message
+                    stream = deepseek_client.stream_response(
+                        system_prompt,
+                        chat_history,
+                        text,
+                        prompt_context,
+                        max_tokens=max_tokens,
+                        group_id=group_id
+                    )
+                    # Streaming interleaves generation with Telegram edits, so it is one stage
+                    # The slot is freed when the completion ends, not after the final send
+                    with metrics.span("llm_stream"):
+                        sent_message, response = await stream_reply(message, stream, granted.release)
+                    usage = stream.usage
+                    complete = stream.error is None
+                else:
+                    # Generate response
+                    with metrics.span("llm"):
+                        result = await deepseek_client.acomplete(
+                            system_prompt,
+                            chat_history,
+                            text,
+                            prompt_context,
+                            max_tokens=max_tokens,
+                            group_id=group_id
+                        )
+                    response = result["content"] if result else None
+                    usage = result["usage"] if result else None
+                    complete = result is not None
+            
+            usage_tracker.record_shared(group_id, charged_users, current_mode, usage)
+            
+            if response and current_mode not in STREAMING_MODES:
+                # Send response
+                with metrics.span("telegram_send"):
+                    sent_message = await send_reply(message, response)
+        
+        # A reply that broke off partway is never cached (it would be replayed truncated)
+        if response and cache_key and not cached_response and complete:
+            response_cache.set(cache_key, response)
+        
+        if response and sent_message is None:
+            # Generated but not delivered even after retries, so it is not remembered either
+            metrics.inc("updates_total", outcome="undelivered")
+            return
         
         if response:
-            # Send response
-            sent_message = await message.reply_text(response)
+            spontaneous_policy.record_reply(group_id)
             
             # Save bot's response to memory
             bot_message_data = {
@@ -352,32 +1257,148 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "message_id": sent_message.message_id,
                 "timestamp": format_timestamp()
             }
-            await memory_manager.save_message(group_id, bot_message_data)
+            with metrics.span("memory_save"):
+                await memory_manager.save_message(group_id, bot_message_data)
+        
+        source = "cache" if cached_response else "llm"
+        metrics.inc("updates_total", outcome="answered" if response else "failed", source=source)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors."""
+    metrics.inc("errors_total", error=type(context.error).__name__)
     print(f"Error: {context.error}")
 
-def main():
-    """Start the bot."""
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def start_metrics_server(port: int):
+    """Expose /metrics if enabled."""
+    if port > 0:
+        await metrics.start_server(METRICS_HOST, port)
+        print(f"- Metrics on http://{METRICS_HOST}:{port}/metrics ✓")
+
+async def on_startup(application: Application):
+    """Start the metrics endpoint once the application is initialized."""
+    await start_metrics_server(METRICS_PORT)
+
+async def on_shutdown(application: Application):
+    """Release the shared DeepSeek session and flush memory storage on shutdown."""
+    await metrics.stop_server()
+    if summarizer is not None:
+        await summarizer.close()
+    await deepseek_client.aclose()
+    await usage_tracker.close()
+    await memory_manager.close()
+
+def build_application() -> Application:
+    """Create the bot application with all handlers registered."""
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("mode", mode_command))
     application.add_handler(CommandHandler("info", info_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("triggers", triggers_command))
+    application.add_handler(CommandHandler("spontaneous", spontaneous_command))
+    application.add_handler(CommandHandler("usage", usage_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
     # Add error handler
     application.add_error_handler(error_handler)
+    return application
+
+def run_shard_worker(shard: int, shard_queue):
+    """Shard worker process: handle the updates the dispatcher routes to this shard."""
+    ignore_interrupts()
+    # Each worker keeps its own usage file (a chat always lands on the same worker) and
+    # reads the others' so user quotas and /usage all cover every worker
+    usage_tracker.path = f"{USAGE_PATH}.shard{shard}"
+    usage_tracker.peer_paths = [f"{USAGE_PATH}.shard{other}" for other in range(SHARD_WORKERS) if other != shard]
+    application = build_application()
+    
+    async def serve():
+        await application.initialize()
+        await application.start()
+        await start_metrics_server(METRICS_PORT + 1 + shard if METRICS_PORT > 0 else 0)
+        print(f"- Shard worker {shard} ready (pid {os.getpid()}) ✓")
+        
+        async def handle(data):
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        
+        try:
+            await consume_shard(shard_queue, handle)
+        finally:
+            await application.stop()
+            await on_shutdown(application)
+            await application.shutdown()
     
+    asyncio.run(serve())
+
+def run_application(application: Application):
+    """Receive updates by webhook or long polling, as configured."""
+    if UPDATE_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise SystemExit("WEBHOOK_URL is required when UPDATE_MODE=webhook")
+        secret = WEBHOOK_SECRET
+        if not secret:
+            secret = secrets.token_urlsafe(32)
+            print("- WEBHOOK_SECRET not set, using a random secret for this run")
+        print(f"- Webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH} ✓")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=ALLOWED_UPDATES
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+def run_sharded():
+    """Run a dispatcher that routes updates to SHARD_WORKERS worker processes by chat ID."""
+    router = ShardRouter(SHARD_WORKERS, run_shard_worker, queue_size=SHARD_QUEUE_SIZE)
+    
+    async def stop_workers(application: Application):
+        await asyncio.get_running_loop().run_in_executor(None, router.stop)
+        print(f"Shard routing: {router.get_stats()}")
+    
+    dispatcher = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_shutdown(stop_workers)
+        .build()
+    )
+    dispatcher.add_handler(TypeHandler(Update, router.handle_update))
+    
+    print(f"- Sharded: dispatcher + {SHARD_WORKERS} worker processes ✓")
+    router.start()
+    run_application(dispatcher)
+
+def main():
+    """Start the bot."""
     # Start the bot
     print("🤖 Enhanced Raiden Bot is starting...")
     print("- Dual mode support (Chat/Assistant) ✓")
     print("- Mode-specific memory limits ✓")
     print("- Adaptive behavior per mode ✓")
     print("- Reply tracking ✓")
+    print(f"- Memory backend: {MEMORY_BACKEND} ✓")
+    print(f"- History format: {HISTORY_FORMAT} ✓")
+    if MEMORY_FLUSH_INTERVAL_MS > 0:
+        print(f"- Batched memory writes every {MEMORY_FLUSH_INTERVAL_MS} ms / {MEMORY_FLUSH_MAX_MESSAGES} messages ✓")
+    if COALESCE_WINDOW > 0:
+        print(f"- Burst coalescing ({COALESCE_WINDOW}s window) ✓")
+    if RESPONSE_CACHE_ENABLED:
+        print(f"- Assistant response cache ({RESPONSE_CACHE_SCOPE}, TTL {RESPONSE_CACHE_TTL:.0f}s) ✓")
+    print(f"- Streaming replies: {', '.join(STREAMING_MODES) or 'off'} ✓")
+    print(f"- Non-blocking DeepSeek client ({CONCURRENT_UPDATES} concurrent updates) ✓")
     
     if WHITELIST_ENABLED:
         print("- Whitelist mode ENABLED 🔒")
@@ -386,7 +1407,10 @@ def main():
     else:
         print("- Whitelist mode DISABLED (public access)")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if SHARD_WORKERS > 1:
+        run_sharded()
+    else:
+        run_application(build_application())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+class TriggerCoalescer:
+    """Merge bot triggers that arrive in a short burst into a single completion.
+
+    The first trigger in a group opens a debounce window and waits for it to close;
+    triggers arriving meanwhile join its batch. The opener gets the whole batch back,
+    the others get None and leave the answering to it.
+    """
+
+    def __init__(self, window_seconds: float = 0.0, max_batch: int = 5):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._batches: Dict[str, List[Any]] = {}
+        self.batches = 0
+        self.merged = 0
+
+    async def collect(self, group_id: str, item: Any) -> Optional[List[Any]]:
+        """Add a trigger; returns its batch once the window closes, or None if merged."""
+        if self.window_seconds <= 0:
+            self.batches += 1
+            return [item]
+
+        batch = self._batches.get(group_id)
+        if batch is not None and len(batch) < self.max_batch:
+            batch.append(item)
+            self.merged += 1
+            return None
+
+        # Open a new window (a full batch closes early for newcomers)
+        batch = [item]
+        self._batches[group_id] = batch
+        await asyncio.sleep(self.window_seconds)
+
+        if self._batches.get(group_id) is batch:
+            del self._batches[group_id]
+        self.batches += 1
+        return batch
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics."""
+        return {
+            "window_seconds": self.window_seconds,
+            "open_windows": len(self._batches),
+            "batches": self.batches,
+            "merged_triggers": self.merged
+        }
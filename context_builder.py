@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+from utils import estimate_tokens
+
+# Per chat message overhead of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def load_token_counter(tokenizer_path: Optional[str] = None) -> Callable[[str], int]:
+    """Get a token counting function.
+
+    Uses a local Hugging Face tokenizer.json (e.g. DeepSeek's) when a path is given and the
+    'tokenizers' package is installed, otherwise the calibrated estimator in utils.
+    """
+    if tokenizer_path:
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(tokenizer_path)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids) if text else 0
+        except Exception as e:
+            print(f"Error loading tokenizer from {tokenizer_path}, using estimator: {e}")
+    return estimate_tokens
+
+def truncate_to_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """Cut text to at most max_tokens, marking the cut with an ellipsis."""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    # Binary search the longest prefix that fits (leave one token for the ellipsis)
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens - 1:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "…"
+
+class ContextBuilder:
+    """Select chat history for a prompt by token budget instead of a fixed message count.
+
+    History is filled newest-first until the mode's prompt budget (system prompt, reply
+    context and user message included) is reached; single oversized messages are truncated.
+
+    When a group_id is given, the window start is anchored: consecutive calls keep the same
+    first message and only grow at the end, so the rendered history is a stable prompt-cache
+    prefix. Once the anchored span no longer fits, the window is re-anchored leaving
+    `prefix_headroom` of the budget free for the following calls.
+    """
+
+    def __init__(self, render_history: Callable[[List[Dict[str, Any]]], str],
+                 budgets: Dict[str, int], max_messages: Dict[str, int],
+                 max_message_tokens: int = 300,
+                 count_tokens: Callable[[str], int] = estimate_tokens,
+                 prefix_headroom: float = 0.3, max_anchors: int = 10000):
+        self.render_history = render_history
+        self.budgets = budgets
+        self.max_messages = max_messages
+        self.max_message_tokens = max_message_tokens
+        self.count_tokens = count_tokens
+        self.prefix_headroom = prefix_headroom
+        self.max_anchors = max_anchors
+        self._anchors: "OrderedDict[str, Any]" = OrderedDict()
+
+    def _message_tokens(self, message_data: Dict[str, Any], empty_cost: int) -> int:
+        """Estimate what a single message adds to the rendered history."""
+        return max(1, self.count_tokens(self.render_history([message_data])) - empty_cost)
+
+    def _set_anchor(self, group_id: str, message_id: Any):
+        """Remember a group's window start, keeping the most recent groups only."""
+        self._anchors[group_id] = message_id
+        self._anchors.move_to_end(group_id)
+        while len(self._anchors) > self.max_anchors:
+            self._anchors.popitem(last=False)
+
+    def build(self, mode: str, system_prompt: str, history: List[Dict[str, Any]],
+              user_message: str, reply_context: Optional[str] = None,
+              group_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Pick the history to send and estimate the resulting prompt tokens."""
+        fixed_tokens = (
+            self.count_tokens(system_prompt) +
+            self.count_tokens(user_message) +
+            (self.count_tokens(reply_context) + MESSAGE_OVERHEAD_TOKENS if reply_context else 0) +
+            MESSAGE_OVERHEAD_TOKENS * 3
+        )
+        empty_cost = self.count_tokens(self.render_history([]))
+        remaining = self.budgets.get(mode, 0) - fixed_tokens - empty_cost
+        limit = self.max_messages.get(mode, len(history))
+
+        # Newest-first: every message that fits, with its cost
+        fitting = []
+        used = 0
+        for message_data in reversed(history[-limit:] if limit > 0 else []):
+            text = message_data.get('message') or ""
+            if self.count_tokens(text) > self.max_message_tokens:
+                message_data = dict(message_data)
+                message_data['message'] = truncate_to_tokens(text, self.max_message_tokens, self.count_tokens)
+
+            cost = self._message_tokens(message_data, empty_cost)
+            if cost > remaining - used:
+                break
+            fitting.append((message_data, cost))
+            used += cost
+
+        count = len(fitting)
+        if group_id is not None and fitting and self.prefix_headroom > 0:
+            anchor = self._anchors.get(group_id)
+            anchored = [i for i, (msg, _) in enumerate(fitting) if msg.get('message_id') == anchor]
+            if anchor is not None and anchored:
+                # Keep the previous window start while it still fits
+                count = anchored[0] + 1
+            else:
+                # Re-anchor with headroom so the next calls can keep this prefix
+                budget = remaining * (1 - self.prefix_headroom)
+                max_count = max(1, int(limit * (1 - self.prefix_headroom)))
+                count = 0
+                spent = 0
+                for _, cost in fitting[:max_count]:
+                    if spent + cost > budget and count > 0:
+                        break
+                    spent += cost
+                    count += 1
+                self._set_anchor(group_id, fitting[count - 1][0].get('message_id'))
+
+        selected = [msg for msg, _ in fitting[:count]]
+        selected.reverse()
+        used = sum(cost for _, cost in fitting[:count])
+        prompt_tokens = fixed_tokens + (empty_cost + used if selected else 0)
+        return selected, prompt_tokens
@@ -1,126 +1,441 @@
 import requests
+import httpx
 import json
-from typing import List, Dict, Any, Optional
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable
+
+from utils import format_history_compact, COMPACT_HISTORY_HEADER
+from resilience import Resilience
+
+# Appended to the chat history of reply completions
+HISTORY_INSTRUCTION = "Based on this chat history, respond to the latest message."
+
+class CompletionStream:
+    """Async iterator over the text deltas of a streamed (SSE) completion.
+
+    After iteration finishes, `text` holds the full completion, `usage` the token usage
+    reported in the final chunk, and `error` is set if the request failed.
+    """
+
+    def __init__(self, session: httpx.AsyncClient, payload: Dict[str, Any],
+                 on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 resilience: Optional[Resilience] = None):
+        self._session = session
+        self._payload = payload
+        self._on_usage = on_usage
+        self._resilience = resilience
+        self.text = ""
+        self.usage: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._retry_delay: Optional[float] = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        attempt = 0
+        while True:
+            # Retries are only possible until the first delta has been yielded
+            async for delta in self._attempt(attempt):
+                yield delta
+            if self._retry_delay is None:
+                return
+            await asyncio.sleep(self._retry_delay)
+            attempt += 1
+
+    async def _attempt(self, attempt: int) -> AsyncIterator[str]:
+        """Run one streaming attempt; sets _retry_delay when it should be retried."""
+        self._retry_delay = None
+        self.error = None
+        resilience = self._resilience
+        if resilience is not None and not resilience.allow_request(attempt):
+            self.error = "circuit open"
+            print("DeepSeek API unavailable (circuit open), skipping request")
+            return
+
+        try:
+            async with self._session.stream("POST", "/chat/completions", json=self._payload) as response:
+                if resilience is not None:
+                    resilience.record(status=response.status_code)
+
+                if response.status_code != 200:
+                    body = await response.aread()
+                    self.error = f"{response.status_code} - {body.decode('utf-8', 'replace')}"
+                    if resilience is not None:
+                        self._retry_delay = resilience.retry_delay(
+                            attempt, status=response.status_code,
+                            retry_after=response.headers.get("retry-after")
+                        )
+                    if self._retry_delay is None:
+                        print(f"DeepSeek API error: {self.error}")
+                    return
+
+                async for line in response.aiter_lines():
+                    # Skip blank separators and keep-alive comments
+                    if not line.startswith("data:"):
+                        continue
+
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+
+                    chunk = json.loads(data)
+                    if chunk.get('usage'):
+                        self.usage = chunk['usage']
+                        if self._on_usage:
+                            self._on_usage(self.usage)
+
+                    choices = chunk.get('choices') or []
+                    if not choices:
+                        continue
+
+                    delta = (choices[0].get('delta') or {}).get('content')
+                    if delta:
+                        self.text += delta
+                        yield delta
+
+        except asyncio.CancelledError:
+            if resilience is not None:
+                resilience.breaker.release()
+            raise
+        except Exception as e:
+            self.error = str(e)
+            if resilience is not None:
+                resilience.record(error=e)
+                if not self.text:
+                    self._retry_delay = resilience.retry_delay(attempt, error=e)
+            if self._retry_delay is None:
+                print(f"Error streaming from DeepSeek API: {e}")
 
 class DeepSeekClient:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, max_connections: int = 100,
+                 max_keepalive_connections: int = 20, keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 write_timeout: float = 10.0, pool_timeout: float = 5.0,
+                 http2: bool = True, history_format: str = "json",
+                 base_url: str = "https://api.deepseek.com/v1",
+                 resilience: Optional[Resilience] = None, max_tracked_groups: int = 10000):
         self.api_key = api_key
-        self.base_url = "https://api.deepseek.com/v1"
+        self.base_url = base_url
         self.model = "deepseek-chat"
-        
-    def generate_response(self, system_prompt: str, chat_history: List[Dict[str, Any]], 
-                         user_message: str, reply_context: Optional[str] = None,
-                         max_tokens: int = 500) -> Optional[str]:
-        """Generate a response using DeepSeek API with configurable max_tokens."""
-        
+
+        # Settings for the shared async session (created lazily inside the event loop)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout
+        )
+        self.http2 = http2
+
+        # "json" (indented JSON list) or "compact" (one line per message, see utils)
+        self.history_format = history_format
+        self._session: Optional[httpx.AsyncClient] = None
+
+        # Retries, backoff and circuit breaker for the async paths
+        self.resilience = resilience if resilience is not None else Resilience()
+
+        # Prompt cache accounting per group (from the usage of each response); the least
+        # recently active groups beyond max_tracked_groups are folded into one retired total
+        self.prompt_cache_stats: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self.max_tracked_groups = max_tracked_groups
+        self._retired_cache_stats = {"calls": 0, "hit_tokens": 0, "miss_tokens": 0}
+        self.usage_totals = {"prompt_tokens": 0, "completion_tokens": 0}
+
+    def _get_headers(self) -> Dict[str, str]:
+        """Get the request headers for the DeepSeek API."""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _get_session(self) -> httpx.AsyncClient:
+        """Get or create the shared, connection-pooled async session."""
+        if self._session is None or self._session.is_closed:
+            try:
+                import h2  # noqa: F401
+                http2 = self.http2
+            except ImportError:
+                # HTTP/2 needs the optional 'h2' package, fall back to HTTP/1.1 keep-alive
+                http2 = False
+
+            self._session = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self._get_headers(),
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=http2
+            )
+        return self._session
+
+    async def aclose(self):
+        """Close the shared async session and its pooled connections."""
+        if self._session is not None and not self._session.is_closed:
+            await self._session.aclose()
+        self._session = None
+
+    def format_history(self, chat_history: List[Dict[str, Any]]) -> str:
+        """Serialize chat history in the configured format."""
+        if self.history_format == "compact":
+            return COMPACT_HISTORY_HEADER + "\n" + format_history_compact(chat_history)
+
+        # Enhanced history with reply tracking
+        enhanced_history = []
+        for msg in chat_history:
+            enhanced_msg = msg.copy()
+            if msg.get('reply_to_message_id'):
+                enhanced_msg['reply_info'] = f"(replying to message {msg['reply_to_message_id']})"
+            enhanced_history.append(enhanced_msg)
+
+        return "RECENT CHAT HISTORY:\n" + json.dumps(enhanced_history, ensure_ascii=False, indent=2)
+
+    def _build_messages(self, system_prompt: str, chat_history: List[Dict[str, Any]],
+                        user_message: str, reply_context: Optional[str] = None,
+                        history_instruction: str = HISTORY_INSTRUCTION) -> List[Dict[str, str]]:
+        """Build the message list sent to the API.
+
+        Stable parts come first (system prompt, then history, which only grows at its end
+        between calls) so consecutive calls in a group share a byte-identical prefix that
+        DeepSeek can serve from its prompt cache. Per-call parts come last.
+        """
+
         # Format chat history for context
         context_messages = []
-        
+
         # Add system prompt
         context_messages.append({
             "role": "system",
             "content": system_prompt
         })
-        
+
         # Add chat history as context
         if chat_history:
-            # Enhanced history with reply tracking
-            enhanced_history = []
-            for msg in chat_history:
-                enhanced_msg = msg.copy()
-                if msg.get('reply_to_message_id'):
-                    enhanced_msg['reply_info'] = f"(replying to message {msg['reply_to_message_id']})"
-                enhanced_history.append(enhanced_msg)
-            
-            history_text = "RECENT CHAT HISTORY:\n"
-            history_text += json.dumps(enhanced_history, ensure_ascii=False, indent=2)
-            history_text += "\n\nBased on this chat history, respond to the latest message."
-            
+            history_text = self.format_history(chat_history)
+            if history_instruction:
+                history_text += "\n\n" + history_instruction
+
             context_messages.append({
                 "role": "system",
                 "content": history_text
             })
-        
+
         # Add reply context if available
         if reply_context:
             context_messages.append({
                 "role": "system",
                 "content": reply_context
             })
-        
+
         # Add the current message
         context_messages.append({
             "role": "user",
             "content": user_message
         })
-        
-        # Prepare the API request
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+
+        return context_messages
+
+    def _build_payload(self, messages: List[Dict[str, str]], max_tokens: int,
+                       stream: bool = False, temperature: Optional[float] = None,
+                       penalty: Optional[float] = None) -> Dict[str, Any]:
+        """Build the request payload with mode-specific sampling parameters."""
         # Adjust parameters based on max_tokens (assistant mode gets different settings)
         if max_tokens > 1000:  # Assistant mode
-            temperature = 0.7
+            temperature = 0.7 if temperature is None else temperature
             top_p = 0.9
             frequency_penalty = 0.1
             presence_penalty = 0.1
         else:  # Chat mode
-            temperature = 1.3
+            temperature = 1.3 if temperature is None else temperature
             top_p = 0.95
             frequency_penalty = 0.3
             presence_penalty = 0.3
-        
+        if penalty is not None:
+            frequency_penalty = presence_penalty = penalty
+
         payload = {
             "model": self.model,
-            "messages": context_messages,
+            "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
             "top_p": top_p,
             "frequency_penalty": frequency_penalty,
             "presence_penalty": presence_penalty
         }
-        
+
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+
+        return payload
+
+    def generate_response(self, system_prompt: str, chat_history: List[Dict[str, Any]],
+                         user_message: str, reply_context: Optional[str] = None,
+                         max_tokens: int = 500) -> Optional[str]:
+        """Generate a response using DeepSeek API with configurable max_tokens.
+
+        Blocking version, prefer agenerate_response inside the bot's event loop.
+        """
+        messages = self._build_messages(system_prompt, chat_history, user_message, reply_context)
+        payload = self._build_payload(messages, max_tokens)
+
         try:
             response = requests.post(
                 f"{self.base_url}/chat/completions",
-                headers=headers,
+                headers=self._get_headers(),
                 json=payload,
                 timeout=30
             )
-            
+
             if response.status_code == 200:
                 data = response.json()
                 return data['choices'][0]['message']['content'].strip()
             else:
                 print(f"DeepSeek API error: {response.status_code} - {response.text}")
                 return None
-                
+
         except Exception as e:
             print(f"Error calling DeepSeek API: {e}")
             return None
-    
+
+    def _record_usage(self, group_id: Optional[str], usage: Dict[str, Any]):
+        """Accumulate prompt cache hit/miss tokens for a group and overall token totals."""
+        stats = self.prompt_cache_stats.setdefault(
+            group_id or "", {"calls": 0, "hit_tokens": 0, "miss_tokens": 0}
+        )
+        self.prompt_cache_stats.move_to_end(group_id or "")
+        while len(self.prompt_cache_stats) > self.max_tracked_groups:
+            _, retired = self.prompt_cache_stats.popitem(last=False)
+            for key, value in retired.items():
+                self._retired_cache_stats[key] += value
+        stats["calls"] += 1
+        stats["hit_tokens"] += usage.get('prompt_cache_hit_tokens', 0) or 0
+        stats["miss_tokens"] += usage.get('prompt_cache_miss_tokens', 0) or 0
+
+        for key in ("prompt_tokens", "completion_tokens"):
+            self.usage_totals[key] += usage.get(key, 0) or 0
+
+    def get_prompt_cache_stats(self, group_id: Optional[str] = None) -> Dict[str, Any]:
+        """Get prompt cache hit rate for a group, or across all groups if group_id is None."""
+        if group_id is not None:
+            groups = [self.prompt_cache_stats.get(group_id, {})]
+        else:
+            groups = list(self.prompt_cache_stats.values()) + [self._retired_cache_stats]
+
+        calls = sum(stats.get("calls", 0) for stats in groups)
+        hit = sum(stats.get("hit_tokens", 0) for stats in groups)
+        miss = sum(stats.get("miss_tokens", 0) for stats in groups)
+        return {
+            "calls": calls,
+            "hit_tokens": hit,
+            "miss_tokens": miss,
+            "hit_rate_percent": round(hit / (hit + miss) * 100, 2) if hit + miss else 0
+        }
+
+    async def acomplete(self, system_prompt: str, chat_history: List[Dict[str, Any]],
+                        user_message: str, reply_context: Optional[str] = None,
+                        max_tokens: int = 500, group_id: Optional[str] = None,
+                        temperature: Optional[float] = None, penalty: Optional[float] = None,
+                        history_instruction: str = HISTORY_INSTRUCTION) -> Optional[Dict[str, Any]]:
+        """Generate a completion and return its content together with the token usage.
+
+        `temperature` and `penalty` (frequency and presence) override the mode's sampling
+        settings, and `history_instruction` the line closing the chat history (e.g. for summaries).
+        """
+        messages = self._build_messages(system_prompt, chat_history, user_message, reply_context,
+                                        history_instruction)
+        payload = self._build_payload(messages, max_tokens, temperature=temperature, penalty=penalty)
+
+        response = await self._post_with_retries(payload)
+        if response is None:
+            return None
+
+        try:
+            data = response.json()
+            usage = data.get('usage') or {}
+            if usage:
+                self._record_usage(group_id, usage)
+            return {
+                "content": data['choices'][0]['message']['content'].strip(),
+                "usage": usage
+            }
+        except Exception as e:
+            print(f"Error parsing DeepSeek API response: {e}")
+            return None
+
+    async def _post_with_retries(self, payload: Dict[str, Any]) -> Optional[httpx.Response]:
+        """POST a completion request, retrying transient failures. Returns None on failure."""
+        attempt = 0
+        while True:
+            if not self.resilience.allow_request(attempt):
+                print("DeepSeek API unavailable (circuit open), skipping request")
+                return None
+
+            try:
+                response = await self._get_session().post("/chat/completions", json=payload)
+            except asyncio.CancelledError:
+                self.resilience.breaker.release()
+                raise
+            except Exception as e:
+                self.resilience.record(error=e)
+                delay = self.resilience.retry_delay(attempt, error=e)
+                if delay is None:
+                    print(f"Error calling DeepSeek API: {e}")
+                    return None
+            else:
+                self.resilience.record(status=response.status_code)
+                if response.status_code == 200:
+                    return response
+
+                delay = self.resilience.retry_delay(
+                    attempt, status=response.status_code,
+                    retry_after=response.headers.get("retry-after")
+                )
+                if delay is None:
+                    print(f"DeepSeek API error: {response.status_code} - {response.text}")
+                    return None
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def agenerate_response(self, system_prompt: str, chat_history: List[Dict[str, Any]],
+                                 user_message: str, reply_context: Optional[str] = None,
+                                 max_tokens: int = 500, group_id: Optional[str] = None) -> Optional[str]:
+        """Generate a response without blocking the event loop, using the shared session."""
+        result = await self.acomplete(system_prompt, chat_history, user_message, reply_context,
+                                      max_tokens=max_tokens, group_id=group_id)
+        return result["content"] if result else None
+
+    def stream_response(self, system_prompt: str, chat_history: List[Dict[str, Any]],
+                        user_message: str, reply_context: Optional[str] = None,
+                        max_tokens: int = 500, group_id: Optional[str] = None) -> CompletionStream:
+        """Stream a response token by token. Iterate the result to receive text deltas."""
+        messages = self._build_messages(system_prompt, chat_history, user_message, reply_context)
+        payload = self._build_payload(messages, max_tokens, stream=True)
+        return CompletionStream(self._get_session(), payload,
+                                on_usage=lambda usage: self._record_usage(group_id, usage),
+                                resilience=self.resilience)
+
     def test_connection(self) -> bool:
         """Test the connection to DeepSeek API."""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         test_payload = {
             "model": self.model,
             "messages": [{"role": "user", "content": "Test"}],
             "max_tokens": 10
         }
-        
+
         try:
             response = requests.post(
                 f"{self.base_url}/chat/completions",
-                headers=headers,
+                headers=self._get_headers(),
                 json=test_payload,
                 timeout=10
             )
             return response.status_code == 200
         except Exception:
-            return False
\ No newline at end of file
+            return False
@@ -1,97 +1,478 @@
-import json
-import os
-from typing import List, Dict, Any, Optional
-from pathlib import Path
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Iterable
 import asyncio
-import aiofiles
+import sys
+import time
+
+from memory_storage import MemoryStorage, JsonFileStorage, GroupLock
+from archive import MessageArchive
+
+# Marks a key the original message dict did not have
+_ABSENT = object()
+
+class MessageRecord:
+    """Compact in-memory form of a stored message.
+
+    Slots instead of a per-message dict, interned usernames (a group's window repeats
+    the same few), and unknown keys kept in `extra`. `to_dict()` gives back the
+    original dict with the same key order, so prompts serialize byte-identically.
+    """
+
+    __slots__ = ("username", "target", "message", "message_id", "timestamp",
+                 "reply_to_message_id", "extra")
+
+    FIELDS = ("username", "target", "message", "message_id", "timestamp", "reply_to_message_id")
+
+    def __init__(self, message_data: Dict[str, Any]):
+        for key in self.FIELDS:
+            setattr(self, key, _ABSENT)
+        extra = None
+        position = 0
+        for key, value in message_data.items():
+            # Slots hold known keys while they arrive in canonical order, the rest goes to extra
+            index = _FIELD_INDEX.get(key, -1) if extra is None else -1
+            if index >= position:
+                if index <= 1 and isinstance(value, str):
+                    value = sys.intern(value)  # username / target
+                setattr(self, key, value)
+                position = index + 1
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self.extra = extra
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key) if key in _FIELD_INDEX else _ABSENT
+        if value is _ABSENT and self.extra is not None:
+            value = self.extra.get(key, _ABSENT)
+        return default if value is _ABSENT else value
+
+    def to_dict(self) -> Dict[str, Any]:
+        message_data = {}
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not _ABSENT:
+                message_data[key] = value
+        if self.extra:
+            message_data.update(self.extra)
+        return message_data
+
+_FIELD_INDEX = {key: index for index, key in enumerate(MessageRecord.FIELDS)}
+
+def _estimate_message_size(record: MessageRecord) -> int:
+    """Rough in-memory size of a cached message in bytes (slots + unshared values)."""
+    size = 104
+    for key in ("message", "timestamp"):
+        value = getattr(record, key)
+        if isinstance(value, str):
+            size += 49 + len(value)
+    if record.extra:
+        size += 232 + sum(49 + len(v) if isinstance(v, str) else 28 for v in record.extra.values())
+    return size
+
+class _GroupCache:
+    """Cached window of a group's latest messages (as MessageRecords) plus a message_id index."""
+
+    __slots__ = ("messages", "by_id", "size")
+
+    def __init__(self, messages: List[Dict[str, Any]], max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.by_id = {}
+        self.size = 0
+        for message_data in messages[-max_messages:] if max_messages > 0 else []:
+            self.append(message_data)
+
+    def append(self, message_data: Dict[str, Any]) -> Optional[MessageRecord]:
+        """Add a message, dropping the oldest one when the window is full (returned)."""
+        if self.messages.maxlen == 0:
+            return None
+        oldest = None
+        if len(self.messages) == self.messages.maxlen:
+            oldest = self.messages[0]
+            self.size -= _estimate_message_size(oldest)
+            if self.by_id.get(oldest.get('message_id')) is oldest:
+                del self.by_id[oldest.get('message_id')]
+
+        record = MessageRecord(message_data)
+        self.messages.append(record)
+        self.size += _estimate_message_size(record)
+        if record.get('message_id') is not None:
+            self.by_id[record.get('message_id')] = record
+        return oldest
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [record.to_dict() for record in self.messages]
+
+    def find(self, message_id: int) -> Optional[Dict[str, Any]]:
+        record = self.by_id.get(message_id)
+        return record.to_dict() if record is not None else None
+
+class MemoryView:
+    """Consistent view of one group's memory, valid inside MemoryManager.transaction()."""
+
+    def __init__(self, entry: _GroupCache):
+        self._entry = entry
+        self.appended: List[Dict[str, Any]] = []
+
+    def find(self, message_id: int) -> Optional[Dict[str, Any]]:
+        """Find a message by ID in the group's window."""
+        for message_data in reversed(self.appended):
+            if message_data.get('message_id') == message_id:
+                return message_data
+        return self._entry.find(message_id)
+
+    def append(self, message_data: Dict[str, Any]):
+        """Append a message; it is persisted when the transaction ends."""
+        self.appended.append(message_data)
+
+    def context(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get the window including messages appended in this transaction."""
+        messages = self._entry.to_dicts() + self.appended
+        messages = messages[-self._entry.messages.maxlen:] if self._entry.messages.maxlen else []
+
+        if limit is not None and limit > 0:
+            return messages[-limit:]
+
+        return messages
 
 class MemoryManager:
-    def __init__(self, memory_dir: str = "./memory", max_messages: int = 30):
-        self.memory_dir = Path(memory_dir)
+    def __init__(self, memory_dir: str = "./memory", max_messages: int = 30,
+                 max_cached_groups: int = 1000, max_cache_bytes: int = 64 * 1024 * 1024,
+                 storage: Optional[MemoryStorage] = None,
+                 flush_interval_ms: int = 0, flush_max_messages: int = 100,
+                 on_overflow: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None,
+                 archive: Optional[MessageArchive] = None):
         self.max_messages = max_messages
-        self.memory_dir.mkdir(exist_ok=True)
+        self.storage = storage if storage is not None else JsonFileStorage(memory_dir)
+        # Optional searchable archive of messages older than the window
+        self.archive = archive
         self._locks = {}
-    
+        self._settings: Dict[str, Dict[str, Any]] = {}
+        # Called with the messages pushed out of a group's window (e.g. to summarize them)
+        self.on_overflow = on_overflow
+
+        # Write-through LRU cache of recently active groups
+        self.max_cached_groups = max_cached_groups
+        self.max_cache_bytes = max_cache_bytes
+        self._cache: "OrderedDict[str, _GroupCache]" = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+
+        # Group-commit batching (flush_interval_ms = 0 means write-through)
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_max_messages = flush_max_messages
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_count = 0
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self._flush_count = 0
+        self._flush_failures = 0
+        self._flushed_messages = 0
+        self._flush_seconds_total = 0.0
+        self._last_flush_ms = 0.0
+        self._last_flush_batch = 0
+
     def _get_lock(self, group_id: str):
         """Get or create a lock for a specific group."""
         if group_id not in self._locks:
-            self._locks[group_id] = asyncio.Lock()
+            self._locks[group_id] = GroupLock()
         return self._locks[group_id]
-    
-    def _get_file_path(self, group_id: str) -> Path:
-        """Get the file path for a group's memory."""
-        return self.memory_dir / f"{group_id}.json"
-    
+
+    def _is_idle(self, group_id: str) -> bool:
+        """True if nobody holds or waits for the group's lock and it has no unflushed messages."""
+        lock = self._locks.get(group_id)
+        if lock is not None and lock.users:
+            return False
+        return group_id not in self._pending
+
+    async def _get_cached(self, group_id: str) -> _GroupCache:
+        """Get a group's cached window, loading it from disk on first access."""
+        entry = self._cache.get(group_id)
+        if entry is not None:
+            self._cache_hits += 1
+            self._cache.move_to_end(group_id)
+            return entry
+
+        self._cache_misses += 1
+        messages = await self.load_memory(group_id)
+
+        # Another coroutine may have filled the cache while we were reading
+        entry = self._cache.get(group_id)
+        if entry is not None:
+            self._cache.move_to_end(group_id)
+            return entry
+
+        entry = _GroupCache(messages, self.max_messages)
+        self._cache[group_id] = entry
+        self._cache_bytes += entry.size
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """Evict least recently used groups until the cache fits its budgets."""
+        over_budget = len(self._cache) > self.max_cached_groups or self._cache_bytes > self.max_cache_bytes
+        for group_id in list(self._cache.keys()) if over_budget else ():
+            if (len(self._cache) <= self.max_cached_groups and
+                    self._cache_bytes <= self.max_cache_bytes):
+                break
+            # Don't evict the most recent group, one with a write in flight or unflushed messages
+            if group_id == next(reversed(self._cache)) or not self._is_idle(group_id):
+                continue
+            self._drop_cached(group_id)
+            self._cache_evictions += 1
+
+        # Locks and settings of groups that were never cached (or were cleared) pile up too;
+        # sweep them once they outnumber the cache, which keeps the sweep amortized O(1)
+        if max(len(self._locks), len(self._settings)) > 2 * len(self._cache) + 64:
+            self._prune_idle()
+
+    def _drop_cached(self, group_id: str):
+        """Remove a group from the cache along with its idle lock, settings and storage state."""
+        entry = self._cache.pop(group_id, None)
+        if entry is not None:
+            self._cache_bytes -= entry.size
+        if self._is_idle(group_id):
+            self._locks.pop(group_id, None)
+            self._settings.pop(group_id, None)
+            self.storage.release(group_id)
+
+    def _prune_idle(self):
+        """Forget locks and settings of idle groups that are not cached."""
+        for group_id in set(self._locks) | set(self._settings):
+            if group_id not in self._cache and self._is_idle(group_id):
+                self._locks.pop(group_id, None)
+                self._settings.pop(group_id, None)
+                self.storage.release(group_id)
+
     async def load_memory(self, group_id: str) -> List[Dict[str, Any]]:
-        """Load chat history for a group."""
-        file_path = self._get_file_path(group_id)
-        
-        if not file_path.exists():
-            return []
-        
-        try:
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                return json.loads(content) if content else []
-        except Exception as e:
-            print(f"Error loading memory for group {group_id}: {e}")
-            return []
-    
+        """Load chat history for a group from storage."""
+        return await self.storage.load(group_id)
+
+    async def _append_locked(self, group_id: str, entry: _GroupCache, new_messages: List[Dict[str, Any]]):
+        """Append messages to a cached group and persist them. The group lock must be held."""
+        # Add new messages (the window keeps only the latest max_messages)
+        size_before = entry.size
+        overflow = []
+        for message_data in new_messages:
+            oldest = entry.append(message_data)
+            if oldest is not None:
+                overflow.append(oldest.to_dict())
+        self._cache_bytes += entry.size - size_before
+        if overflow and self.archive is not None:
+            self.archive.add(group_id, overflow)
+        if overflow and self.on_overflow is not None:
+            self.on_overflow(group_id, overflow)
+
+        if self.flush_interval_ms > 0:
+            # Batched mode: mark dirty, the background flusher persists it
+            self._pending.setdefault(group_id, []).extend(new_messages)
+            self._pending_count += len(new_messages)
+            self._ensure_flusher()
+            if self._pending_count >= self.flush_max_messages:
+                self._flush_wakeup.set()
+        else:
+            # Write through to storage
+            await self.storage.append(group_id, new_messages, entry.to_dicts())
+
     async def save_message(self, group_id: str, message_data: Dict[str, Any]):
         """Save a new message to the group's memory."""
         async with self._get_lock(group_id):
-            # Load existing messages
-            messages = await self.load_memory(group_id)
-            
-            # Add new message
-            messages.append(message_data)
-            
-            # Keep only the latest messages (use default max_messages)
-            if len(messages) > self.max_messages:
-                messages = messages[-self.max_messages:]
-            
-            # Save to file
-            file_path = self._get_file_path(group_id)
+            entry = await self._get_cached(group_id)
+            await self._append_locked(group_id, entry, [message_data])
+
+        self._evict()
+
+    @asynccontextmanager
+    async def transaction(self, group_id: str) -> AsyncIterator[MemoryView]:
+        """Hold the group lock and expose one consistent view for lookup, append and context.
+
+        The group is read from storage at most once (not at all when cached); messages
+        appended through the view are persisted together when the block exits.
+        """
+        async with self._get_lock(group_id):
+            entry = await self._get_cached(group_id)
+            view = MemoryView(entry)
+            yield view
+            if view.appended:
+                await self._append_locked(group_id, entry, view.appended)
+
+        self._evict()
+
+    def _ensure_flusher(self):
+        """Start the background flusher if it isn't running."""
+        if self._flusher is None or self._flusher.done():
+            self._flush_wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Flush dirty groups every flush_interval_ms, or sooner once flush_max_messages are pending."""
+        while not self._closing:
             try:
-                async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-                    await f.write(json.dumps(messages, ensure_ascii=False, indent=2))
-            except Exception as e:
-                print(f"Error saving memory for group {group_id}: {e}")
-    
+                await asyncio.wait_for(self._flush_wakeup.wait(), self.flush_interval_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            if not await self.flush():
+                # Storage is failing: wait a full interval before retrying the re-queued batches
+                await asyncio.sleep(self.flush_interval_ms / 1000)
+
+    async def flush(self) -> bool:
+        """Write every dirty group's pending messages to storage.
+
+        Batches that could not be written stay pending for the next flush; returns False
+        if any did.
+        """
+        if not self._pending:
+            return True
+
+        started = time.perf_counter()
+        batch = 0
+        failed = 0
+        for group_id in list(self._pending.keys()):
+            async with self._get_lock(group_id):
+                pending = self._pending.pop(group_id, None)
+                if not pending:
+                    continue
+                self._pending_count -= len(pending)
+
+                entry = self._cache.get(group_id)
+                window = entry.to_dicts() if entry is not None else pending[-self.max_messages:]
+                written = False
+                try:
+                    written = await self.storage.append(group_id, pending, window)
+                finally:
+                    if written:
+                        batch += len(pending)
+                    else:
+                        # Not written (error or cancellation): keep the batch for the next flush
+                        self._pending[group_id] = pending + self._pending.get(group_id, [])
+                        self._pending_count += len(pending)
+                        failed += 1
+                        self._flush_failures += 1
+
+        elapsed = time.perf_counter() - started
+        self._flush_count += 1
+        self._flushed_messages += batch
+        self._flush_seconds_total += elapsed
+        self._last_flush_ms = round(elapsed * 1000, 2)
+        self._last_flush_batch = batch
+        return failed == 0
+
     async def get_context(self, group_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """Get the context for a group with an optional message limit."""
-        messages = await self.load_memory(group_id)
-        
+        messages = (await self._get_cached(group_id)).to_dicts()
+
         if limit is not None and limit > 0:
             # Return only the last 'limit' messages
             return messages[-limit:] if len(messages) > limit else messages
-        
+
         return messages
-    
+
     async def find_message_by_id(self, group_id: str, message_id: int) -> Optional[Dict[str, Any]]:
         """Find a specific message by ID in the group's memory."""
-        messages = await self.load_memory(group_id)
-        for msg in messages:
-            if msg.get('message_id') == message_id:
-                return msg
-        return None
-    
+        entry = self._cache.get(group_id)
+        if entry is not None:
+            self._cache_hits += 1
+            self._cache.move_to_end(group_id)
+            return entry.find(message_id)
+
+        # Not cached: let the storage answer directly (an indexed query for SQLite)
+        self._cache_misses += 1
+        return await self.storage.find(group_id, message_id)
+
     async def clear_memory(self, group_id: str):
         """Clear all memory for a group (useful when switching modes)."""
         async with self._get_lock(group_id):
-            file_path = self._get_file_path(group_id)
-            try:
-                if file_path.exists():
-                    async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-                        await f.write(json.dumps([], ensure_ascii=False, indent=2))
-            except Exception as e:
-                print(f"Error clearing memory for group {group_id}: {e}")
-    
+            self._drop_cached(group_id)
+            self._pending_count -= len(self._pending.pop(group_id, []))
+            await self.storage.clear(group_id)
+            if self.archive is not None:
+                await self.archive.clear(group_id)
+
+    async def recall(self, group_id: str, query: str, limit: int = 5,
+                     ignore: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """Find archived messages older than the window that match a query (best first)."""
+        if self.archive is None:
+            return []
+        return await self.archive.search(group_id, query, limit=limit, ignore=ignore)
+
+    async def get_settings(self, group_id: str) -> Dict[str, Any]:
+        """Get a group's settings, loaded from storage on first use."""
+        settings = self._settings.get(group_id)
+        if settings is None:
+            settings = await self.storage.load_settings(group_id)
+            self._settings[group_id] = settings
+        return settings
+
+    async def update_settings(self, group_id: str, **changes: Any):
+        """Change a group's settings and persist them (a value of None removes the key)."""
+        async with self._get_lock(group_id):
+            settings = dict(await self.get_settings(group_id))
+            for key, value in changes.items():
+                if value is None:
+                    settings.pop(key, None)
+                else:
+                    settings[key] = value
+            self._settings[group_id] = settings
+            await self.storage.save_settings(group_id, settings)
+
     async def get_memory_stats(self, group_id: str) -> Dict[str, Any]:
         """Get statistics about a group's memory."""
-        messages = await self.load_memory(group_id)
+        messages = (await self._get_cached(group_id)).messages
         return {
             "total_messages": len(messages),
             "max_capacity": self.max_messages,
             "memory_usage_percent": round((len(messages) / self.max_messages) * 100, 2) if self.max_messages > 0 else 0
-        }
\ No newline at end of file
+        }
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get statistics about the in-memory group cache."""
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            "cached_groups": len(self._cache),
+            "max_cached_groups": self.max_cached_groups,
+            "cache_bytes": self._cache_bytes,
+            "max_cache_bytes": self.max_cache_bytes,
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "evictions": self._cache_evictions,
+            "tracked_locks": len(self._locks),
+            "hit_rate_percent": round(self._cache_hits / lookups * 100, 2) if lookups else 0
+        }
+
+    def get_flush_stats(self) -> Dict[str, Any]:
+        """Get statistics about batched persistence."""
+        return {
+            "batched": self.flush_interval_ms > 0,
+            "flush_interval_ms": self.flush_interval_ms,
+            "flush_max_messages": self.flush_max_messages,
+            "dirty_groups": len(self._pending),
+            "pending_messages": self._pending_count,
+            "flushes": self._flush_count,
+            "failed_writes": self._flush_failures,
+            "last_flush_ms": self._last_flush_ms,
+            "last_batch_size": self._last_flush_batch,
+            "avg_flush_ms": round(self._flush_seconds_total / self._flush_count * 1000, 2) if self._flush_count else 0,
+            "avg_batch_size": round(self._flushed_messages / self._flush_count, 2) if self._flush_count else 0
+        }
+
+    async def close(self):
+        """Stop the flusher, drain pending messages and close the storage backend."""
+        self._closing = True
+        if self._flusher is not None:
+            # Let a flush that is already writing finish instead of cancelling it mid-write
+            self._flush_wakeup.set()
+            try:
+                await self._flusher
+            except Exception as e:
+                print(f"Error flushing memory: {e}")
+            self._flusher = None
+        await self.flush()
+        if self.archive is not None:
+            await self.archive.close()
+        await self.storage.close()
@@ -0,0 +1,470 @@
+import json
+import os
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+import aiofiles
+
+class GroupLock:
+    """Per-group asyncio lock that counts the coroutines holding or waiting for it.
+
+    `users` is 0 only when nobody is inside or queued for `async with`, which is what
+    makes a group's state safe to drop.
+    """
+
+    __slots__ = ("_lock", "users")
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.users = 0
+
+    async def __aenter__(self):
+        self.users += 1
+        try:
+            await self._lock.acquire()
+        except BaseException:
+            self.users -= 1
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._lock.release()
+        self.users -= 1
+
+class MemoryStorage:
+    """Interface for MemoryManager storage backends.
+
+    Backends persist each group's message window; MemoryManager keeps the hot copy in memory.
+    """
+
+    async def load(self, group_id: str) -> List[Dict[str, Any]]:
+        """Load chat history for a group (oldest first)."""
+        raise NotImplementedError
+
+    async def append(self, group_id: str, new_messages: List[Dict[str, Any]],
+                     window: List[Dict[str, Any]]) -> bool:
+        """Persist new messages; `window` is the group's full window after appending them.
+
+        Returns False if the write failed (the error is logged), so callers can retry it.
+        """
+        raise NotImplementedError
+
+    async def find(self, group_id: str, message_id: int) -> Optional[Dict[str, Any]]:
+        """Find a stored message by ID."""
+        for msg in await self.load(group_id):
+            if msg.get('message_id') == message_id:
+                return msg
+        return None
+
+    async def clear(self, group_id: str):
+        """Clear a group's stored history."""
+        raise NotImplementedError
+
+    async def load_settings(self, group_id: str) -> Dict[str, Any]:
+        """Load a group's settings (mode, trigger words, ...)."""
+        raise NotImplementedError
+
+    async def save_settings(self, group_id: str, settings: Dict[str, Any]):
+        """Persist a group's settings, replacing the stored ones."""
+        raise NotImplementedError
+
+    def release(self, group_id: str):
+        """Drop in-memory state kept for a group that went idle."""
+        pass
+
+    async def close(self):
+        """Release resources held by the storage."""
+        pass
+
+async def _load_settings_file(file_path: Path) -> Dict[str, Any]:
+    """Read a group's settings file ({} if missing or unreadable)."""
+    if not file_path.exists():
+        return {}
+    try:
+        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+            content = await f.read()
+        return json.loads(content) if content else {}
+    except Exception as e:
+        print(f"Error loading settings from {file_path}: {e}")
+        return {}
+
+async def _save_settings_file(file_path: Path, settings: Dict[str, Any]):
+    """Replace a group's settings file atomically."""
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    try:
+        async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+            await f.write(json.dumps(settings, ensure_ascii=False))
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        print(f"Error saving settings to {file_path}: {e}")
+
+class JsonFileStorage(MemoryStorage):
+    """Stores each group's window as a pretty-printed JSON list (memory/<group_id>.json).
+
+    Every append rewrites the whole window.
+    """
+
+    def __init__(self, memory_dir: str = "./memory"):
+        self.memory_dir = Path(memory_dir)
+        self.memory_dir.mkdir(exist_ok=True)
+
+    def _get_file_path(self, group_id: str) -> Path:
+        """Get the file path for a group's memory."""
+        return self.memory_dir / f"{group_id}.json"
+
+    async def load(self, group_id: str) -> List[Dict[str, Any]]:
+        """Load chat history for a group."""
+        file_path = self._get_file_path(group_id)
+
+        if not file_path.exists():
+            return []
+
+        try:
+            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+                content = await f.read()
+                return json.loads(content) if content else []
+        except Exception as e:
+            print(f"Error loading memory for group {group_id}: {e}")
+            return []
+
+    async def append(self, group_id: str, new_messages: List[Dict[str, Any]],
+                     window: List[Dict[str, Any]]) -> bool:
+        """Persist new messages by rewriting the whole window (atomically, via a temp file)."""
+        file_path = self._get_file_path(group_id)
+        tmp_path = file_path.with_name(file_path.name + ".tmp")
+        try:
+            async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+                await f.write(json.dumps(window, ensure_ascii=False, indent=2))
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            print(f"Error saving memory for group {group_id}: {e}")
+            return False
+        return True
+
+    async def clear(self, group_id: str):
+        """Clear a group's stored history."""
+        file_path = self._get_file_path(group_id)
+        try:
+            if file_path.exists():
+                async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
+                    await f.write(json.dumps([], ensure_ascii=False, indent=2))
+        except Exception as e:
+            print(f"Error clearing memory for group {group_id}: {e}")
+
+    async def load_settings(self, group_id: str) -> Dict[str, Any]:
+        """Load a group's settings (memory/<group_id>.settings.json)."""
+        return await _load_settings_file(self.memory_dir / f"{group_id}.settings.json")
+
+    async def save_settings(self, group_id: str, settings: Dict[str, Any]):
+        """Persist a group's settings."""
+        await _save_settings_file(self.memory_dir / f"{group_id}.settings.json", settings)
+
+class JsonlFileStorage(MemoryStorage):
+    """Append-only journal storage (memory/<group_id>.jsonl), one compact JSON line per message.
+
+    Appends cost O(1) per message. Once a journal grows past `max_messages * compact_factor`
+    lines, a background pass rewrites it to the last `max_messages` entries through a
+    temp file and an atomic rename. Legacy `.json` memories are migrated on first load.
+    """
+
+    def __init__(self, memory_dir: str = "./memory", max_messages: int = 30,
+                 compact_factor: int = 4):
+        self.memory_dir = Path(memory_dir)
+        self.memory_dir.mkdir(exist_ok=True)
+        self.max_messages = max_messages
+        self.compact_threshold = max(max_messages * compact_factor, max_messages + 1)
+        self._locks = {}
+        self._line_counts = {}
+        self._compactions = {}
+
+    def _get_lock(self, group_id: str):
+        """Get or create a lock for a specific group's journal."""
+        if group_id not in self._locks:
+            self._locks[group_id] = GroupLock()
+        return self._locks[group_id]
+
+    def _get_file_path(self, group_id: str) -> Path:
+        """Get the journal path for a group's memory."""
+        return self.memory_dir / f"{group_id}.jsonl"
+
+    def _get_legacy_path(self, group_id: str) -> Path:
+        """Get the path of a group's legacy JSON memory file."""
+        return self.memory_dir / f"{group_id}.json"
+
+    @staticmethod
+    def _encode(messages: List[Dict[str, Any]]) -> str:
+        return "".join(json.dumps(msg, ensure_ascii=False, separators=(",", ":")) + "\n"
+                       for msg in messages)
+
+    async def _write_atomic(self, file_path: Path, content: str):
+        """Replace a file atomically via a temp file and rename."""
+        tmp_path = file_path.with_name(file_path.name + ".tmp")
+        async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+            await f.write(content)
+            await f.flush()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, f.fileno())
+        os.replace(tmp_path, file_path)
+
+    async def _read_journal(self, group_id: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """Read every intact entry of a group's journal.
+
+        Also returns whether the journal is clean (no torn line from a crash mid-append).
+        """
+        file_path = self._get_file_path(group_id)
+        if not file_path.exists():
+            return [], True
+
+        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+            content = await f.read()
+
+        messages = []
+        clean = not content or content.endswith("\n")
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn line from a crash mid-append, skip it
+                clean = False
+        return messages, clean
+
+    async def _migrate_legacy(self, group_id: str):
+        """Convert a legacy .json memory file into a journal."""
+        legacy_path = self._get_legacy_path(group_id)
+        if self._get_file_path(group_id).exists() or not legacy_path.exists():
+            return
+
+        try:
+            async with aiofiles.open(legacy_path, 'r', encoding='utf-8') as f:
+                content = await f.read()
+            messages = json.loads(content) if content else []
+            await self._write_atomic(self._get_file_path(group_id),
+                                     self._encode(messages[-self.max_messages:]))
+            os.replace(legacy_path, legacy_path.with_name(legacy_path.name + ".migrated"))
+        except Exception as e:
+            print(f"Error migrating memory for group {group_id}: {e}")
+
+    async def load(self, group_id: str) -> List[Dict[str, Any]]:
+        """Load chat history for a group."""
+        async with self._get_lock(group_id):
+            try:
+                await self._migrate_legacy(group_id)
+                messages, clean = await self._read_journal(group_id)
+                if not clean:
+                    # Rewrite so the next append doesn't land on a partial line
+                    messages = messages[-self.max_messages:]
+                    await self._write_atomic(self._get_file_path(group_id), self._encode(messages))
+            except Exception as e:
+                print(f"Error loading memory for group {group_id}: {e}")
+                return []
+
+        self._line_counts[group_id] = len(messages)
+        return messages[-self.max_messages:]
+
+    async def append(self, group_id: str, new_messages: List[Dict[str, Any]],
+                     window: List[Dict[str, Any]]) -> bool:
+        """Append new messages to the journal, scheduling compaction when it grows too long."""
+        async with self._get_lock(group_id):
+            try:
+                async with aiofiles.open(self._get_file_path(group_id), 'a', encoding='utf-8') as f:
+                    await f.write(self._encode(new_messages))
+            except Exception as e:
+                print(f"Error saving memory for group {group_id}: {e}")
+                return False
+
+        line_count = self._line_counts.get(group_id, 0) + len(new_messages)
+        self._line_counts[group_id] = line_count
+
+        if line_count > self.compact_threshold and group_id not in self._compactions:
+            task = asyncio.create_task(self._compact(group_id))
+            self._compactions[group_id] = task
+            task.add_done_callback(lambda _: self._compactions.pop(group_id, None))
+        return True
+
+    async def _compact(self, group_id: str):
+        """Trim a journal back to the window size, replacing it atomically."""
+        async with self._get_lock(group_id):
+            try:
+                messages, _ = await self._read_journal(group_id)
+                kept = messages[-self.max_messages:]
+                await self._write_atomic(self._get_file_path(group_id), self._encode(kept))
+                self._line_counts[group_id] = len(kept)
+            except Exception as e:
+                print(f"Error compacting memory for group {group_id}: {e}")
+
+    async def clear(self, group_id: str):
+        """Clear a group's stored history."""
+        async with self._get_lock(group_id):
+            try:
+                await self._migrate_legacy(group_id)
+                if self._get_file_path(group_id).exists():
+                    await self._write_atomic(self._get_file_path(group_id), "")
+                self._line_counts[group_id] = 0
+            except Exception as e:
+                print(f"Error clearing memory for group {group_id}: {e}")
+
+    async def load_settings(self, group_id: str) -> Dict[str, Any]:
+        """Load a group's settings (memory/<group_id>.settings.json)."""
+        return await _load_settings_file(self.memory_dir / f"{group_id}.settings.json")
+
+    async def save_settings(self, group_id: str, settings: Dict[str, Any]):
+        """Persist a group's settings."""
+        await _save_settings_file(self.memory_dir / f"{group_id}.settings.json", settings)
+
+    def release(self, group_id: str):
+        """Drop the journal lock and line count of an idle group (recounted on next load)."""
+        lock = self._locks.get(group_id)
+        if group_id in self._compactions or (lock is not None and lock.users):
+            return
+        self._locks.pop(group_id, None)
+        self._line_counts.pop(group_id, None)
+
+    async def close(self):
+        """Wait for pending compactions to finish."""
+        if self._compactions:
+            await asyncio.gather(*self._compactions.values(), return_exceptions=True)
+
+class SQLiteStorage(MemoryStorage):
+    """Stores every group in one SQLite database (WAL mode).
+
+    All queries run on a single dedicated thread with one shared connection, so the event
+    loop never blocks on disk. Messages are indexed on (group_id, message_id) and windows
+    are trimmed in SQL. Several processes (shard workers) may share the database.
+    """
+
+    def __init__(self, db_path: str = "./memory/memory.db", max_messages: int = 30):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_messages = max_messages
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-sqlite")
+        # Wait on locks held by other worker processes rather than failing right away
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id TEXT NOT NULL,
+                message_id INTEGER,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_group_message
+                ON messages (group_id, message_id);
+            CREATE INDEX IF NOT EXISTS idx_messages_group_seq
+                ON messages (group_id, seq);
+            CREATE TABLE IF NOT EXISTS group_settings (
+                group_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        """Run a blocking database call on the storage thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _load_sync(self, group_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT data FROM (SELECT seq, data FROM messages WHERE group_id = ? "
+            "ORDER BY seq DESC LIMIT ?) ORDER BY seq",
+            (group_id, self.max_messages)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _append_sync(self, group_id: str, new_messages: List[Dict[str, Any]]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO messages (group_id, message_id, data) VALUES (?, ?, ?)",
+                [(group_id, msg.get('message_id'),
+                  json.dumps(msg, ensure_ascii=False, separators=(",", ":")))
+                 for msg in new_messages]
+            )
+            # Keep only the latest window for this group
+            self._conn.execute(
+                "DELETE FROM messages WHERE group_id = ? AND seq <= ("
+                "SELECT seq FROM messages WHERE group_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (group_id, group_id, self.max_messages)
+            )
+
+    def _find_sync(self, group_id: str, message_id: int) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT data FROM messages WHERE group_id = ? AND message_id = ? "
+            "ORDER BY seq DESC LIMIT 1",
+            (group_id, message_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _clear_sync(self, group_id: str):
+        with self._conn:
+            self._conn.execute("DELETE FROM messages WHERE group_id = ?", (group_id,))
+
+    def _load_settings_sync(self, group_id: str) -> Dict[str, Any]:
+        row = self._conn.execute(
+            "SELECT data FROM group_settings WHERE group_id = ?", (group_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _save_settings_sync(self, group_id: str, settings: Dict[str, Any]):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO group_settings (group_id, data) VALUES (?, ?)",
+                (group_id, json.dumps(settings, ensure_ascii=False))
+            )
+
+    async def load(self, group_id: str) -> List[Dict[str, Any]]:
+        """Load chat history for a group."""
+        try:
+            return await self._run(self._load_sync, group_id)
+        except Exception as e:
+            print(f"Error loading memory for group {group_id}: {e}")
+            return []
+
+    async def append(self, group_id: str, new_messages: List[Dict[str, Any]],
+                     window: List[Dict[str, Any]]) -> bool:
+        """Insert new messages and trim the group's window in one transaction."""
+        try:
+            await self._run(self._append_sync, group_id, new_messages)
+        except Exception as e:
+            print(f"Error saving memory for group {group_id}: {e}")
+            return False
+        return True
+
+    async def find(self, group_id: str, message_id: int) -> Optional[Dict[str, Any]]:
+        """Find a stored message with a single indexed query."""
+        try:
+            return await self._run(self._find_sync, group_id, message_id)
+        except Exception as e:
+            print(f"Error finding message {message_id} for group {group_id}: {e}")
+            return None
+
+    async def clear(self, group_id: str):
+        """Clear a group's stored history."""
+        try:
+            await self._run(self._clear_sync, group_id)
+        except Exception as e:
+            print(f"Error clearing memory for group {group_id}: {e}")
+
+    async def load_settings(self, group_id: str) -> Dict[str, Any]:
+        """Load a group's settings."""
+        try:
+            return await self._run(self._load_settings_sync, group_id)
+        except Exception as e:
+            print(f"Error loading settings for group {group_id}: {e}")
+            return {}
+
+    async def save_settings(self, group_id: str, settings: Dict[str, Any]):
+        """Persist a group's settings."""
+        try:
+            await self._run(self._save_settings_sync, group_id, settings)
+        except Exception as e:
+            print(f"Error saving settings for group {group_id}: {e}")
+
+    async def close(self):
+        """Close the database connection and its thread."""
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,180 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds, from fast cache hits to slow completions
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the update being handled in the current task
+_current_stages: "ContextVar[Optional[Dict[str, float]]]" = ContextVar("metrics_stages", default=None)
+
+LabelSet = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+def _labels(labels: Dict[str, object]) -> LabelSet:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+class Metrics:
+    """Counters, latency histograms and scrape-time gauges in the Prometheus text format.
+
+    `track_update()` times a whole update and `span()` times its stages; updates slower
+    than `slow_update_ms` are logged with their per-stage breakdown.
+    """
+
+    def __init__(self, prefix: str = "raiden_bot", buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                 slow_update_ms: float = 0):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self.slow_update_ms = slow_update_ms
+        self._counters: Dict[Tuple[str, LabelSet], float] = {}
+        self._histograms: Dict[Tuple[str, LabelSet], _Histogram] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.slow_updates = 0
+
+    def inc(self, name: str, value: float = 1.0, **labels: object):
+        """Increase a counter (name should end in _total)."""
+        key = (name, _labels(labels))
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels: object):
+        """Record a duration in a histogram."""
+        key = (name, _labels(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(self.buckets)
+        histogram.total += seconds
+        histogram.count += 1
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram.counts[i] += 1
+                break
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Register a callback returning (name, labels, value) samples at scrape time."""
+        self._collectors.append(collector)
+
+    def record_stage(self, stage: str, seconds: float):
+        """Record a stage duration for the histogram and the current update's breakdown."""
+        self.observe("stage_seconds", seconds, stage=stage)
+        stages = _current_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Time a stage of the current update."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - started)
+
+    @contextmanager
+    def track_update(self, group_id: str = "", kind: str = "message") -> Iterator[None]:
+        """Time a whole update and log it if it was slow."""
+        stages: Dict[str, float] = {}
+        token = _current_stages.set(stages)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _current_stages.reset(token)
+            elapsed = time.perf_counter() - started
+            self.observe("update_seconds", elapsed, kind=kind)
+            if self.slow_update_ms > 0 and elapsed * 1000 >= self.slow_update_ms:
+                self.slow_updates += 1
+                breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in stages.items())
+                print(f"Slow update: {elapsed * 1000:.0f} ms in chat {group_id} ({breakdown or 'no stages'})")
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+
+        def declare(name: str, metric_type: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            full = f"{self.prefix}_{name}"
+            declare(full, "counter")
+            lines.append(f"{full}{_format_labels(labels)} {value:g}")
+
+        for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+            full = f"{self.prefix}_{name}"
+            declare(full, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{full}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {histogram.total:.6f}")
+            lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+
+        full = f"{self.prefix}_slow_updates_total"
+        declare(full, "counter")
+        lines.append(f"{full} {self.slow_updates}")
+
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, labels, value in samples:
+                full = f"{self.prefix}_{name}"
+                declare(full, "counter" if name.endswith("_total") else "gauge")
+                lines.append(f"{full}{_format_labels(_labels(labels))} {float(value):g}")
+
+        return "\n".join(lines) + "\n"
+
+    async def _handle_scrape(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self, host: str = "127.0.0.1", port: int = 9464):
+        """Serve GET /metrics on a local port."""
+        self._server = await asyncio.start_server(self._handle_scrape, host, port)
+
+    async def stop_server(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
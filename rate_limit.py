@@ -0,0 +1,51 @@
+import time
+from typing import Optional
+
+class TokenBucket:
+    """Allow `rate` events per second on average, with bursts of up to `capacity`.
+
+    Starts full. `now` may be passed explicitly (monotonic seconds) so callers and
+    benchmarks can drive the bucket with their own clock.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: Optional[float]) -> float:
+        if now is None:
+            now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def reconfigure(self, rate: float, capacity: float, now: Optional[float] = None):
+        """Change the rate and burst size, keeping the tokens earned so far (up to the new capacity)."""
+        if rate == self.rate and capacity == self.capacity:
+            return
+        self._refill(now)
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def consume(self, amount: float = 1.0, now: Optional[float] = None) -> bool:
+        """Take `amount` tokens if they are available."""
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def delay(self, amount: float = 1.0, now: Optional[float] = None) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)."""
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate
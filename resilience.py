@@ -0,0 +1,160 @@
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+# Status codes worth retrying: rate limiting and transient upstream errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class CircuitBreaker:
+    """Fail fast while upstream is unhealthy.
+
+    Opens after `failure_threshold` consecutive failures, rejects calls for
+    `recovery_timeout` seconds, then lets a single probe through (half-open).
+    A successful probe closes the circuit, a failed one re-opens it. A probe that ends
+    without an outcome should be released; one that never reports back is replaced after
+    another `recovery_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Check whether a call may go upstream now."""
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        if self.state == self.HALF_OPEN and (
+                not self._probe_in_flight or time.monotonic() - self._probe_started >= self.recovery_timeout):
+            self._probe_in_flight = True
+            self._probe_started = time.monotonic()
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def release(self):
+        """Give back a half-open probe that ended without an outcome (e.g. it was cancelled)."""
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+class RetryBudget:
+    """Limit retries to a fraction of request volume.
+
+    Each first attempt deposits `ratio` tokens (up to `reserve`), each retry withdraws one,
+    so during a sustained outage retries add at most `ratio` extra load.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = reserve
+
+    def deposit(self):
+        self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+class Resilience:
+    """Retry policy (jittered exponential backoff honouring Retry-After), retry budget and
+    circuit breaker for DeepSeek API calls."""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 max_retry_after: float = 30.0, budget: Optional[RetryBudget] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def allow_request(self, attempt: int) -> bool:
+        """Check the breaker before an attempt (0-based), depositing budget for first attempts."""
+        if attempt == 0:
+            self.budget.deposit()
+        return self.breaker.allow()
+
+    @staticmethod
+    def is_retryable_error(error: Exception) -> bool:
+        return isinstance(error, (httpx.TransportError, httpx.TimeoutException))
+
+    def record(self, status: Optional[int] = None, error: Optional[Exception] = None):
+        """Feed an attempt's outcome to the breaker (429 means throttled, not unhealthy)."""
+        if error is not None or (status is not None and status >= 500):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def retry_delay(self, attempt: int, status: Optional[int] = None,
+                    error: Optional[Exception] = None,
+                    retry_after: Optional[str] = None) -> Optional[float]:
+        """Get the delay before retrying attempt (0-based), or None if it should not be retried."""
+        retryable = (status in RETRYABLE_STATUS) or (error is not None and self.is_retryable_error(error))
+        if not retryable or attempt + 1 >= self.max_attempts:
+            return None
+
+        # Full jitter: uniform in [0, min(max_delay, base * 2^attempt)]
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass  # HTTP-date form is not used by the DeepSeek API
+            if delay > self.max_retry_after:
+                return None
+
+        if not self.budget.withdraw():
+            self.budget_exhausted += 1
+            return None
+
+        self.retries += 1
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get retry and circuit breaker statistics."""
+        return {
+            "breaker_state": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "breaker_rejected": self.breaker.rejected,
+            "retries": self.retries,
+            "retry_budget_exhausted": self.budget_exhausted
+        }
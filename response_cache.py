@@ -0,0 +1,91 @@
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Iterable, Tuple
+
+def normalize_question(text: str, strip_words: Iterable[str] = ()) -> str:
+    """Normalize a question for cache lookups (case, mentions, punctuation, whitespace)."""
+    text = re.sub(r"@\w+", " ", text.lower())
+    words = re.findall(r"\w+", text)
+    ignored = {word for strip in strip_words for word in re.findall(r"\w+", strip.lower())}
+    return " ".join(word for word in words if word not in ignored)
+
+class ResponseCache:
+    """TTL + LRU cache of generated responses for repeated questions.
+
+    Keys combine mode, normalized question and a hash of the relevant context (e.g. the
+    message being replied to). With scope "group" entries are private to one chat, with
+    scope "global" identical questions are shared across chats.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600,
+                 scope: str = "group", strip_words: Iterable[str] = ()):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.scope = scope
+        self.strip_words = tuple(strip_words)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def make_key(self, group_id: str, mode: str, question: str,
+                 context: Optional[str] = None, strip_words: Optional[Iterable[str]] = None) -> Optional[str]:
+        """Build the cache key, or None if the question is empty after normalization.
+
+        `strip_words` (e.g. the group's trigger words) replaces the cache's default list.
+        """
+        normalized = normalize_question(question, self.strip_words if strip_words is None else strip_words)
+        if not normalized:
+            return None
+
+        scope = group_id if self.scope == "group" else "*"
+        context_hash = hashlib.sha1((context or "").encode("utf-8")).hexdigest()[:16]
+        raw = "\x1f".join((scope, mode, normalized, context_hash))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        """Get a cached response, counting hits and misses."""
+        if key is None:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Optional[str], response: str):
+        """Store a response, evicting the least recently used entries past max_entries."""
+        if key is None or self.max_entries <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache hit/miss statistics."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "scope": self.scope,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate_percent": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
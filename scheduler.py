@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# Priority classes (lower runs first)
+PRIORITY_MENTION = 0
+PRIORITY_REPLY = 1
+PRIORITY_SPONTANEOUS = 2
+PRIORITY_BACKGROUND = 3  # work nobody waits for, e.g. memory summaries
+
+PRIORITY_NAMES = {
+    PRIORITY_MENTION: "mention",
+    PRIORITY_REPLY: "reply",
+    PRIORITY_SPONTANEOUS: "spontaneous",
+    PRIORITY_BACKGROUND: "background",
+}
+
+class _Waiter:
+    __slots__ = ("priority", "group_id", "deadline", "future")
+
+    def __init__(self, priority: int, group_id: str, deadline: float, future: asyncio.Future):
+        self.priority = priority
+        self.group_id = group_id
+        self.deadline = deadline
+        self.future = future
+
+class SlotLease:
+    """An LLM slot request: truthy if granted. The slot is held until release() or the end of the block."""
+
+    __slots__ = ("_scheduler", "group_id", "granted", "_held")
+
+    def __init__(self, scheduler: "LLMScheduler", group_id: str, granted: bool):
+        self._scheduler = scheduler
+        self.group_id = group_id
+        self.granted = granted
+        self._held = granted
+
+    def __bool__(self) -> bool:
+        return self.granted
+
+    def release(self):
+        """Give the slot back early (e.g. once the completion is done but sending is not)."""
+        if self._held:
+            self._held = False
+            self._scheduler._release(self.group_id)
+
+class LLMScheduler:
+    """Admission control for DeepSeek calls.
+
+    Caps concurrent calls globally and per group, grants free slots by priority class
+    (mention > reply > spontaneous > background, FIFO within a class), drops requests whose
+    queue deadline has passed, and sheds background, then spontaneous work once the queue
+    backs up.
+    """
+
+    def __init__(self, max_concurrent: int = 16, per_group_concurrent: int = 2,
+                 deadlines: Optional[Dict[int, float]] = None, shed_queue_depth: int = 32):
+        self.max_concurrent = max_concurrent
+        self.per_group_concurrent = per_group_concurrent
+        self.deadlines = deadlines or {
+            PRIORITY_MENTION: 30.0,
+            PRIORITY_REPLY: 20.0,
+            PRIORITY_SPONTANEOUS: 5.0,
+            PRIORITY_BACKGROUND: 60.0,
+        }
+        self.shed_queue_depth = shed_queue_depth
+
+        self._active = 0
+        self._active_per_group: Dict[str, int] = defaultdict(int)
+        self._queue: List[Any] = []
+        self._sequence = itertools.count()
+        self.granted: Dict[str, int] = defaultdict(int)
+        self.expired: Dict[str, int] = defaultdict(int)
+        self.shed: Dict[str, int] = defaultdict(int)
+
+    def _can_run(self, group_id: str) -> bool:
+        return (self._active < self.max_concurrent and
+                self._active_per_group.get(group_id, 0) < self.per_group_concurrent)
+
+    def _start(self, group_id: str, priority: int):
+        self._active += 1
+        self._active_per_group[group_id] += 1
+        self.granted[PRIORITY_NAMES[priority]] += 1
+
+    def _shed_lowest(self, priority: int) -> bool:
+        """Drop the newest waiting request of the lowest sheddable class below `priority`."""
+        sheddable = [entry for entry in self._queue
+                     if PRIORITY_SPONTANEOUS <= entry[2].priority and priority < entry[2].priority
+                     and not entry[2].future.done()]
+        if not sheddable:
+            return False
+        victim = max(sheddable, key=lambda entry: (entry[0], entry[1]))[2]
+        victim.future.set_result(False)
+        self.shed[PRIORITY_NAMES[victim.priority]] += 1
+        return True
+
+    def _dispatch(self):
+        """Grant free slots to the best eligible waiters."""
+        now = time.monotonic()
+        deferred = []
+        while self._queue and self._active < self.max_concurrent:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.future.done():
+                continue
+            if waiter.deadline < now:
+                waiter.future.set_result(False)
+                self.expired[PRIORITY_NAMES[waiter.priority]] += 1
+                continue
+            if not self._can_run(waiter.group_id):
+                # Group already at its share, let other groups go first
+                deferred.append(entry)
+                continue
+            self._start(waiter.group_id, waiter.priority)
+            waiter.future.set_result(True)
+
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+
+    def _release(self, group_id: str):
+        self._active -= 1
+        self._active_per_group[group_id] -= 1
+        if self._active_per_group[group_id] <= 0:
+            del self._active_per_group[group_id]
+        self._dispatch()
+
+    async def _acquire(self, group_id: str, priority: int) -> bool:
+        """Wait for a slot; returns False if the request was shed or went stale."""
+        if not self._queue and self._can_run(group_id):
+            self._start(group_id, priority)
+            return True
+
+        pending = sum(1 for entry in self._queue if not entry[2].future.done())
+        if pending >= self.shed_queue_depth:
+            if not self._shed_lowest(priority):
+                self.shed[PRIORITY_NAMES[priority]] += 1
+                return False
+
+        deadline = time.monotonic() + self.deadlines.get(priority, 30.0)
+        waiter = _Waiter(priority, group_id, deadline, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        self._dispatch()
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            if not waiter.future.done():
+                waiter.future.set_result(False)
+                self.expired[PRIORITY_NAMES[priority]] += 1
+                return False
+            # Granted right as the deadline hit, keep the slot
+            return waiter.future.result()
+        except asyncio.CancelledError:
+            if waiter.future.done() and waiter.future.result():
+                self._release(group_id)
+            elif not waiter.future.done():
+                waiter.future.set_result(False)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, group_id: str, priority: int) -> AsyncIterator[SlotLease]:
+        """Hold an LLM slot for the block; the lease is falsy if the request was dropped."""
+        lease = SlotLease(self, group_id, await self._acquire(group_id, priority))
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get scheduler queue and admission statistics."""
+        waiting: Dict[str, int] = defaultdict(int)
+        for entry in self._queue:
+            if not entry[2].future.done():
+                waiting[PRIORITY_NAMES[entry[2].priority]] += 1
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queued": dict(waiting),
+            "granted": dict(self.granted),
+            "expired": dict(self.expired),
+            "shed": dict(self.shed)
+        }
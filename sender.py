@@ -0,0 +1,171 @@
+import asyncio
+import random
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from rate_limit import TokenBucket
+from utils import split_message
+
+T = TypeVar("T")
+
+class TelegramSender:
+    """Outbound Telegram requests paced under the flood limits.
+
+    Every request takes a token from a global bucket (`global_rate` per second) and from
+    its chat's bucket (`group_per_minute` in groups, `private_rate` per second in private
+    chats). Requests for one chat go out one at a time in arrival order, so a chat that
+    has to wait does not hold up the others. RetryAfter pauses the chat for the time
+    Telegram asks; network errors are retried with jittered exponential backoff, up to
+    `max_attempts` tries. A timeout is only retried for idempotent requests (edits): a
+    timed-out send may already have been delivered, and retrying it would post the reply
+    twice. Other errors (e.g. BadRequest) are not retried.
+    """
+
+    def __init__(self, global_rate: float = 28.0, global_burst: float = 2.0,
+                 group_per_minute: float = 17.0, group_burst: float = 3.0,
+                 private_rate: float = 1.0, private_burst: float = 3.0,
+                 max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0,
+                 max_length: int = 4096, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.group_rate = group_per_minute / 60
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_length = max_length
+        self.max_chats = max_chats
+
+        # Per chat: [token bucket, lock or None, requests queued or in flight], least recent first
+        self._chats: "OrderedDict[Any, List[Any]]" = OrderedDict()
+        self._waiting = 0
+        self.sent = 0
+        self.retry_after = 0
+        self.network_retries = 0
+        self.failed = 0
+        self.throttled_seconds = 0.0
+
+    def _chat(self, chat_id: Any, private: bool) -> List[Any]:
+        state = self._chats.get(chat_id)
+        if state is None:
+            rate, burst = (self.private_rate, self.private_burst) if private else (self.group_rate, self.group_burst)
+            state = self._chats[chat_id] = [TokenBucket(rate, burst), None, 0]
+            # Forget the least recent idle chats (their buckets would be full again by now)
+            for _ in range(len(self._chats)):
+                if len(self._chats) <= self.max_chats:
+                    break
+                old_id = next(iter(self._chats))
+                if self._chats[old_id][2]:
+                    self._chats.move_to_end(old_id)
+                else:
+                    del self._chats[old_id]
+        else:
+            self._chats.move_to_end(chat_id)
+        return state
+
+    def try_acquire(self, chat_id: Any, private: bool = False) -> bool:
+        """Take a send token for a chat only if one is free right now (e.g. for optional edits)."""
+        bucket = self._chat(chat_id, private)[0]
+        if bucket.delay() > 0 or self.global_bucket.delay() > 0:
+            return False
+        bucket.consume()
+        self.global_bucket.consume()
+        return True
+
+    async def _acquire(self, bucket: TokenBucket):
+        while True:
+            wait = max(bucket.delay(), self.global_bucket.delay())
+            if wait <= 0:
+                bucket.consume()
+                self.global_bucket.consume()
+                return
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    async def _deliver(self, chat_id: Any, bucket: TokenBucket, request: Callable[[], Awaitable[T]],
+                       idempotent: bool = False) -> Optional[T]:
+        """Make one request with pacing and retries. Returns None if it could not be delivered."""
+        for attempt in range(self.max_attempts):
+            await self._acquire(bucket)
+            try:
+                result = await request()
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                # The chat is over its limit: pause it for as long as Telegram asks
+                self.retry_after += 1
+                bucket.tokens = 0
+                delay = float(e.retry_after)
+            except BadRequest as e:
+                print(f"Telegram rejected a message to chat {chat_id}: {e}")
+                break
+            except NetworkError as e:
+                if isinstance(e, TimedOut) and not idempotent:
+                    print(f"Timed out sending to chat {chat_id}, not retrying (it may have been delivered): {e}")
+                    break
+                self.network_retries += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"Error sending to chat {chat_id} (attempt {attempt + 1}): {e}")
+            except Exception as e:
+                print(f"Error sending to chat {chat_id}: {e}")
+                break
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(delay)
+        self.failed += 1
+        return None
+
+    async def _run(self, chat_id: Any, private: bool, requests: List[Callable[[], Awaitable[T]]],
+                   idempotent: bool = False) -> List[T]:
+        """Run a chat's requests back to back in its queue; stops at the first undelivered one."""
+        state = self._chat(chat_id, private)
+        if state[1] is None:
+            state[1] = asyncio.Lock()
+        state[2] += 1
+        self._waiting += 1
+        try:
+            async with state[1]:
+                results = []
+                for request in requests:
+                    result = await self._deliver(chat_id, state[0], request, idempotent)
+                    if result is None:
+                        break
+                    results.append(result)
+                return results
+        finally:
+            state[2] -= 1
+            self._waiting -= 1
+            if state[2] == 0:
+                state[1] = None
+
+    async def call(self, chat_id: Any, request: Callable[[], Awaitable[T]], private: bool = False,
+                   idempotent: bool = False) -> Optional[T]:
+        """Make one Telegram request (send, edit...) for a chat. Returns None if it failed.
+
+        Pass `idempotent=True` for requests that are safe to repeat after a timeout (edits).
+        """
+        results = await self._run(chat_id, private, [request], idempotent)
+        return results[0] if results else None
+
+    async def send(self, chat_id: Any, text: str, send: Callable[[str], Awaitable[T]],
+                   private: bool = False) -> List[T]:
+        """Send text split into Telegram-sized messages with `send(chunk)`, in order.
+
+        Returns the delivered messages (empty if none could be sent).
+        """
+        chunks = split_message(text, self.max_length)
+        return await self._run(chat_id, private, [lambda chunk=chunk: send(chunk) for chunk in chunks])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get send queue statistics."""
+        return {
+            "tracked_chats": len(self._chats),
+            "waiting": self._waiting,
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "network_retries": self.network_retries,
+            "failed": self.failed,
+            "throttled_seconds": round(self.throttled_seconds, 3)
+        }
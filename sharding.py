@@ -0,0 +1,96 @@
+import asyncio
+import multiprocessing
+import queue as queue_module
+import signal
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """Pick the shard that owns a chat (stable across restarts for a fixed shard count)."""
+    return zlib.crc32(str(chat_id).encode("ascii")) % shards
+
+class ShardRouter:
+    """Front dispatcher for a multi-process deployment.
+
+    Starts one worker process per shard and forwards every update, serialized with
+    `Update.to_dict()`, to the worker owning its chat. Each chat is always handled by the
+    same worker, so per-group locks and caches stay process-local; state that must
+    survive restarts (memory, group settings) goes through the shared storage backend.
+    """
+
+    def __init__(self, shards: int, worker_target: Callable[..., None],
+                 worker_args: Tuple[Any, ...] = (), queue_size: int = 10000):
+        # Spawn, not fork: workers must not inherit the dispatcher's sockets or database handles
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue(queue_size) for _ in range(shards)]
+        self.processes = [
+            context.Process(target=worker_target, args=(shard, self.queues[shard]) + tuple(worker_args),
+                            name=f"shard-{shard}", daemon=True)
+            for shard in range(shards)
+        ]
+        self.routed = [0] * shards
+        self.dropped = 0
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def route(self, chat_id: int, data: Dict[str, Any]) -> bool:
+        """Queue a serialized update for its owner shard; False if that shard is backed up."""
+        shard = shard_for(chat_id, len(self.queues))
+        try:
+            self.queues[shard].put_nowait(data)
+        except queue_module.Full:
+            self.dropped += 1
+            return False
+        self.routed[shard] += 1
+        return True
+
+    async def handle_update(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """TypeHandler callback for the dispatcher application."""
+        if isinstance(update, Update) and update.effective_chat is not None:
+            self.route(update.effective_chat.id, update.to_dict())
+
+    def stop(self, timeout: float = 30.0):
+        """Ask workers to finish their queued updates and exit."""
+        for shard_queue in self.queues:
+            shard_queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                print(f"Shard worker {process.name} did not stop in time, terminating")
+                process.terminate()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get routing statistics."""
+        return {
+            "shards": len(self.queues),
+            "routed": list(self.routed),
+            "dropped": self.dropped,
+            "alive": sum(1 for process in self.processes if process.is_alive())
+        }
+
+def ignore_interrupts():
+    """Leave Ctrl+C to the dispatcher, which shuts workers down in order."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+async def consume_shard(shard_queue: Any, handle: Callable[[Dict[str, Any]], Awaitable[None]],
+                        max_batch: int = 100):
+    """Worker side: pass routed updates to `handle` until the dispatcher sends None."""
+    loop = asyncio.get_running_loop()
+    while True:
+        # One blocking get in a thread, then drain whatever else is already queued
+        batch: List[Optional[Dict[str, Any]]] = [await loop.run_in_executor(None, shard_queue.get)]
+        while batch[-1] is not None and len(batch) < max_batch:
+            try:
+                batch.append(shard_queue.get_nowait())
+            except queue_module.Empty:
+                break
+
+        for data in batch:
+            if data is None:
+                return
+            await handle(data)
@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from rate_limit import TokenBucket
+from triggers import TriggerEngine
+from utils import score_spontaneous_reply
+
+class SpontaneousPolicy:
+    """Decides when the bot chimes in on messages nobody addressed to it.
+
+    Every message is scored locally (question marks, length, topic keywords, time since
+    the bot last spoke in the group). A message at or above the mode's threshold spends a
+    token from the group's bucket, which refills at `per_hour` replies per hour up to
+    `burst`, so a busy group gets a few well-placed replies instead of a steady stream of
+    completions. Thresholds and rates are set per mode; a group can override them in its
+    settings ("spontaneous": {mode: {"threshold": ..., "per_hour": ...}}) and replace the
+    topic keywords ("spontaneous_keywords", None means the defaults).
+    """
+
+    def __init__(self, thresholds: Dict[str, float], per_hour: Dict[str, float], burst: float = 2.0,
+                 keywords: Iterable[str] = (), max_keywords: int = 50, quiet_seconds: float = 1800.0,
+                 max_groups: int = 10000):
+        self.thresholds = dict(thresholds)
+        self.per_hour = dict(per_hour)
+        self.burst = burst
+        self.quiet_seconds = quiet_seconds
+        self.max_groups = max_groups
+        self.keywords = TriggerEngine(keywords, max_triggers=max_keywords)
+
+        # Per group: [token bucket, monotonic time the bot last spoke or None], least recent first
+        self._groups: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self.scored = 0
+        self.above_threshold = 0
+        self.rate_limited = 0
+        self.allowed = 0
+
+    def limits(self, mode: str, settings: Optional[Dict[str, Any]] = None) -> Tuple[float, float]:
+        """Get the (threshold, replies per hour) in effect for a group in a mode."""
+        override = ((settings or {}).get("spontaneous") or {}).get(mode) or {}
+        threshold = override.get("threshold", self.thresholds.get(mode, 1.0))
+        per_hour = override.get("per_hour", self.per_hour.get(mode, 0.0))
+        return float(threshold), float(per_hour)
+
+    def keywords_for(self, settings: Optional[Dict[str, Any]] = None) -> Tuple[str, ...]:
+        """Get the topic keywords in effect for a group."""
+        return self.keywords.resolve((settings or {}).get("spontaneous_keywords"))
+
+    def _state(self, group_id: str, now: float, per_hour: Optional[float] = None) -> List[Any]:
+        """Get (or start) a group's state, updating its bucket's rate when one is given."""
+        state = self._groups.get(group_id)
+        if state is None:
+            state = self._groups[group_id] = [TokenBucket((per_hour or 0.0) / 3600, self.burst, now), None]
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+        else:
+            self._groups.move_to_end(group_id)
+            if per_hour is not None:
+                state[0].reconfigure(per_hour / 3600, self.burst, now)
+        return state
+
+    def score(self, group_id: str, text: str, settings: Optional[Dict[str, Any]] = None,
+              replying_to_other: bool = False, now: Optional[float] = None) -> float:
+        """Score a message for a group without spending any budget."""
+        if now is None:
+            now = time.monotonic()
+        state = self._groups.get(group_id)
+        last_spoke = state[1] if state is not None else None
+        return score_spontaneous_reply(
+            text,
+            keyword_hits=self.keywords.count_matches(text, (settings or {}).get("spontaneous_keywords")),
+            seconds_since_bot=None if last_spoke is None else now - last_spoke,
+            replying_to_other=replying_to_other,
+            quiet_seconds=self.quiet_seconds
+        )
+
+    def should_reply(self, group_id: str, mode: str, text: str, settings: Optional[Dict[str, Any]] = None,
+                     replying_to_other: bool = False, now: Optional[float] = None) -> bool:
+        """Decide whether to chime in on a message, spending a token from the group's budget if so."""
+        threshold, per_hour = self.limits(mode, settings)
+        if per_hour <= 0:
+            return False
+        if now is None:
+            now = time.monotonic()
+
+        self.scored += 1
+        if self.score(group_id, text, settings, replying_to_other, now) < threshold:
+            return False
+        self.above_threshold += 1
+
+        bucket = self._state(group_id, now, per_hour)[0]
+        if not bucket.consume(1, now):
+            self.rate_limited += 1
+            return False
+        self.allowed += 1
+        return True
+
+    def record_reply(self, group_id: str, now: Optional[float] = None):
+        """Note that the bot just spoke in a group (any reply, not only spontaneous ones)."""
+        if now is None:
+            now = time.monotonic()
+        state = self._state(group_id, now)
+        state[1] = now
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get spontaneous reply statistics."""
+        return {
+            "tracked_groups": len(self._groups),
+            "scored": self.scored,
+            "above_threshold": self.above_threshold,
+            "rate_limited": self.rate_limited,
+            "allowed": self.allowed
+        }
@@ -0,0 +1,189 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from context_builder import truncate_to_tokens
+from utils import estimate_tokens
+
+# Instructions for folding messages into a group's summary ({max_words} is filled in)
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain the long-term memory of a Telegram group chat. Merge the earlier summary "
+    "and the chat history you are given into one updated summary.\n"
+    "- Keep who is who, ongoing topics, decisions, plans, promises, preferences, running jokes "
+    "and anything someone asked to be remembered.\n"
+    "- Drop greetings and small talk. Prefer recent information when it contradicts older notes.\n"
+    "- Write compact plain-text notes, at most {max_words} words, no preamble."
+)
+
+# Closes the chat history in summary requests (instead of asking for a reply)
+SUMMARY_HISTORY_INSTRUCTION = "These are the messages to fold into the summary; do not reply to them."
+
+def format_summary(summary: str) -> str:
+    """Prompt section carrying a group's summary (appended to the system prompt)."""
+    return "\n\nLONG-TERM MEMORY (summary of earlier messages in this chat):\n" + summary
+
+class RollingSummarizer:
+    """Long-term memory tier: fold messages that leave a group's window into a rolling summary.
+
+    MemoryManager reports messages pushed out of the window through `add()`. They are
+    buffered per group and folded in batches of `batch_size` (or once the oldest has
+    waited `max_delay` seconds) by a background task, off the reply path. The summary
+    lives in the group settings and is capped at `max_summary_tokens`, so it adds a
+    fixed amount to the prompt however long the chat runs. Messages still buffered at
+    shutdown are saved with it (`summary_pending`) and folded in with the group's next batch.
+    """
+
+    def __init__(self, memory, summarize: Callable[[str, str, List[Dict[str, Any]]], Awaitable[Optional[str]]],
+                 batch_size: int = 20, max_delay: float = 600.0, max_summary_tokens: int = 200,
+                 max_pending_messages: int = 100, max_pending_groups: int = 10000,
+                 concurrency: int = 1, count_tokens: Callable[[str], int] = estimate_tokens):
+        self.memory = memory
+        self.summarize = summarize
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_summary_tokens = max_summary_tokens
+        self.max_pending_messages = max_pending_messages
+        self.max_pending_groups = max_pending_groups
+        self.concurrency = concurrency
+        self.count_tokens = count_tokens
+
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_since: Dict[str, float] = {}
+        self._in_flight: Dict[str, bool] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.folds = 0
+        self.folded_messages = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def add(self, group_id: str, messages: List[Dict[str, Any]]):
+        """Buffer messages that left a group's window (MemoryManager.on_overflow)."""
+        pending = self._pending.get(group_id)
+        if pending is None:
+            if len(self._pending) >= self.max_pending_groups:
+                self.dropped += len(messages)
+                return
+            pending = self._pending[group_id] = []
+            self._pending_since[group_id] = time.monotonic()
+        pending.extend(messages)
+
+        # While summaries keep failing, keep only the newest messages
+        if len(pending) > self.max_pending_messages:
+            self.dropped += len(pending) - self.max_pending_messages
+            del pending[:-self.max_pending_messages]
+
+        self._ensure_worker()
+        if len(pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def discard(self, group_id: str):
+        """Forget buffered messages and any fold in flight (the summary itself is in settings)."""
+        self._pending.pop(group_id, None)
+        self._pending_since.pop(group_id, None)
+        self._retry_at.pop(group_id, None)
+        if group_id in self._in_flight:
+            self._in_flight[group_id] = False
+
+    def _ensure_worker(self):
+        """Start the background worker if it isn't running."""
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    def _ready_groups(self) -> List[str]:
+        """Groups with a full batch, or whose oldest buffered message waited max_delay."""
+        now = time.monotonic()
+        return [group_id for group_id, pending in self._pending.items()
+                if group_id not in self._in_flight and self._retry_at.get(group_id, 0) <= now and
+                (len(pending) >= self.batch_size or now - self._pending_since[group_id] >= self.max_delay)]
+
+    async def _run(self):
+        """Fold ready groups, at most `concurrency` at a time."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(1.0, self.max_delay / 4))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            ready = self._ready_groups()
+            for start in range(0, len(ready), self.concurrency):
+                await asyncio.gather(*(self._fold(group_id) for group_id in ready[start:start + self.concurrency]))
+
+    async def _fold(self, group_id: str):
+        """Merge a group's buffered messages into its summary."""
+        batch = self._pending.pop(group_id, None)
+        self._pending_since.pop(group_id, None)
+        if not batch:
+            return
+
+        self._in_flight[group_id] = True
+        try:
+            settings = await self.memory.get_settings(group_id)
+            # Messages saved at the last shutdown go first
+            saved = settings.get("summary_pending") or []
+            messages = (saved + batch)[-self.max_pending_messages:]
+            summary = await self.summarize(group_id, settings.get("summary", ""), messages)
+        except asyncio.CancelledError:
+            # Shutting down: keep the batch so close() can save it
+            if self._in_flight.pop(group_id, False):
+                self._pending[group_id] = (batch + self._pending.get(group_id, []))[-self.max_pending_messages:]
+                self._pending_since.setdefault(group_id, time.monotonic())
+            raise
+        except Exception as e:
+            print(f"Error summarizing memory for group {group_id}: {e}")
+            summary = None
+
+        if not self._in_flight.pop(group_id, False):
+            return  # Discarded (e.g. memory cleared) while the summary was generated
+
+        if not summary:
+            # Put the batch back in front of anything that arrived meanwhile; retried after max_delay
+            self.failures += 1
+            pending = batch + self._pending.get(group_id, [])
+            self.dropped += max(0, len(pending) - self.max_pending_messages)
+            self._pending[group_id] = pending[-self.max_pending_messages:]
+            self._pending_since.setdefault(group_id, time.monotonic())
+            self._retry_at[group_id] = time.monotonic() + self.max_delay
+            return
+
+        self._retry_at.pop(group_id, None)
+        summary = truncate_to_tokens(summary.strip(), self.max_summary_tokens, self.count_tokens)
+        await self.memory.update_settings(group_id, summary=summary, summary_pending=None)
+        self.folds += 1
+        self.folded_messages += len(messages)
+
+    async def close(self):
+        """Stop the background worker and save buffered messages for the next run."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for group_id, pending in list(self._pending.items()):
+            try:
+                settings = await self.memory.get_settings(group_id)
+                saved = settings.get("summary_pending") or []
+                await self.memory.update_settings(
+                    group_id, summary_pending=(saved + pending)[-self.max_pending_messages:]
+                )
+            except Exception as e:
+                print(f"Error saving buffered messages for group {group_id}: {e}")
+        self._pending.clear()
+        self._pending_since.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get summarization statistics."""
+        return {
+            "pending_groups": len(self._pending),
+            "pending_messages": sum(len(pending) for pending in self._pending.values()),
+            "folds": self.folds,
+            "folded_messages": self.folded_messages,
+            "failures": self.failures,
+            "dropped_messages": self.dropped
+        }
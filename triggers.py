@@ -0,0 +1,92 @@
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from telegram import Message, MessageEntity
+
+# Words that summon the bot unless a group configures its own
+DEFAULT_TRIGGERS = ("raiden", "ei")
+
+def normalize_triggers(triggers: Iterable[str]) -> Tuple[str, ...]:
+    """Lowercase, strip a leading '@', drop blanks and duplicates (keeping order)."""
+    normalized = []
+    for trigger in triggers:
+        trigger = trigger.strip().lower().lstrip("@")
+        if trigger and trigger not in normalized:
+            normalized.append(trigger)
+    return tuple(normalized)
+
+def compile_triggers(triggers: Iterable[str]) -> Optional[Pattern]:
+    """Compile triggers into one case-insensitive, whole-word matcher.
+
+    A trigger only matches when it is not glued to other word characters, so
+    "ei" matches "Ei," or "@ei" but not "their" or "being".
+    """
+    words = normalize_triggers(triggers)
+    if not words:
+        return None
+    # Longest first so overlapping triggers prefer the fuller word
+    alternatives = "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)@?(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+class TriggerEngine:
+    """Matches trigger words and Telegram @mentions of the bot itself.
+
+    Groups may carry their own trigger list (kept in group settings, None means the
+    defaults); each distinct list is compiled once and shared by every group using it.
+    """
+
+    def __init__(self, default_triggers: Iterable[str] = DEFAULT_TRIGGERS, max_triggers: int = 20,
+                 max_compiled: int = 1024):
+        self.default_triggers = normalize_triggers(default_triggers)
+        self.max_triggers = max_triggers
+        self.max_compiled = max_compiled
+        self._compiled: Dict[Tuple[str, ...], Optional[Pattern]] = {}
+
+    def resolve(self, triggers: Optional[Iterable[str]] = None) -> Tuple[str, ...]:
+        """Get the trigger words in effect for a group's configured list (capped at max_triggers)."""
+        if triggers is None:
+            return self.default_triggers
+        return normalize_triggers(triggers)[:self.max_triggers]
+
+    def _matcher(self, triggers: Optional[Iterable[str]]) -> Optional[Pattern]:
+        key = self.default_triggers if triggers is None else tuple(triggers)
+        matcher = self._compiled.get(key, False)
+        if matcher is False:
+            if len(self._compiled) >= self.max_compiled:
+                self._compiled.clear()
+            matcher = self._compiled[key] = compile_triggers(self.resolve(key))
+        return matcher
+
+    def matches(self, text: str, triggers: Optional[Iterable[str]] = None) -> bool:
+        """Check whether text contains one of the trigger words."""
+        if not text:
+            return False
+        matcher = self._matcher(triggers)
+        return matcher is not None and matcher.search(text) is not None
+
+    def count_matches(self, text: str, triggers: Optional[Iterable[str]] = None) -> int:
+        """Count the distinct trigger words that appear in text."""
+        if not text:
+            return 0
+        matcher = self._matcher(triggers)
+        if matcher is None:
+            return 0
+        return len({match.lstrip("@").lower() for match in matcher.findall(text)})
+
+    def is_mentioned(self, message: Message, triggers: Optional[Iterable[str]] = None,
+                     bot_username: Optional[str] = None, bot_id: Optional[int] = None) -> bool:
+        """Check a message for a trigger word or a Telegram mention of the bot."""
+        if bot_username or bot_id:
+            handle = f"@{bot_username.lower()}" if bot_username else None
+            for entity in message.entities or ():
+                if entity.type == MessageEntity.MENTION and handle:
+                    if message.parse_entity(entity).lower() == handle:
+                        return True
+                elif entity.type == MessageEntity.TEXT_MENTION and entity.user:
+                    if bot_id is not None and entity.user.id == bot_id:
+                        return True
+        return self.matches(message.text or "", triggers)
+
+def parse_trigger_args(args: List[str]) -> List[str]:
+    """Split command arguments on commas and whitespace."""
+    return [word for arg in args for word in re.split(r"[,\s]+", arg) if word]
@@ -0,0 +1,314 @@
+import asyncio
+import heapq
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Usage counters kept for every group, user, mode and (group, user) pair
+_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cache_hit_tokens")
+
+class UsageTracker:
+    """Token accounting per group, user and mode, with rolling quotas.
+
+    Each completion's `usage` is added to lifetime totals for its mode, group, user and
+    (group, user) pair, and to the rolling windows of its group and user: `buckets` time
+    buckets spanning `group_window` / `user_window` seconds. A quota of 0 means no limit.
+    `check()` runs before a completion is requested, so a call that starts under quota may
+    finish above it by at most one response.
+
+    Totals are kept in memory (the least recently used beyond `max_tracked` are dropped)
+    and written to `path` as JSON every `flush_interval` seconds when they changed.
+    With `peer_paths` (the files of other worker processes), peers' usage is re-read at the
+    same interval and counted in user quotas and in the all-chats report, so those lag the
+    other workers by up to two intervals.
+    """
+
+    def __init__(self, path: Optional[str] = None, user_quota: int = 0, user_window: float = 3600.0,
+                 group_quota: int = 0, group_window: float = 86400.0, buckets: int = 24,
+                 flush_interval: float = 60.0, max_tracked: int = 100000,
+                 peer_paths: Optional[List[str]] = None):
+        self.path = path
+        self.peer_paths = peer_paths or []
+        self.quotas = {"user": user_quota, "group": group_quota}
+        self.windows = {"user": user_window, "group": group_window}
+        self.bucket_seconds = {scope: window / buckets for scope, window in self.windows.items()}
+        self.flush_interval = flush_interval
+        self.max_tracked = max_tracked
+
+        # "group:<id>", "user:<id>", "member:<group>:<user>" -> counters, least recent first
+        self._totals: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Per mode (never evicted; "summary" for background calls)
+        self._modes: Dict[str, Dict[str, int]] = {}
+        # "group:<id>", "user:<id>" -> {bucket number: tokens}
+        self._windows: Dict[str, Dict[int, int]] = {}
+        self._notified_until: Dict[str, float] = {}
+        # Persisted usage of the other worker processes, by path
+        self._peers: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._dirty = False
+        self._writer: Optional[asyncio.Task] = None
+        self.rejected = {"user": 0, "group": 0}
+
+    def _load(self):
+        """Read persisted usage once, on first use."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not Path(self.path).exists():
+            return
+        try:
+            data = json.loads(Path(self.path).read_text(encoding="utf-8"))
+            self._totals = OrderedDict(data.get("totals", {}))
+            self._modes = data.get("modes", {})
+            self._windows = {key: {int(bucket): tokens for bucket, tokens in buckets.items()}
+                             for key, buckets in data.get("windows", {}).items()}
+        except Exception as e:
+            print(f"Error loading usage from {self.path}: {e}")
+
+    def _entry(self, key: str) -> Dict[str, Any]:
+        entry = self._totals.get(key)
+        if entry is None:
+            entry = self._totals[key] = dict.fromkeys(_FIELDS, 0)
+            while len(self._totals) > self.max_tracked:
+                old_key, _ = self._totals.popitem(last=False)
+                self._windows.pop(old_key, None)
+        else:
+            self._totals.move_to_end(key)
+        return entry
+
+    def _window_buckets(self, scope: str, key: str, now: float) -> Dict[int, int]:
+        """A group's or user's buckets within its rolling window, with peers' usage for users."""
+        oldest = int((now - self.windows[scope]) // self.bucket_seconds[scope]) + 1
+        buckets = self._windows.get(key)
+        if buckets:
+            for bucket in [bucket for bucket in buckets if bucket < oldest]:
+                del buckets[bucket]
+        if scope != "user" or not self._peers:
+            return buckets or {}
+        merged = dict(buckets or {})
+        for peer in self._peers.values():
+            for bucket, tokens in peer.get("windows", {}).get(key, {}).items():
+                bucket = int(bucket)
+                if bucket >= oldest:
+                    merged[bucket] = merged.get(bucket, 0) + tokens
+        return merged
+
+    def _window_tokens(self, scope: str, key: str, now: float) -> int:
+        """Tokens a group or user used within its rolling window (expired buckets are pruned)."""
+        return sum(self._window_buckets(scope, key, now).values())
+
+    def _retry_after(self, scope: str, key: str, now: float) -> float:
+        """Seconds until enough old buckets expire to bring a key back under its quota."""
+        buckets = self._window_buckets(scope, key, now)
+        used = sum(buckets.values())
+        for bucket in sorted(buckets):
+            used -= buckets[bucket]
+            if used < self.quotas[scope]:
+                # The bucket leaves the window once it is older than _window_buckets' cutoff
+                expires = bucket * self.bucket_seconds[scope] + self.windows[scope]
+                return max(0.0, expires - now)
+        return 0.0
+
+    def record(self, group_id: str, user_id: Optional[str], mode: str, usage: Dict[str, Any],
+               name: Optional[str] = None, now: Optional[float] = None):
+        """Add one completion's token usage (user_id None for calls nobody asked for)."""
+        self.record_shared(group_id, [(user_id, name)] if user_id is not None else [], mode, usage, now)
+
+    def record_shared(self, group_id: str, users: List[Tuple[str, Optional[str]]], mode: str,
+                      usage: Dict[str, Any], now: Optional[float] = None):
+        """Add one completion's token usage, split evenly between the (user_id, name) pairs
+        that asked for it (e.g. the senders of coalesced triggers)."""
+        if not usage:
+            return
+        self._load()
+        if now is None:
+            now = time.time()
+        prompt = usage.get("prompt_tokens", 0) or 0
+        completion = usage.get("completion_tokens", 0) or 0
+        cache_hit = usage.get("prompt_cache_hit_tokens", 0) or 0
+
+        for entry in (self._modes.setdefault(mode, dict.fromkeys(_FIELDS, 0)), self._entry(f"group:{group_id}")):
+            entry["calls"] += 1
+            entry["prompt_tokens"] += prompt
+            entry["completion_tokens"] += completion
+            entry["cache_hit_tokens"] += cache_hit
+        self._add_window("group", f"group:{group_id}", prompt + completion, now)
+
+        count = len(users)
+        for index, (user_id, name) in enumerate(users):
+            # Even shares; the first user also takes the remainders so they add up to the total
+            first = index == 0
+            share_prompt = prompt // count + (prompt % count if first else 0)
+            share_completion = completion // count + (completion % count if first else 0)
+            for key in (f"user:{user_id}", f"member:{group_id}:{user_id}"):
+                entry = self._entry(key)
+                if name:
+                    entry["name"] = name
+                entry["calls"] += 1
+                entry["prompt_tokens"] += share_prompt
+                entry["completion_tokens"] += share_completion
+                entry["cache_hit_tokens"] += cache_hit // count + (cache_hit % count if first else 0)
+            self._add_window("user", f"user:{user_id}", share_prompt + share_completion, now)
+
+        self._dirty = True
+        self._ensure_writer()
+
+    def _add_window(self, scope: str, key: str, tokens: int, now: float):
+        bucket = int(now // self.bucket_seconds[scope])
+        buckets = self._windows.setdefault(key, {})
+        buckets[bucket] = buckets.get(bucket, 0) + tokens
+
+    def check(self, group_id: str, user_id: Optional[str] = None,
+              now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Check the quotas before a completion.
+
+        Returns None when the call may go ahead, otherwise the exhausted scope ("user" or
+        "group"), the seconds until it frees up and whether to tell the chat (once per
+        exhaustion, so repeated attempts don't each get a notice).
+        """
+        self._load()
+        if self.peer_paths:
+            self._ensure_writer()
+        if now is None:
+            now = time.time()
+        for scope, key in (("user", f"user:{user_id}"), ("group", f"group:{group_id}")):
+            quota = self.quotas[scope]
+            if quota <= 0 or (scope == "user" and user_id is None):
+                continue
+            if self._window_tokens(scope, key, now) < quota:
+                continue
+            self.rejected[scope] += 1
+            retry_after = self._retry_after(scope, key, now)
+            notify = self._notified_until.get(key, 0) <= now
+            if notify:
+                self._notified_until[key] = now + retry_after
+                if len(self._notified_until) > self.max_tracked:
+                    self._notified_until = {k: until for k, until in self._notified_until.items() if until > now}
+            return {"scope": scope, "retry_after": retry_after, "notify": notify}
+        return None
+
+    def report(self, group_id: Optional[str] = None, top: int = 5, now: Optional[float] = None) -> Dict[str, Any]:
+        """Usage of one group (with its top users), or across all groups (top groups and users)."""
+        self._load()
+        if now is None:
+            now = time.time()
+
+        totals = self._totals if group_id is not None else self._merged("totals", self._totals)
+
+        def ranked(prefix: str) -> List[Dict[str, Any]]:
+            entries = heapq.nlargest(
+                top, ((key, entry) for key, entry in totals.items() if key.startswith(prefix)),
+                key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"]
+            )
+            return [dict(entry, id=key[len(prefix):]) for key, entry in entries]
+
+        if group_id is not None:
+            key = f"group:{group_id}"
+            return {
+                "totals": dict(self._totals.get(key) or dict.fromkeys(_FIELDS, 0)),
+                "window_tokens": self._window_tokens("group", key, now),
+                "window_seconds": self.windows["group"],
+                "quota": self.quotas["group"],
+                "top_users": ranked(f"member:{group_id}:"),
+            }
+        modes = self._merged("modes", self._modes)
+        return {
+            "totals": {field: sum(entry.get(field, 0) for entry in modes.values()) for field in _FIELDS},
+            "modes": {mode: dict(entry) for mode, entry in modes.items()},
+            "top_groups": ranked("group:"),
+            "top_users": ranked("user:"),
+        }
+
+    def _merged(self, section: str, own: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """This process's totals or modes with the peers' added."""
+        if not self._peers:
+            return own
+        merged = {key: dict(entry) for key, entry in own.items()}
+        for peer in self._peers.values():
+            for key, entry in peer.get(section, {}).items():
+                target = merged.setdefault(key, dict.fromkeys(_FIELDS, 0))
+                for field in _FIELDS:
+                    target[field] += entry.get(field, 0)
+                if entry.get("name") and not target.get("name"):
+                    target["name"] = entry["name"]
+        return merged
+
+    def _ensure_writer(self):
+        """Start the periodic writer if usage is persisted and it isn't running."""
+        if self.path and (self._writer is None or self._writer.done()):
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        while True:
+            await self.refresh_peers()
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _read_peers_sync(self) -> Dict[str, Dict[str, Any]]:
+        peers = {}
+        for peer_path in self.peer_paths:
+            try:
+                if Path(peer_path).exists():
+                    peers[peer_path] = json.loads(Path(peer_path).read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"Error loading usage from {peer_path}: {e}")
+                if peer_path in self._peers:
+                    peers[peer_path] = self._peers[peer_path]
+        return peers
+
+    async def refresh_peers(self):
+        """Re-read the other worker processes' persisted usage."""
+        if self.peer_paths:
+            self._peers = await asyncio.get_running_loop().run_in_executor(None, self._read_peers_sync)
+
+    def _write_sync(self, content: str):
+        path = Path(self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(content, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    async def flush(self):
+        """Persist usage now if it changed."""
+        if not self.path or not self._dirty:
+            return
+        self._dirty = False
+        content = json.dumps({
+            "totals": self._totals,
+            "modes": self._modes,
+            "windows": {key: {str(bucket): tokens for bucket, tokens in buckets.items()}
+                        for key, buckets in self._windows.items()}
+        }, ensure_ascii=False)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_sync, content)
+        except Exception as e:
+            self._dirty = True
+            print(f"Error saving usage to {self.path}: {e}")
+
+    async def close(self):
+        """Stop the writer and persist what changed."""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        await self.flush()
+
+    def get_totals(self, mode: Optional[str] = None) -> Dict[str, int]:
+        """Lifetime counters of one mode, or of all modes together."""
+        if mode is not None:
+            return dict(self._modes.get(mode) or dict.fromkeys(_FIELDS, 0))
+        return {field: sum(entry.get(field, 0) for entry in self._modes.values()) for field in _FIELDS}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get accounting statistics."""
+        return {
+            "tracked_keys": len(self._totals),
+            "modes": sorted(self._modes),
+            "rejected": dict(self.rejected)
+        }
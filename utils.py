@@ -1,8 +1,12 @@
 import re
-import random
+import math
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 
+from triggers import DEFAULT_TRIGGERS, compile_triggers
+
+_DEFAULT_TRIGGER_PATTERN = compile_triggers(DEFAULT_TRIGGERS)
+
 def format_timestamp(timestamp: Optional[datetime] = None) -> str:
     """Format timestamp to ISO format with timezone."""
     if timestamp is None:
@@ -19,18 +23,10 @@ def extract_username(user) -> str:
         return f"user_{user.id}"
 
 def is_bot_mentioned(text: str) -> bool:
-    """Check if bot is mentioned in the message."""
+    """Check if bot is mentioned in the message (default trigger words, whole words only)."""
     if not text:
         return False
-    
-    text_lower = text.lower()
-    triggers = ['raiden', 'ei', '@raiden', '@ei']
-    
-    for trigger in triggers:
-        if trigger in text_lower:
-            return True
-    
-    return False
+    return _DEFAULT_TRIGGER_PATTERN.search(text) is not None
 
 def extract_target_from_reply(message) -> Optional[str]:
     """Extract target username from reply."""
@@ -38,9 +34,31 @@ def extract_target_from_reply(message) -> Optional[str]:
         return extract_username(message.reply_to_message.from_user)
     return None
 
-def should_spontaneous_reply() -> bool:
-    """2% chance for spontaneous reply."""
-    return random.random() < 0.02
+def score_spontaneous_reply(text: str, keyword_hits: int = 0, seconds_since_bot: Optional[float] = None,
+                            replying_to_other: bool = False, quiet_seconds: float = 1800.0) -> float:
+    """Cheap local estimate (0 to 1) of how worthwhile it is to chime in on a message.
+
+    Questions, messages with some substance and topic keywords score up; the score
+    recovers over `quiet_seconds` after the bot last spoke, and messages replying to
+    another member score down. Very short messages ("lol", "ok") score 0.
+    """
+    if not text:
+        return 0.0
+    tokens = estimate_tokens(text)
+    if tokens < 4:
+        return 0.0
+
+    score = 0.25 * min(1.0, (tokens - 3) / 15)
+    if "?" in text or "？" in text:
+        score += 0.35
+    score += min(0.3, 0.15 * keyword_hits)
+    if seconds_since_bot is None:
+        score += 0.15
+    else:
+        score += 0.15 * min(1.0, max(0.0, seconds_since_bot) / quiet_seconds) if quiet_seconds > 0 else 0.15
+    if replying_to_other:
+        score -= 0.25
+    return max(0.0, min(1.0, score))
 
 def find_message_by_id(messages: List[Dict[str, Any]], message_id: int) -> Optional[Dict[str, Any]]:
     """Find a message in the history by its ID."""
@@ -56,6 +74,21 @@ def format_reply_context(original_message: Dict[str, Any]) -> str:
                 f"that said: \"{original_message['message']}\"]")
     return ""
 
+def split_message(text: str, limit: int = 4096) -> List[str]:
+    """Split text into Telegram-sized chunks, preferring newline and space boundaries."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
 def clean_message_for_api(messages: list) -> str:
     """Convert message history to a readable format for the API."""
     context_lines = []
@@ -68,6 +101,75 @@ def clean_message_for_api(messages: list) -> str:
     
     return "\n".join(context_lines)
 
+COMPACT_HISTORY_HEADER = (
+    "RECENT CHAT HISTORY (one message per line: #message_id [HH:MM] sender → target ↩#replied_to_id: text). "
+    "Long usernames appear once as name[alias] and afterwards only as the alias."
+)
+
+def format_history_compact(messages: List[Dict[str, Any]], alias_min_length: int = 9) -> str:
+    """Serialize history one line per message with reply markers and short user aliases.
+
+    Lines only depend on earlier messages, so extending the history never changes the
+    lines already rendered.
+    """
+    aliases = {}
+    lines = []
+
+    def name_of(username: Optional[str]) -> str:
+        if not username or len(username) < alias_min_length:
+            return username or ""
+        if username in aliases:
+            return aliases[username]
+        aliases[username] = f"u{len(aliases) + 1}"
+        return f"{username}[{aliases[username]}]"
+
+    for msg in messages:
+        line = f"#{msg.get('message_id', '?')}"
+        timestamp = msg.get('timestamp')
+        if timestamp and len(timestamp) >= 16:
+            line += f" [{timestamp[11:16]}]"
+        line += f" {name_of(msg.get('username'))}"
+        if msg.get('target'):
+            line += f" → {name_of(msg['target'])}"
+        if msg.get('reply_to_message_id'):
+            line += f" ↩#{msg['reply_to_message_id']}"
+        line += f": {msg.get('message', '')}"
+        lines.append(line)
+
+    return "\n".join(lines)
+
+_TOKEN_PIECE = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"  # CJK
+    r"|[^\W\d_]+"  # words
+    r"|\d+"  # numbers
+    r"|\s+"  # whitespace runs
+    r"|[^\w\s]+|_+"  # punctuation and symbol runs
+)
+
+def estimate_tokens(text: str) -> int:
+    """Estimate DeepSeek tokens without a tokenizer.
+
+    Calibrated on DeepSeek's published ratios (about 0.3 tokens per English character and
+    0.6 per Chinese character). Whitespace runs such as indentation count as one token.
+    """
+    if not text:
+        return 0
+
+    tokens = 0.0
+    for piece in _TOKEN_PIECE.findall(text):
+        first = piece[0]
+        if first.isspace():
+            tokens += 1 if len(piece) > 1 or first == "\n" else 0
+        elif first.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif len(piece) == 1 and ord(first) >= 0x3040:
+            tokens += 0.6
+        elif first.isalpha():
+            tokens += max(1.0, len(piece) * 0.3) if first.isascii() else len(piece) * 0.6
+        else:
+            tokens += math.ceil(len(piece) / 2)
+    return max(1, round(tokens))
+
 def validate_mode(mode: str) -> bool:
     """Validate if the provided mode is supported."""
     return mode.lower() in ["chat", "assistant"]
@@ -78,7 +180,7 @@ def get_mode_description(mode: str) -> str:
         "chat": (
             "**Chat Mode**: Raiden Ei personality\n"
             "• 30 message memory\n"
-            "• Spontaneous replies (2% chance)\n"
+            "• Spontaneous replies (when relevant, rate-limited)\n"
             "• Goddess-like personality\n"
             "• Short, impactful responses (1-3 sentences)"
         ),
@@ -105,11 +207,14 @@ def format_mode_switch_message(old_mode: str, new_mode: str) -> str:
             "I'm now your helpful assistant. How can I help you today?"
         )
 
-def should_respond_in_mode(mode: str, is_mentioned: bool, is_reply: bool, spontaneous_chance: bool = False) -> bool:
-    """Determine if bot should respond based on mode and triggers."""
+def should_respond_in_mode(mode: str, is_mentioned: bool, is_reply: bool, spontaneous: bool = False) -> bool:
+    """Determine if bot should respond based on mode and triggers.
+
+    `spontaneous` is the spontaneous-reply policy's decision for the message.
+    """
     if mode == "chat":
         # Chat mode: respond to mentions, replies, and sometimes spontaneously
-        return is_mentioned or is_reply or (spontaneous_chance and should_spontaneous_reply())
+        return is_mentioned or is_reply or spontaneous
     else:  # assistant mode
         # Assistant mode: only respond to direct engagement
         return is_mentioned or is_reply
\ No newline at end of file